@@ -0,0 +1,303 @@
+# backfill.py
+"""
+Повторный анализ сохраненных сообщений после смены модели или промпта.
+
+Сообщения читаются пачками в порядке сохранения (rowid), анализируются
+ограниченным числом параллельных запросов к LLM и перезаписывают анализ
+с новыми model и prompt_version. Уже актуальные анализы пропускаются.
+
+Прогресс сохраняется в таблице backfill_state: после падения или Ctrl+C
+повторный запуск продолжает с места остановки. Контрольная точка не
+проходит дальше первого сообщения с ошибкой, поэтому при следующем запуске
+оно анализируется снова; после --max-failures ошибок подряд (например,
+Ollama недоступна) запуск останавливается. Скорость ограничивается
+(--workers, --rate), чтобы не отнимать Ollama у живого мониторинга.
+
+    python backfill.py --workers 2 --rate 0.5
+"""
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+from logger import get_logger
+import config
+
+logger = get_logger()
+
+
+class _RateLimiter:
+    """Не больше per_second запусков в секунду; 0 - без ограничения."""
+
+    def __init__(self, per_second: float):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        delay = self._next - now
+        self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Backfill:
+    def __init__(
+        self,
+        analyzer,
+        data_manager,
+        name: str = "default",
+        workers: int = config.BACKFILL_WORKERS,
+        rate: float = config.BACKFILL_MAX_PER_SECOND,
+        batch_size: int = 100,
+        limit: int = 0,
+        force: bool = False,
+        restart: bool = False,
+        progress_seconds: float = 10.0,
+        max_failures: int = config.BACKFILL_MAX_CONSECUTIVE_FAILURES,
+    ):
+        self.analyzer = analyzer
+        self.data_manager = data_manager
+        self.name = name
+        self.workers = max(workers, 1)
+        self.limiter = _RateLimiter(rate)
+        self.batch_size = batch_size
+        self.limit = limit
+        self.force = force
+        self.restart = restart
+        self.progress_seconds = progress_seconds
+        self.max_failures = max_failures
+        self.model = analyzer.model_version
+        self.prompt_version = analyzer.prompt_version
+        self.counts = {"updated": 0, "failed": 0, "skipped": 0}
+        self.total = 0
+        self._started = 0.0
+        # Сообщения в порядке rowid, еще не вошедшие в контрольную точку:
+        # None - выполняется, True - завершено, False - ошибка. Контрольная
+        # точка - последний rowid, до которого все сообщения завершены
+        # успешно; на первой ошибке она останавливается до конца запуска
+        self._in_flight: Dict[int, Optional[bool]] = {}
+        self._watermark = 0
+        self._processed_before = 0
+        self._consecutive_failures = 0
+        self.aborted = False
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    def _resume_point(self) -> int:
+        checkpoint = self.data_manager.get_backfill_checkpoint(self.name)
+        if checkpoint is None or self.restart:
+            return 0
+        if (checkpoint["model"], checkpoint["prompt_version"]) != (
+            self.model,
+            self.prompt_version,
+        ):
+            logger.info(
+                f"Контрольная точка '{self.name}' сделана для {checkpoint['model']} / "
+                f"{checkpoint['prompt_version']}, начинаем заново."
+            )
+            return 0
+        self._processed_before = checkpoint["processed"]
+        logger.info(
+            f"Продолжаем '{self.name}' после rowid {checkpoint['last_rowid']} "
+            f"(уже обработано {checkpoint['processed']})."
+        )
+        return checkpoint["last_rowid"]
+
+    def _checkpoint(self):
+        self.data_manager.set_backfill_checkpoint(
+            self.name,
+            self._watermark,
+            self.model,
+            self.prompt_version,
+            self._processed_before + self.done,
+        )
+
+    def _finish(self, rowid: int, ok: bool):
+        self._in_flight[rowid] = ok
+        for pending, finished in list(self._in_flight.items()):
+            if not finished:
+                break
+            del self._in_flight[pending]
+            self._watermark = pending
+        if ok:
+            self._consecutive_failures = 0
+            return
+        self._consecutive_failures += 1
+        if (
+            self.max_failures
+            and self._consecutive_failures >= self.max_failures
+            and not self.aborted
+        ):
+            self.aborted = True
+            logger.error(
+                f"Повторный анализ остановлен: {self._consecutive_failures} ошибок "
+                f"подряд. Контрольная точка оставлена на rowid {self._watermark}."
+            )
+
+    async def _process(self, row: Dict[str, Any]) -> str:
+        text = row["text"] or self.data_manager.get_message_text(
+            row["channel_id"], row["message_id"]
+        )
+        if not text:
+            return "skipped"
+        analysis = await self.analyzer.analyze_message(text)
+        if analysis is None:
+            return "failed"
+        saved = self.data_manager.save_analysis(
+            row["channel_id"], row["message_id"], analysis
+        )
+        return "updated" if saved else "failed"
+
+    async def _worker(self, row: Dict[str, Any], semaphore: asyncio.Semaphore):
+        try:
+            result = await self._process(row)
+        except Exception as e:
+            logger.error(
+                f"Ошибка повторного анализа сообщения {row['message_id']} "
+                f"из '{row['channel_id']}': {e}"
+            )
+            result = "failed"
+        finally:
+            semaphore.release()
+        self.counts[result] += 1
+        self._finish(row["rowid"], result != "failed")
+
+    def _report(self):
+        elapsed = time.monotonic() - self._started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total - self.done, 0)
+        eta = timedelta(seconds=int(remaining / rate)) if rate > 0 else "?"
+        percent = self.done / self.total if self.total else 1.0
+        logger.info(
+            f"Backfill: {self.done}/{self.total} ({percent:.1%}), "
+            f"{rate:.2f} сообщ./с, осталось ~{eta} "
+            f"(обновлено {self.counts['updated']}, ошибок {self.counts['failed']}, "
+            f"пропущено {self.counts['skipped']})"
+        )
+
+    async def _progress(self):
+        while True:
+            await asyncio.sleep(self.progress_seconds)
+            self._report()
+            self._checkpoint()
+
+    async def run(self) -> Dict[str, int]:
+        after = self._watermark = self._resume_point()
+        self.total = self.data_manager.count_backfill_pending(
+            after, self.model, self.prompt_version, self.force
+        )
+        if self.limit:
+            self.total = min(self.total, self.limit)
+        logger.info(
+            f"Повторный анализ {self.total} сообщений моделью {self.model} "
+            f"(промпт {self.prompt_version}), параллельно {self.workers}."
+        )
+        self._started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.workers)
+        tasks = set()
+        progress = asyncio.create_task(self._progress())
+        started = 0
+        try:
+            while not self.limit or started < self.limit:
+                batch = self.data_manager.get_backfill_batch(
+                    after,
+                    self.model,
+                    self.prompt_version,
+                    limit=self.batch_size,
+                    force=self.force,
+                )
+                if not batch:
+                    break
+                for row in batch:
+                    if self.limit and started >= self.limit or self.aborted:
+                        break
+                    await self.limiter.wait()
+                    await semaphore.acquire()
+                    if self.aborted:
+                        semaphore.release()
+                        break
+                    self._in_flight[row["rowid"]] = None
+                    task = asyncio.create_task(self._worker(row, semaphore))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    started += 1
+                if self.aborted:
+                    break
+                after = batch[-1]["rowid"]
+            await asyncio.gather(*tasks)
+        finally:
+            progress.cancel()
+            # Сохраняется только успешно завершенный префикс: прерванные
+            # и неудачные сообщения будут проанализированы при следующем запуске
+            self._checkpoint()
+        self._report()
+        return dict(self.counts)
+
+
+def main(argv: Optional[list] = None) -> int:
+    # Импорты здесь: без Telethon и бота из services
+    from storage import create_storage
+    from llm_analyzer import OllamaAnalyzer
+
+    parser = argparse.ArgumentParser(
+        description="Повторный анализ сохраненных сообщений текущей моделью и промптом"
+    )
+    parser.add_argument("--workers", type=int, default=config.BACKFILL_WORKERS)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=config.BACKFILL_MAX_PER_SECOND,
+        help="Не больше сообщений в секунду (0 - без ограничения)",
+    )
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=0, help="0 - все сообщения")
+    parser.add_argument("--name", default="default", help="Имя контрольной точки")
+    parser.add_argument(
+        "--force", action="store_true", help="Анализировать и актуальные анализы"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="Игнорировать контрольную точку"
+    )
+    parser.add_argument("--progress-seconds", type=float, default=10.0)
+    parser.add_argument(
+        "--max-failures",
+        type=int,
+        default=config.BACKFILL_MAX_CONSECUTIVE_FAILURES,
+        help="Остановиться после стольких ошибок подряд (0 - не останавливаться)",
+    )
+    args = parser.parse_args(argv)
+
+    data_manager = create_storage()
+    analyzer = OllamaAnalyzer()
+    # Повторный анализ имеет смысл только результатами LLM
+    analyzer.fallback = None
+    backfill = Backfill(
+        analyzer,
+        data_manager,
+        name=args.name,
+        workers=args.workers,
+        rate=args.rate,
+        batch_size=args.batch_size,
+        limit=args.limit,
+        force=args.force,
+        restart=args.restart,
+        progress_seconds=args.progress_seconds,
+        max_failures=args.max_failures,
+    )
+    try:
+        counts = asyncio.run(backfill.run())
+    except KeyboardInterrupt:
+        logger.info("Повторный анализ прерван, прогресс сохранен.")
+        return 130
+    finally:
+        data_manager.close()
+    return 0 if not counts["failed"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
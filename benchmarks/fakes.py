@@ -0,0 +1,125 @@
+# benchmarks/fakes.py
+"""
+Поддельные Telegram-компоненты для офлайн-бенчмарка.
+
+FakeTelegramMonitor повторяет интерфейс TelegramMonitor и "публикует"
+посты с заданной частотой. RecordingBot повторяет нужную часть
+aiogram.Bot и запоминает время каждой отправки.
+"""
+import asyncio
+import math
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+_WORDS = (
+    "правительство объявило новые меры поддержки экономики регионов "
+    "в результате происшествия пострадали несколько человек спасатели "
+    "сборная выиграла матч чемпионата ученые представили технологию "
+    "выставка откроется в музее на следующей неделе общество обсуждает"
+).split()
+
+_LINK_RE = re.compile(r"https://t\.me/([^/\s]+)/(\d+)")
+
+
+class FakeTelegramMonitor:
+    """Источник постов с заданной частотой публикации в каждом канале."""
+
+    def __init__(
+        self,
+        channel_ids: List[str],
+        posts_per_channel: int,
+        posts_per_second: float,
+        text_length: int = 400,
+        seed: int = 0,
+    ):
+        self.channel_ids = channel_ids
+        self.posts_per_channel = posts_per_channel
+        self.posts_per_second = posts_per_second
+        self.text_length = text_length
+        self._random = random.Random(seed)
+        self.started: Optional[float] = None
+        self.fetch_calls = 0
+        self.recent_calls = 0
+
+    async def connect(self) -> bool:
+        self.started = time.monotonic()
+        return True
+
+    async def disconnect(self):
+        pass
+
+    def published_at(self, message_id: int) -> float:
+        """Монотонное время публикации поста с указанным ID."""
+        return self.started + (message_id - 1) / self.posts_per_second
+
+    def _available(self) -> int:
+        elapsed = time.monotonic() - self.started
+        return min(
+            self.posts_per_channel, math.floor(elapsed * self.posts_per_second) + 1
+        )
+
+    def _text(self, channel_id: str, message_id: int) -> str:
+        words = [f"Новость {message_id} канала {channel_id}."]
+        length = len(words[0])
+        while length < self.text_length:
+            word = self._random.choice(_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words) + "."
+
+    async def get_new_messages(
+        self, channel_id: str, last_message_id: int = 0
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        self.fetch_calls += 1
+        await asyncio.sleep(0)
+        last = max(min(self._available(), last_message_id + 100), last_message_id)
+        posts = [
+            {
+                "id": message_id,
+                "text": self._text(channel_id, message_id),
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime()),
+                "channel_id": channel_id,
+                "channel_title": f"Канал {channel_id}",
+                "channel_username": channel_id,
+                "is_forward": False,
+            }
+            for message_id in range(last_message_id + 1, last + 1)
+        ]
+        return posts, last
+
+    async def get_recent_posts(
+        self, channel_id: str, limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        # Посты в бенчмарке не редактируются: проверка правок только
+        # обращается к источнику и ничего не находит
+        self.recent_calls += 1
+        await asyncio.sleep(0)
+        return []
+
+    async def get_initial_last_message_id(self, channel_id: str) -> int:
+        # Ноль: бенчмарк обрабатывает все посты с самого начала
+        return 0
+
+
+class RecordingBot:
+    """Минимальная замена aiogram.Bot, записывающая отправленные сообщения."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent: List[Tuple[float, int, str]] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append((time.monotonic(), chat_id, text))
+
+    def deliveries(self) -> List[Tuple[float, str, int]]:
+        """(время доставки, канал, ID поста) для каждой отправки."""
+        result = []
+        for sent_at, _, text in self.sent:
+            match = _LINK_RE.search(text)
+            if match:
+                result.append((sent_at, match.group(1), int(match.group(2))))
+        return result
@@ -0,0 +1,273 @@
+# benchmarks/run_benchmark.py
+"""
+Офлайн end-to-end бенчмарк конвейера обработки новостей.
+
+Запускает настоящие MonitoringService, хранилище, маршрутизацию
+подписчиков и NotificationWorker, подменяя только внешние системы:
+Telethon (FakeTelegramMonitor), Ollama (StubOllamaServer) и Bot API
+(RecordingBot). Выводит пропускную способность, перцентили задержки
+"публикация -> доставка" и потребление памяти.
+
+Пример:
+    python -m benchmarks.run_benchmark --channels 3 --posts 100 --subscribers 200
+
+Как регрессионный тест:
+    python -m benchmarks.run_benchmark --json bench.json
+    python -m benchmarks.run_benchmark --baseline bench.json --tolerance 0.1
+
+С хранилищем в PostgreSQL (база должна быть пустой):
+    python -m benchmarks.run_benchmark --database-url postgresql://localhost/bench
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--posts", type=int, default=50, help="Постов в канале")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1000.0,
+        help="Постов в секунду на канал (большое значение - все посты сразу)",
+    )
+    parser.add_argument("--text-length", type=int, default=400)
+    parser.add_argument("--subscribers", type=int, default=100)
+    parser.add_argument("--llm-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--classifier-model",
+        default="",
+        help="Включить каскад моделей с этой моделью для классификации",
+    )
+    parser.add_argument("--classifier-latency", type=float, default=0.01)
+    parser.add_argument("--llm-token-delay", type=float, default=0.0)
+    parser.add_argument("--bad-json-rate", type=float, default=0.05)
+    parser.add_argument("--send-latency", type=float, default=0.005)
+    parser.add_argument("--poll-interval", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Сохранить результат в JSON-файл")
+    parser.add_argument("--baseline", help="JSON-результат для сравнения")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Допустимое ухудшение относительно baseline (доля)",
+    )
+    parser.add_argument(
+        "--database-url",
+        help="Пустая база PostgreSQL (postgresql://...) вместо временной SQLite",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Не глушить логи")
+    return parser.parse_args()
+
+
+def _configure_environment(args: argparse.Namespace, workdir: str):
+    """Настраивает окружение до импорта модулей проекта (config читает env)."""
+    channels = ",".join(f"bench_{i}" for i in range(args.channels))
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_TOKEN": "123456:BENCHMARK",
+            "TELEGRAM_API_ID": "1",
+            "TELEGRAM_API_HASH": "benchmark",
+            "TELEGRAM_CHANNEL_IDS": channels,
+            "TAVILY_API_KEY": "benchmark",
+            "DATABASE_URL": args.database_url
+            or os.path.join(workdir, "data", "storage.db"),
+            "METRICS_ENABLED": "false",
+            "NOTIFY_BACKOFF_BASE_SECONDS": "0.05",
+            "OLLAMA_CLASSIFIER_MODEL": args.classifier_model,
+        }
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def _run(args: argparse.Namespace, ollama) -> Dict[str, Any]:
+    import config
+    import monitoring_service
+    from benchmarks.fakes import FakeTelegramMonitor, RecordingBot
+    from notification_worker import NotificationWorker
+    from services import data_manager, subscriber_router
+
+    # CHECK_INTERVAL в env целочисленный, а бенчмарку нужны доли секунды
+    config.CHECK_INTERVAL_SECONDS = args.poll_interval
+
+    for chat_id in range(1, args.subscribers + 1):
+        await subscriber_router.add_subscriber(chat_id)
+
+    fake_monitor = FakeTelegramMonitor(
+        config.TELEGRAM_CHANNEL_IDS,
+        posts_per_channel=args.posts,
+        posts_per_second=args.rate,
+        text_length=args.text_length,
+        seed=args.seed,
+    )
+    bot = RecordingBot(latency=args.send_latency)
+    worker = NotificationWorker(bot=bot)
+    service = monitoring_service.MonitoringService(
+        bot=bot, notification_worker=worker, monitor=fake_monitor
+    )
+
+    total_posts = args.channels * args.posts
+    started = time.monotonic()
+    tasks = [
+        asyncio.create_task(service.run()),
+        asyncio.create_task(worker.run()),
+    ]
+    try:
+        while True:
+            await asyncio.sleep(0.05)
+            done = all(
+                data_manager.get_last_message_id(channel) >= args.posts
+                for channel in config.TELEGRAM_CHANNEL_IDS
+            )
+            if done and data_manager.count_pending_notifications() == 0:
+                break
+            if time.monotonic() - started > args.timeout:
+                raise TimeoutError("Бенчмарк не завершился за отведенное время")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finished = time.monotonic()
+
+    deliveries = bot.deliveries()
+    latencies = [
+        sent_at - fake_monitor.published_at(message_id)
+        for sent_at, _, message_id in deliveries
+    ]
+    elapsed = (max(d[0] for d in deliveries) if deliveries else finished) - started
+    analyzed = sum(
+        monitoring_service.MESSAGES_PROCESSED.get(channel, "analyzed")
+        for channel in config.TELEGRAM_CHANNEL_IDS
+    )
+    save_failed = sum(
+        monitoring_service.MESSAGES_PROCESSED.get(channel, "save_failed")
+        for channel in config.TELEGRAM_CHANNEL_IDS
+    )
+    return {
+        "posts": total_posts,
+        "analyzed": int(analyzed),
+        "save_failed": int(save_failed),
+        "deliveries": len(deliveries),
+        "elapsed_seconds": round(elapsed, 3),
+        "messages_per_second": round(total_posts / elapsed, 3) if elapsed else 0.0,
+        "deliveries_per_second": (
+            round(len(deliveries) / elapsed, 3) if elapsed else 0.0
+        ),
+        "latency_p50": round(percentile(latencies, 0.50), 4),
+        "latency_p90": round(percentile(latencies, 0.90), 4),
+        "latency_p99": round(percentile(latencies, 0.99), 4),
+        "latency_max": round(max(latencies), 4) if latencies else 0.0,
+        "llm_requests": ollama.requests,
+        "llm_repair_requests": ollama.repair_requests,
+        "telegram_fetch_calls": fake_monitor.fetch_calls,
+        "telegram_edit_check_calls": fake_monitor.recent_calls,
+    }
+
+
+def _compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float):
+    """Возвращает список регрессий относительно baseline."""
+    failures = []
+    if result["messages_per_second"] < baseline["messages_per_second"] * (
+        1 - tolerance
+    ):
+        failures.append(
+            f"пропускная способность {result['messages_per_second']} < "
+            f"{baseline['messages_per_second']} (-{tolerance:.0%})"
+        )
+    if result["latency_p99"] > baseline["latency_p99"] * (1 + tolerance):
+        failures.append(
+            f"p99 задержки {result['latency_p99']} > "
+            f"{baseline['latency_p99']} (+{tolerance:.0%})"
+        )
+    return failures
+
+
+def main() -> int:
+    args = _parse_args()
+    workdir = tempfile.mkdtemp(prefix="newsbot_bench_")
+    _configure_environment(args, workdir)
+    port = _free_port()
+    os.environ["OLLAMA_BASE_URL"] = f"http://127.0.0.1:{port}"
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # Логи и файл сессии Telethon создаются относительно рабочей директории
+    os.chdir(workdir)
+
+    # Модули проекта читают окружение при импорте, а services создает
+    # сервисы (включая проверку Ollama), поэтому порядок импортов важен
+    from benchmarks.stub_ollama import StubOllamaServer
+    from llm_analyzer import NEWS_CATEGORIES, SENTIMENTS
+    from logger import get_logger
+
+    if not args.verbose:
+        get_logger().setLevel(logging.WARNING)
+
+    ollama = StubOllamaServer(
+        NEWS_CATEGORIES,
+        SENTIMENTS,
+        latency=args.llm_latency,
+        model_latency=(
+            {args.classifier_model: args.classifier_latency}
+            if args.classifier_model
+            else None
+        ),
+        token_delay=args.llm_token_delay,
+        bad_json_rate=args.bad_json_rate,
+        seed=args.seed,
+        port=port,
+    )
+    ollama.start()
+
+    tracemalloc.start()
+    try:
+        result = asyncio.run(_run(args, ollama))
+    finally:
+        ollama.stop()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result["tracemalloc_peak_mb"] = round(peak / 2**20, 2)
+    result["max_rss_mb"] = round(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2
+    )
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failures = _compare(result, json.load(f), args.tolerance)
+        if failures:
+            print("РЕГРЕССИЯ: " + "; ".join(failures), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# benchmarks/stub_ollama.py
+"""
+Заглушка Ollama HTTP API (/api/generate) для офлайн-бенчмарка.
+
+Сервер работает в отдельном потоке со своим event loop: OllamaAnalyzer
+при создании делает синхронный запрос, который иначе заблокировал бы
+основной цикл. Латентность и доля "сломанного" JSON настраиваются.
+"""
+import asyncio
+import json
+import random
+import threading
+from typing import Dict, List, Optional
+from aiohttp import web
+
+# Варианты поломок, которые встречаются в ответах реальных моделей
+BROKEN_VARIANTS = ("trailing_comma", "single_quotes", "truncated", "prose")
+
+
+class StubOllamaServer:
+    def __init__(
+        self,
+        categories: List[str],
+        sentiments: List[str],
+        latency: float = 0.2,
+        model_latency: Optional[Dict[str, float]] = None,
+        token_delay: float = 0.0,
+        bad_json_rate: float = 0.0,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.categories = categories
+        self.sentiments = sentiments
+        self.latency = latency
+        # Отдельная латентность для моделей каскада (например, малой)
+        self.model_latency = model_latency or {}
+        self.token_delay = token_delay
+        self.bad_json_rate = bad_json_rate
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.repair_requests = 0
+        self._random = random.Random(seed)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _answer(self, prompt: str) -> str:
+        """Формирует ответ модели: корректный JSON или одну из типичных поломок."""
+        summary = f"Краткое содержание новости ({len(prompt)} символов промпта)."
+        # Каскад моделей: summary обычным текстом, классификация - без summary
+        if prompt.startswith("Сделай краткое"):
+            return summary
+        data = {
+            "summary": summary,
+            "sentiment": self._random.choice(self.sentiments),
+            "hashtags": self._random.sample(self.categories, 2),
+        }
+        if prompt.startswith("Определи тональность"):
+            del data["summary"]
+        text = json.dumps(data, ensure_ascii=False)
+        is_repair = prompt.startswith("Исправь ответ")
+        if is_repair:
+            self.repair_requests += 1
+        if is_repair or self._random.random() >= self.bad_json_rate:
+            return text
+        variant = self._random.choice(BROKEN_VARIANTS)
+        if variant == "trailing_comma":
+            return text[:-1] + ",}"
+        if variant == "single_quotes":
+            return text.replace('"', "'")
+        if variant == "truncated":
+            return text[: len(text) // 2]
+        return "Конечно! Вот анализ этой новости: тональность скорее нейтральная."
+
+    async def _handle_generate(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        prompt = payload.get("prompt") or ""
+        self.requests += 1
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        # Имитация обработки промпта (prompt eval)
+        await asyncio.sleep(self.model_latency.get(payload.get("model"), self.latency))
+        answer = self._answer(prompt)
+        chunks = [answer[i : i + 8] for i in range(0, len(answer), 8)]
+        try:
+            for chunk in chunks:
+                line = {"model": payload.get("model"), "response": chunk, "done": False}
+                await response.write((json.dumps(line) + "\n").encode("utf-8"))
+                if self.token_delay:
+                    await asyncio.sleep(self.token_delay)
+            final = {
+                "model": payload.get("model"),
+                "response": "",
+                "done": True,
+                "prompt_eval_count": len(prompt) // 3,
+                "eval_count": len(chunks),
+            }
+            await response.write((json.dumps(final) + "\n").encode("utf-8"))
+            await response.write_eof()
+        except ConnectionResetError:
+            # Клиент прервал генерацию, получив закрытый JSON-объект
+            pass
+        return response
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post("/api/generate", self._handle_generate)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start())
+        self._ready.set()
+        self._loop.run_forever()
+
+    def start(self) -> str:
+        """Запускает сервер в фоновом потоке и возвращает его базовый URL."""
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self.base_url
+
+    def stop(self):
+        if not self._loop:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop)
+        future.result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
@@ -0,0 +1,173 @@
+# benchmarks/webhook_load.py
+"""
+Нагрузочная проверка бота в режиме вебхука без Telegram.
+
+Скрипт отправляет на вебхук запущенного бота поддельные обновления
+(сообщения с командой от разных пользователей) и одновременно изображает
+Bot API, на который бот отправляет ответы. Выводит коды ответов вебхука,
+перцентили времени ответа и число полученных от бота сообщений.
+
+Пример (бот и скрипт в разных терминалах):
+    APP_ROLE=bot BOT_MODE=webhook WEBHOOK_SECRET=test \\
+        TELEGRAM_BOT_API_URL=http://127.0.0.1:8081 python main.py
+    python -m benchmarks.webhook_load --secret test --api-port 8081 --updates 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+import aiohttp
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram/webhook")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--text", default="/help", help="Текст сообщений")
+    parser.add_argument(
+        "--api-port",
+        type=int,
+        default=8081,
+        help="Порт поддельного Bot API (TELEGRAM_BOT_API_URL бота)",
+    )
+    parser.add_argument(
+        "--wait", type=float, default=10.0, help="Сколько ждать ответов бота"
+    )
+    return parser.parse_args()
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """Обновление с личным сообщением пользователя, как его присылает Telegram."""
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    entities = []
+    if text.startswith("/"):
+        entities.append(
+            {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+        )
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {
+                "id": user_id,
+                "type": "private",
+                "first_name": user["first_name"],
+            },
+            "from": user,
+            "text": text,
+            "entities": entities,
+        },
+    }
+
+
+class StubBotApi:
+    """Отвечает на вызовы Bot API и считает отправленные ботом сообщения."""
+
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self.replies = 0
+        self._message_id = 0
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.calls[method] += 1
+        result: Any = True
+        if method.lower() in ("sendmessage", "editmessagetext"):
+            self.replies += 1
+            self._message_id += 1
+            chat_id = int(data.get("chat_id", 0))
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data.get("text", ""),
+            }
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, port: int) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+
+async def _run(args: argparse.Namespace) -> Dict[str, Any]:
+    api = StubBotApi()
+    runner = await api.start(args.api_port)
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def post(session: aiohttp.ClientSession, update_id: int):
+        update = make_update(update_id, 1 + update_id % args.users, args.text)
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                async with session.post(
+                    args.url, json=update, headers={SECRET_HEADER: args.secret}
+                ) as response:
+                    statuses[str(response.status)] += 1
+            except aiohttp.ClientError as e:
+                statuses[type(e).__name__] += 1
+                return
+            latencies.append(time.monotonic() - started)
+
+    try:
+        started = time.monotonic()
+        async with aiohttp.ClientSession() as session:
+            await asyncio.gather(
+                *(post(session, i) for i in range(1, args.updates + 1))
+            )
+        posted = time.monotonic() - started
+        # Бот отвечает после того, как вебхук вернул 200
+        deadline = time.monotonic() + args.wait
+        while api.replies < statuses["200"] and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.monotonic() - started
+    finally:
+        await runner.cleanup()
+
+    return {
+        "updates": args.updates,
+        "statuses": dict(statuses),
+        "updates_per_second": round(args.updates / posted, 1) if posted else 0.0,
+        "response_p50": round(percentile(latencies, 0.50), 4),
+        "response_p99": round(percentile(latencies, 0.99), 4),
+        "replies": api.replies,
+        "replies_per_second": round(api.replies / elapsed, 1) if elapsed else 0.0,
+        "api_calls": dict(api.calls),
+    }
+
+
+def main() -> int:
+    args = _parse_args()
+    result = asyncio.run(_run(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result["statuses"].get("200") == args.updates else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
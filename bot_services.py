@@ -1,26 +1,88 @@
 # bot_services.py
-from aiogram import Dispatcher, types, F
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, CommandObject
 from aiogram.enums import ParseMode
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from services import (
     data_manager,
     llm_analyzer,
+    loop_watchdog,
+    model_keeper,
+    subscriber_registry,
+    subscriber_router,
     tavily_search,
+    trend_detector,
 )
+from subscriber_router import FILTER_CHANNEL, FILTER_HASHTAG, FILTER_SENTIMENT
+from llm_analyzer import NEWS_CATEGORIES, SENTIMENTS
+from sampling_profiler import SamplingProfiler
+from export import EXPORT_FORMATS, export_to_file
+from trend_detector import KIND_HASHTAG, KIND_TERM
+from rate_limiter import RATE_LIMIT_FLAG, RateLimitMiddleware, call_directly
 import config
 from logger import get_logger
 
 logger = get_logger()
 dp = Dispatcher()
 
+# Лимиты и объединение одинаковых запросов для обработчиков с флагом rate_limit
+if config.RATE_LIMIT_ENABLED:
+    dp.message.middleware(RateLimitMiddleware())
+
+# Профилировщик создается заранее, но поток сэмплирования существует
+# только между /profile start и /profile stop
+profiler = SamplingProfiler(interval=config.PROFILE_INTERVAL_MS / 1000)
+_profile_task: Optional[asyncio.Task] = None
+
+# Лимит Telegram Bot API на отправку файла ботом
+TELEGRAM_UPLOAD_LIMIT = 50 * 2**20
+
+# Короткие коды типов фильтров для callback_data (лимит Telegram - 64 байта)
+FILTER_MENU = {
+    "h": (FILTER_HASHTAG, "🏷 Темы", NEWS_CATEGORIES),
+    "c": (FILTER_CHANNEL, "📢 Каналы", config.TELEGRAM_CHANNEL_IDS),
+    "s": (FILTER_SENTIMENT, "🎭 Тональность", SENTIMENTS),
+}
+
 
 def get_subscription_keyboard(chat_id: int):
     builder = InlineKeyboardBuilder()
-    if data_manager.is_subscriber(chat_id):
+    if subscriber_registry.is_subscriber(chat_id):
         builder.button(text="✅ Отписаться от уведомлений", callback_data="unsubscribe")
+        builder.button(text="⚙️ Фильтры уведомлений", callback_data="filters")
     else:
         builder.button(text="🔔 Подписаться на уведомления", callback_data="subscribe")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def get_filters_keyboard():
+    """Меню выбора типа фильтра."""
+    builder = InlineKeyboardBuilder()
+    for code, (_, title, _) in FILTER_MENU.items():
+        builder.button(text=title, callback_data=f"filters:{code}")
+    builder.button(text="⬅️ Назад", callback_data="filters:back")
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def get_filter_values_keyboard(chat_id: int, code: str):
+    """Список значений фильтра с отметками выбранных."""
+    kind, _, options = FILTER_MENU[code]
+    selected = subscriber_router.get_filters(chat_id, kind)
+    builder = InlineKeyboardBuilder()
+    for i, option in enumerate(options):
+        mark = "✅ " if option in selected else ""
+        builder.button(text=f"{mark}{option}", callback_data=f"flt:{code}:{i}")
+    all_mark = "✅ " if not selected else ""
+    builder.button(text=f"{all_mark}Все", callback_data=f"fltclr:{code}")
+    builder.button(text="⬅️ Назад", callback_data="filters")
+    builder.adjust(1)
     return builder.as_markup()
 
 
@@ -50,10 +112,10 @@ async def process_callback_subscribe(callback_query: types.CallbackQuery):
     # Получаем ID чата. Это может быть ID пользователя (в личке) или ID группы.
     chat_id = callback_query.message.chat.id
 
-    if data_manager.is_subscriber(chat_id):
+    if subscriber_registry.is_subscriber(chat_id):
         await callback_query.answer("Этот чат уже подписан!")
     else:
-        data_manager.add_subscriber(chat_id)
+        await subscriber_router.add_subscriber(chat_id)
         await callback_query.answer("✅ Чат успешно подписан на уведомления!")
         # Обновляем клавиатуру, чтобы показать кнопку "Отписаться"
         await callback_query.message.edit_reply_markup(
@@ -72,10 +134,10 @@ async def process_callback_unsubscribe(callback_query: types.CallbackQuery):
     # Получаем ID чата. Это может быть ID пользователя (в личке) или ID группы.
     chat_id = callback_query.message.chat.id
 
-    if not data_manager.is_subscriber(chat_id):
+    if not subscriber_registry.is_subscriber(chat_id):
         await callback_query.answer("Этот чат и так не подписан.")
     else:
-        data_manager.remove_subscriber(chat_id)
+        await subscriber_router.remove_subscriber(chat_id)
         await callback_query.answer("✅ Чат успешно отписан от уведомлений.")
         # Обновляем клавиатуру, чтобы показать кнопку "Подписаться"
         await callback_query.message.edit_reply_markup(
@@ -83,6 +145,64 @@ async def process_callback_unsubscribe(callback_query: types.CallbackQuery):
         )
 
 
+@dp.callback_query(lambda c: c.data and c.data.startswith("filters"))
+async def process_callback_filters(callback_query: types.CallbackQuery):
+    """Навигация по меню фильтров подписки."""
+    if not callback_query.message:
+        await callback_query.answer("Не удалось определить чат.", show_alert=True)
+        return
+
+    chat_id = callback_query.message.chat.id
+    if not subscriber_registry.is_subscriber(chat_id):
+        await callback_query.answer("Сначала подпишитесь на уведомления.")
+        return
+
+    _, _, code = callback_query.data.partition(":")
+    if code == "back":
+        markup = get_subscription_keyboard(chat_id)
+    elif code in FILTER_MENU:
+        markup = get_filter_values_keyboard(chat_id, code)
+    else:
+        markup = get_filters_keyboard()
+    await callback_query.answer()
+    await callback_query.message.edit_reply_markup(reply_markup=markup)
+
+
+@dp.callback_query(lambda c: c.data and c.data.startswith("flt"))
+async def process_callback_filter_toggle(callback_query: types.CallbackQuery):
+    """Включает/выключает значение фильтра или сбрасывает фильтр целиком."""
+    if not callback_query.message:
+        await callback_query.answer("Не удалось определить чат.", show_alert=True)
+        return
+
+    chat_id = callback_query.message.chat.id
+    if not subscriber_registry.is_subscriber(chat_id):
+        await callback_query.answer("Сначала подпишитесь на уведомления.")
+        return
+
+    action, code, *rest = callback_query.data.split(":")
+    if code not in FILTER_MENU:
+        await callback_query.answer()
+        return
+    kind, _, options = FILTER_MENU[code]
+
+    if action == "fltclr":
+        await subscriber_router.clear_filters(chat_id, kind)
+        await callback_query.answer("Фильтр сброшен: будут приходить все новости.")
+    else:
+        try:
+            value = options[int(rest[0])]
+        except (IndexError, ValueError):
+            await callback_query.answer("Неизвестное значение фильтра.")
+            return
+        enabled = await subscriber_router.toggle_filter(chat_id, kind, value)
+        await callback_query.answer(f"{'Добавлено' if enabled else 'Убрано'}: {value}")
+
+    await callback_query.message.edit_reply_markup(
+        reply_markup=get_filter_values_keyboard(chat_id, code)
+    )
+
+
 @dp.message(Command("help"))
 async def cmd_help(message: types.Message):
     """Отправляет приветственное сообщение со списком команд."""
@@ -91,6 +211,7 @@ async def cmd_help(message: types.Message):
         "/help - Показать это сообщение\n"
         "/status - Показать статус системы\n"
         "/stats - Показать статистику анализа\n"
+        "/trends - Темы, набирающие популярность за последний час\n"
         "/subscribe - Управление подпиской на уведомления\n"
         "/chat `<текст>` - Пообщаться с LLM\n"
         "/web `<запрос>` - Поиск в интернете\n"
@@ -114,21 +235,197 @@ async def cmd_subscribe(message: types.Message):
 @dp.message(Command("status"))
 async def cmd_status(message: types.Message):
     """Показывает статус компонентов системы."""
+    loop = loop_watchdog.stats()
+    healthy, _ = loop_watchdog.health()
+    models = f"`{config.OLLAMA_MODEL}`"
+    if config.OLLAMA_CLASSIFIER_MODEL:
+        models += f", классификация: `{config.OLLAMA_CLASSIFIER_MODEL}`"
+    latency = llm_analyzer.latency_stats()
+    warm, cold = latency["warm"], latency["cold"]
+    if config.APP_ROLE == "bot":
+        # Модели прогревает процесс мониторинга, здесь его состояния нет
+        keeper_line = "• **В памяти Ollama:** см. процесс мониторинга\n"
+        latency_title = "Задержка LLM (команды бота)"
+    else:
+        keeper = model_keeper.status()
+        keeper_line = (
+            f"• **В памяти Ollama:** {', '.join(keeper['resident']) or 'нет'} "
+            f"(прогрев {'включен' if keeper['keep_warm'] else 'выключен'}, "
+            f"прогноз {keeper['expected_posts']:.1f} постов/ч)\n"
+        )
+        latency_title = "Задержка LLM"
     status_text = (
-        "✅ **Статус системы:**\n\n"
+        f"{'✅' if healthy else '⚠️'} **Статус системы:**\n\n"
         "• **Бот:** Онлайн\n"
-        f"• **Мониторинг канала:** `{config.TELEGRAM_CHANNEL_ID}`\n"
-        f"• **LLM модель:** `{config.OLLAMA_MODEL}`"
+        f"• **Мониторинг каналов:** `{', '.join(config.TELEGRAM_CHANNEL_IDS)}`\n"
+        f"• **LLM модель:** {models}\n"
+        f"{keeper_line}"
+        f"• **{latency_title}:** прогретая p50 {warm['p50']:.2f} с, "
+        f"макс. {warm['max']:.2f} с ({warm['count']}); "
+        f"холодный старт p50 {cold['p50']:.2f} с, "
+        f"макс. {cold['max']:.2f} с ({cold['count']})\n"
+        f"• **Event loop:** задержка {loop['last_lag'] * 1000:.1f} мс, "
+        f"p99 {loop['p99_lag'] * 1000:.1f} мс, "
+        f"макс. {loop['max_lag'] * 1000:.1f} мс за {loop['window_seconds']:.0f} с, "
+        f"блокировок: {loop['stalls']}"
     )
     await message.answer(status_text, parse_mode=ParseMode.MARKDOWN)
 
 
+def is_admin(user: Optional[types.User]) -> bool:
+    return user is not None and user.id in config.ADMIN_USER_IDS
+
+
+async def _send_profile(bot: Bot, chat_id: int):
+    """Останавливает профилировщик и отправляет результат документом."""
+    elapsed = profiler.elapsed()
+    collapsed = profiler.stop()
+    if not collapsed:
+        await bot.send_message(chat_id, "⚠️ Профилировщик не собрал ни одного сэмпла.")
+        return
+    filename = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.collapsed"
+    await bot.send_document(
+        chat_id,
+        types.BufferedInputFile(collapsed.encode("utf-8"), filename=filename),
+        caption=(
+            f"🔥 Сэмплов: {profiler.samples} за {elapsed:.1f} с.\n"
+            "Откройте файл в speedscope.app или flamegraph.pl."
+        ),
+    )
+
+
+async def _finish_profile(bot: Bot, chat_id: int, duration: float):
+    global _profile_task
+    try:
+        await asyncio.sleep(duration)
+        await _send_profile(bot, chat_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при отправке профиля: {e}", exc_info=True)
+    finally:
+        if _profile_task is asyncio.current_task():
+            _profile_task = None
+
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message, command: CommandObject):
+    """Запускает и останавливает сэмплирующий профилировщик (только для админов)."""
+    global _profile_task
+    if not is_admin(message.from_user):
+        await message.answer("⛔ Команда доступна только администраторам.")
+        return
+
+    args = (command.args or "").split()
+    action = args[0].lower() if args else ""
+    if action == "start":
+        if profiler.running:
+            await message.answer(
+                "Профилировщик уже запущен. Остановите его: /profile stop"
+            )
+            return
+        try:
+            duration = (
+                float(args[1]) if len(args) > 1 else config.PROFILE_DEFAULT_SECONDS
+            )
+        except ValueError:
+            await message.answer("Длительность должна быть числом секунд.")
+            return
+        duration = max(1.0, min(duration, config.PROFILE_MAX_SECONDS))
+        profiler.start(duration)
+        _profile_task = asyncio.create_task(
+            _finish_profile(message.bot, message.chat.id, duration)
+        )
+        logger.info(f"Профилирование запущено пользователем {message.from_user.id}.")
+        await message.answer(
+            f"▶️ Профилирование запущено на {duration:.0f} с. Досрочно: /profile stop"
+        )
+    elif action == "stop":
+        if not profiler.running:
+            await message.answer("Профилировщик не запущен.")
+            return
+        if _profile_task:
+            _profile_task.cancel()
+            _profile_task = None
+        await _send_profile(message.bot, message.chat.id)
+    else:
+        await message.answer(
+            "Использование: /profile start `[секунды]` | /profile stop",
+            parse_mode=ParseMode.MARKDOWN,
+        )
+
+
+@dp.message(Command("export"))
+async def cmd_export(message: types.Message, command: CommandObject):
+    """Выгружает сообщения и анализы файлом (только для админов)."""
+    if not is_admin(message.from_user):
+        await message.answer("⛔ Команда доступна только администраторам.")
+        return
+
+    usage = (
+        "Использование: /export `[csv|jsonl|parquet]` `[days=N]` `[channel=...]` "
+        "`[sentiment=...]` `[tag=...]`"
+    )
+    fmt = "jsonl"
+    days = config.EXPORT_DEFAULT_DAYS
+    filters = {"channel": [], "sentiment": [], "tag": []}
+    for arg in (command.args or "").split():
+        key, sep, value = arg.partition("=")
+        if not sep and key.lower() in EXPORT_FORMATS:
+            fmt = key.lower()
+        elif key == "days" and value.isdigit():
+            days = int(value)
+        elif key in filters and value:
+            filters[key].append(value)
+        else:
+            await message.answer(usage, parse_mode=ParseMode.MARKDOWN)
+            return
+
+    await message.bot.send_chat_action(
+        chat_id=message.chat.id, action="upload_document"
+    )
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+    filename = f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}{EXPORT_FORMATS[fmt]}"
+    fd, path = tempfile.mkstemp(suffix=EXPORT_FORMATS[fmt])
+    os.close(fd)
+    try:
+        # Выгрузка блокирующая: выполняется в отдельном потоке
+        count = await asyncio.to_thread(
+            export_to_file,
+            data_manager,
+            path,
+            fmt,
+            date_from=since,
+            channels=filters["channel"],
+            sentiments=filters["sentiment"],
+            tags=filters["tag"],
+        )
+        size = os.path.getsize(path)
+        if size > TELEGRAM_UPLOAD_LIMIT:
+            await message.answer(
+                f"⚠️ Файл выгрузки ({size / 2**20:.1f} МБ) больше лимита Telegram. "
+                "Сузьте фильтры или используйте `python export.py`.",
+                parse_mode=ParseMode.MARKDOWN,
+            )
+            return
+        await message.answer_document(
+            types.FSInputFile(path, filename=filename),
+            caption=f"📤 Сообщений: {count} за {days} дн.",
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке: {e}", exc_info=True)
+        await message.answer(f"❌ Не удалось выгрузить данные: {e}")
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
 @dp.message(Command("stats"))
 async def cmd_stats(message: types.Message):
     """Показывает статистику анализа."""
     await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
     try:
-        stats = data_manager.get_statistics()
+        stats = await data_manager.aio.get_statistics()
         if not stats or stats.get("total_messages", 0) == 0:
             await message.answer(
                 "😔 Пока нет данных для статистики. Мониторинг еще не обработал ни одного сообщения."
@@ -154,8 +451,38 @@ async def cmd_stats(message: types.Message):
         await message.answer("❌ Произошла ошибка при получении статистики.")
 
 
-@dp.message(Command("chat"))
-async def cmd_chat(message: types.Message, command: CommandObject):
+@dp.message(Command("trends"))
+async def cmd_trends(message: types.Message):
+    """Показывает темы, резко участившиеся за последнее окно (без запросов к базе)."""
+    window = config.TRENDS_WINDOW_SECONDS / 60
+    sections = []
+    for kind, title, prefix in (
+        (KIND_HASHTAG, "🏷️ **Хэштеги:**", "#"),
+        (KIND_TERM, "📰 **Сюжеты:**", ""),
+    ):
+        trends = trend_detector.trends(kind, limit=10)
+        if trends:
+            lines = [
+                f"`{prefix}{t['topic']}` - {t['count']} (обычно {t['baseline']:.1f}, "
+                f"z={t['z']:.1f})"
+                for t in trends
+            ]
+            sections.append(f"{title}\n" + "\n".join(lines))
+    if not sections:
+        await message.answer(
+            f"🤷 За последние {window:.0f} мин. всплесков тем не замечено."
+        )
+        return
+    await message.answer(
+        f"📈 **Тренды за последние {window:.0f} мин.:**\n\n" + "\n\n".join(sections),
+        parse_mode=ParseMode.MARKDOWN,
+    )
+
+
+@dp.message(Command("chat"), flags={RATE_LIMIT_FLAG: "chat"})
+async def cmd_chat(
+    message: types.Message, command: CommandObject, coalesce=call_directly
+):
     """Общается с LLM."""
     if not command.args:
         await message.answer("Пожалуйста, напишите что-нибудь после команды `/chat`")
@@ -163,12 +490,14 @@ async def cmd_chat(message: types.Message, command: CommandObject):
     text = command.args
 
     await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
-    response = await llm_analyzer.get_chat_response(text)
+    response = await coalesce(lambda: llm_analyzer.get_chat_response(text))
     await message.answer(response)
 
 
-@dp.message(Command("analyze"))
-async def cmd_analyze(message: types.Message, command: CommandObject):
+@dp.message(Command("analyze"), flags={RATE_LIMIT_FLAG: "analyze"})
+async def cmd_analyze(
+    message: types.Message, command: CommandObject, coalesce=call_directly
+):
     """Анализирует произвольный текст."""
     if not command.args:
         await message.answer(
@@ -180,7 +509,7 @@ async def cmd_analyze(message: types.Message, command: CommandObject):
     await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
     progress_message = await message.answer("🔍 Анализирую текст...")
 
-    analysis = await llm_analyzer.analyze_message(text_to_analyze)
+    analysis = await coalesce(lambda: llm_analyzer.analyze_message(text_to_analyze))
 
     if analysis and analysis.summary:
         hashtags_str = (
@@ -199,8 +528,10 @@ async def cmd_analyze(message: types.Message, command: CommandObject):
         )
 
 
-@dp.message(Command("web"))
-async def cmd_web(message: types.Message, command: CommandObject):
+@dp.message(Command("web"), flags={RATE_LIMIT_FLAG: "web"})
+async def cmd_web(
+    message: types.Message, command: CommandObject, coalesce=call_directly
+):
     """Выполняет поиск в интернете."""
     if not command.args:
         await message.answer("Пожалуйста, укажите поисковый запрос: `/web <запрос>`")
@@ -212,7 +543,7 @@ async def cmd_web(message: types.Message, command: CommandObject):
         f'🔍 Ищу информацию по запросу: "{query}"...'
     )
 
-    search_results = await tavily_search.search(query)
+    search_results = await coalesce(lambda: tavily_search.search(query))
 
     if search_results is None:
         await progress_message.edit_text(
@@ -236,12 +567,12 @@ async def cmd_web(message: types.Message, command: CommandObject):
     )
 
 
-@dp.message(F.chat.type == "private")
-async def handle_non_command(message: types.Message):
+@dp.message(F.chat.type == "private", flags={RATE_LIMIT_FLAG: "chat"})
+async def handle_non_command(message: types.Message, coalesce=call_directly):
     """
     Обрабатывает сообщения без команд как чат с LLM, но только в личных чатах.
     """
     if message.text and not message.text.startswith("/"):
         await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
-        response = await llm_analyzer.get_chat_response(message.text)
+        response = await coalesce(lambda: llm_analyzer.get_chat_response(message.text))
         await message.answer(response)
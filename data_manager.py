@@ -1,22 +1,91 @@
 # data_manager.py
 import sqlite3
 import os
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from logger import get_logger
 import config
 import json
 from collections import Counter
+import metrics
+from storage import StorageBackend
 
 logger = get_logger()
 
+DB_WRITE_SECONDS = metrics.Histogram(
+    "newsbot_db_write_seconds",
+    "Длительность операций записи в хранилище",
+    ["operation"],
+)
+
+# Версия схемы хранится в PRAGMA user_version.
+# 2: сообщения и анализы ключуются парой (channel_id, message_id)
+# 3: флаг degraded у анализов, выполненных локальным классификатором
+# 4: модель и версия промпта у анализов (для повторного анализа backfill.py)
+# 5: метаданные вложений у сообщений (альбомы и медиа с подписью)
+# 6: отслеживание правок: время правки поста и ID отправленных уведомлений
+SCHEMA_VERSION = 6
+
+MESSAGES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        channel_id TEXT NOT NULL,
+        message_id INTEGER NOT NULL,
+        text TEXT, -- NULL, если текст перенесен в архив
+        date TEXT NOT NULL,
+        archived_at TEXT,
+        media TEXT, -- JSON-список вложений; для альбома message_id - первый ID
+        edited_at TEXT, -- edit_date поста, учтенная при последней проверке правок
+        PRIMARY KEY (channel_id, message_id)
+    );
+"""
+
+ANALYSES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id TEXT NOT NULL,
+        message_id INTEGER NOT NULL,
+        summary TEXT NOT NULL,
+        sentiment TEXT NOT NULL,
+        hashtags TEXT, -- JSON-строка
+        analysis_date TEXT NOT NULL,
+        degraded INTEGER NOT NULL DEFAULT 0, -- 1: без LLM, локальный классификатор
+        model TEXT,
+        prompt_version TEXT,
+        UNIQUE (channel_id, message_id),
+        FOREIGN KEY (channel_id, message_id) REFERENCES messages (channel_id, message_id)
+    );
+"""
+
+# Архив: одна база на месяц, текст сжат zlib
+ARCHIVE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS messages (
+        channel_id TEXT NOT NULL,
+        message_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        text BLOB NOT NULL,
+        PRIMARY KEY (channel_id, message_id)
+    );
+"""
+
+
+def _media_json(message: Dict[str, Any]) -> Optional[str]:
+    media = message.get("media")
+    return json.dumps(media, ensure_ascii=False) if media else None
+
+
+class DataManager(StorageBackend):
+    """Хранилище в SQLite: рабочая база в режиме WAL и помесячные архивы."""
 
-class DataManager:
     def __init__(self, db_path: str = config.DATABASE_URL):
         self.db_path = db_path
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.archive_dir = config.ARCHIVE_DIR
         self.conn = self._create_connection()
         self._create_tables()
+        self._migrate_schema()
+        self._create_indexes()
         logger.info(f"DataManager инициализирован с базой данных: {db_path}")
 
     def _create_connection(self) -> Optional[sqlite3.Connection]:
@@ -24,6 +93,12 @@ class DataManager:
         try:
             conn = sqlite3.connect(self.db_path)
             conn.row_factory = sqlite3.Row
+            # auto_vacuum применяется к новой базе при создании первой таблицы;
+            # существующая база переводится в этот режим в _migrate_schema
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            # WAL: чтение не блокирует запись, checkpoint выполняется по расписанию
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
             return conn
         except sqlite3.Error as e:
             logger.error(f"Ошибка при подключении к базе данных: {e}")
@@ -35,50 +110,216 @@ class DataManager:
             return
         try:
             with self.conn:
+                self.conn.execute(MESSAGES_TABLE_SQL.format(name="messages"))
+                self.conn.execute(ANALYSES_TABLE_SQL.format(name="analyses"))
+                self.conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS last_processed_ids (
+                        channel_id TEXT PRIMARY KEY,
+                        last_message_id INTEGER NOT NULL
+                    );
+                    """
+                )
+                self.conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS subscribers (
+                        user_id INTEGER PRIMARY KEY
+                    );
+                    """
+                )
+                # Счетчик изменений подписок: позволяет процессам с кэшем
+                # подписчиков в памяти заметить изменения, сделанные другими
+                self.conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS subscribers_version (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        version INTEGER NOT NULL
+                    );
+                    """
+                )
                 self.conn.execute(
+                    "INSERT OR IGNORE INTO subscribers_version (id, version) VALUES (1, 0)"
+                )
+                # Фильтры подписчиков: kind - 'hashtag', 'channel' или 'sentiment'
+                self.conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS subscriber_filters (
+                        user_id INTEGER NOT NULL,
+                        kind TEXT NOT NULL,
+                        value TEXT NOT NULL,
+                        PRIMARY KEY (user_id, kind, value)
+                    );
                     """
-                    CREATE TABLE IF NOT EXISTS messages (
-                        id INTEGER PRIMARY KEY,
-                        channel_id TEXT NOT NULL,
+                )
+                # Обратный индекс: значение фильтра -> подписчики
+                self.conn.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_subscriber_filters_kind_value
+                    ON subscriber_filters (kind, value);
+                    """
+                )
+                # Очередь уведомлений: одна строка на пару (анализ, чат)
+                self.conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS notification_payloads (
+                        analysis_id INTEGER PRIMARY KEY,
                         text TEXT NOT NULL,
-                        date TEXT NOT NULL
+                        FOREIGN KEY (analysis_id) REFERENCES analyses (id)
                     );
-                """
+                    """
                 )
                 self.conn.execute(
                     """
-                    CREATE TABLE IF NOT EXISTS analyses (
+                    CREATE TABLE IF NOT EXISTS notification_outbox (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        message_id INTEGER NOT NULL UNIQUE,
-                        summary TEXT NOT NULL,
-                        sentiment TEXT NOT NULL,
-                        hashtags TEXT, -- JSON-строка
-                        analysis_date TEXT NOT NULL,
-                        FOREIGN KEY (message_id) REFERENCES messages (id)
+                        analysis_id INTEGER NOT NULL,
+                        chat_id INTEGER NOT NULL,
+                        -- pending / sent / dead; edit - отправленное уведомление
+                        -- нужно отредактировать после правки поста
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        next_attempt_at REAL NOT NULL,
+                        last_error TEXT,
+                        created_at TEXT NOT NULL,
+                        sent_at TEXT,
+                        sent_message_id INTEGER, -- ID сообщения бота в чате
+                        UNIQUE (analysis_id, chat_id),
+                        FOREIGN KEY (analysis_id) REFERENCES analyses (id)
                     );
-                """
+                    """
                 )
                 self.conn.execute(
                     """
-                    CREATE TABLE IF NOT EXISTS last_processed_ids (
-                        channel_id TEXT PRIMARY KEY,
-                        last_message_id INTEGER NOT NULL
-                    );
+                    CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+                    ON notification_outbox (status, next_attempt_at);
                     """
                 )
+                # Контрольные точки повторного анализа (backfill.py)
                 self.conn.execute(
                     """
-                    CREATE TABLE IF NOT EXISTS subscribers (
-                        user_id INTEGER PRIMARY KEY
+                    CREATE TABLE IF NOT EXISTS backfill_state (
+                        name TEXT PRIMARY KEY,
+                        last_rowid INTEGER NOT NULL,
+                        model TEXT NOT NULL,
+                        prompt_version TEXT NOT NULL,
+                        processed INTEGER NOT NULL,
+                        updated_at TEXT NOT NULL
                     );
                     """
                 )
                 logger.info(
-                    "Таблицы 'messages', 'analyses', 'last_processed_ids' и 'subscribers' успешно проверены/созданы."
+                    "Таблицы 'messages', 'analyses', 'last_processed_ids', 'subscribers', "
+                    "'subscriber_filters' и 'notification_outbox' успешно проверены/созданы."
                 )
         except sqlite3.Error as e:
             logger.error(f"Ошибка при создании таблиц: {e}")
 
+    def _migrate_schema(self):
+        """Обновляет схему существующей базы до SCHEMA_VERSION."""
+        if not self.conn:
+            return
+        try:
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                columns = {
+                    row["name"]
+                    for row in self.conn.execute("PRAGMA table_info(messages)")
+                }
+                with self.conn:
+                    self.conn.execute("BEGIN")
+                    if "message_id" not in columns:
+                        self._migrate_to_channel_keys()
+                    message_columns = {
+                        row["name"]
+                        for row in self.conn.execute("PRAGMA table_info(messages)")
+                    }
+                    for column in ("media", "edited_at"):
+                        if column not in message_columns:
+                            self.conn.execute(
+                                f"ALTER TABLE messages ADD COLUMN {column} TEXT"
+                            )
+                    outbox_columns = {
+                        row["name"]
+                        for row in self.conn.execute(
+                            "PRAGMA table_info(notification_outbox)"
+                        )
+                    }
+                    if "sent_message_id" not in outbox_columns:
+                        self.conn.execute(
+                            "ALTER TABLE notification_outbox ADD COLUMN sent_message_id INTEGER"
+                        )
+                    analysis_columns = {
+                        row["name"]
+                        for row in self.conn.execute("PRAGMA table_info(analyses)")
+                    }
+                    if "degraded" not in analysis_columns:
+                        self.conn.execute(
+                            "ALTER TABLE analyses ADD COLUMN degraded INTEGER NOT NULL DEFAULT 0"
+                        )
+                    for column in ("model", "prompt_version"):
+                        if column not in analysis_columns:
+                            self.conn.execute(
+                                f"ALTER TABLE analyses ADD COLUMN {column} TEXT"
+                            )
+                    self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            # Базы, созданные до включения auto_vacuum, нужно один раз
+            # перестроить, иначе incremental_vacuum ничего не делает
+            if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                logger.info("Перевод базы в режим incremental auto_vacuum (VACUUM)...")
+                self.conn.execute("VACUUM")
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при миграции схемы базы данных: {e}")
+
+    def _migrate_to_channel_keys(self):
+        """
+        Миграция на ключ (channel_id, message_id). Раньше ключом был только
+        ID сообщения Telegram, и посты разных каналов с одинаковым ID
+        перезаписывали друг друга. Вызывается внутри транзакции.
+
+        ID анализов сохраняются, поэтому ссылки из очереди уведомлений
+        остаются корректными.
+        """
+        logger.info("Миграция таблиц 'messages' и 'analyses' на ключ (канал, ID)...")
+        self.conn.execute(ANALYSES_TABLE_SQL.format(name="analyses_new"))
+        self.conn.execute(
+            """
+            INSERT INTO analyses_new
+                (id, channel_id, message_id, summary, sentiment, hashtags, analysis_date)
+            SELECT a.id, COALESCE(m.channel_id, ''), a.message_id, a.summary,
+                   a.sentiment, a.hashtags, a.analysis_date
+            FROM analyses a
+            LEFT JOIN messages m ON m.id = a.message_id
+            """
+        )
+        self.conn.execute("DROP TABLE analyses")
+        self.conn.execute("ALTER TABLE analyses_new RENAME TO analyses")
+        self.conn.execute(MESSAGES_TABLE_SQL.format(name="messages_new"))
+        self.conn.execute(
+            """
+            INSERT INTO messages_new (channel_id, message_id, text, date)
+            SELECT channel_id, id, text, date FROM messages
+            """
+        )
+        self.conn.execute("DROP TABLE messages")
+        self.conn.execute("ALTER TABLE messages_new RENAME TO messages")
+
+    def _create_indexes(self):
+        """Создает индексы, зависящие от актуальной схемы."""
+        if not self.conn:
+            return
+        try:
+            with self.conn:
+                # Частичный индекс: в нем только сообщения, еще не перенесенные в архив
+                self.conn.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_messages_unarchived_date
+                    ON messages (date) WHERE archived_at IS NULL;
+                    """
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при создании индексов: {e}")
+
+    @metrics.timed(DB_WRITE_SECONDS, "save_message")
     def save_message(self, message: Dict[str, Any]):
         """Сохраняет одно сообщение в базу данных."""
         if not self.conn:
@@ -86,21 +327,33 @@ class DataManager:
         try:
             with self.conn:
                 self.conn.execute(
-                    "INSERT OR IGNORE INTO messages (id, channel_id, text, date) VALUES (?, ?, ?, ?)",
+                    """
+                    INSERT OR IGNORE INTO messages
+                        (channel_id, message_id, text, date, media)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
                     (
-                        message["id"],
                         message.get("channel_id", ""),
+                        message["id"],
                         message["text"],
                         message["date"],
+                        _media_json(message),
                     ),
                 )
         except sqlite3.Error as e:
             logger.error(f"Ошибка при сохранении сообщения {message.get('id')}: {e}")
 
-    def save_analysis(self, message_id: int, analysis: Dict[str, Any]):
-        """Сохраняет результаты анализа в базу данных."""
+    @metrics.timed(DB_WRITE_SECONDS, "save_analysis")
+    def save_analysis(
+        self, channel_id: str, message_id: int, analysis: Dict[str, Any]
+    ) -> bool:
+        """
+        Сохраняет результаты анализа. Если сообщение уже анализировалось,
+        анализ заменяется на новый с сохранением ID (ссылки из очереди
+        уведомлений остаются корректными).
+        """
         if not self.conn:
-            return
+            return False
 
         if not isinstance(analysis, dict):
             analysis = analysis.dict()
@@ -109,21 +362,416 @@ class DataManager:
             with self.conn:
                 self.conn.execute(
                     """
-                    INSERT INTO analyses (message_id, summary, sentiment, hashtags, analysis_date)
-                    VALUES (?, ?, ?, ?, ?)
+                    INSERT INTO analyses
+                        (channel_id, message_id, summary, sentiment, hashtags,
+                         analysis_date, degraded, model, prompt_version)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (channel_id, message_id) DO UPDATE SET
+                        summary = excluded.summary,
+                        sentiment = excluded.sentiment,
+                        hashtags = excluded.hashtags,
+                        analysis_date = excluded.analysis_date,
+                        degraded = excluded.degraded,
+                        model = excluded.model,
+                        prompt_version = excluded.prompt_version
                     """,
                     (
+                        channel_id,
                         message_id,
                         analysis.get("summary", ""),
                         analysis.get("sentiment", ""),
                         json.dumps(analysis.get("hashtags", [])),
                         datetime.now().isoformat(),
+                        int(bool(analysis.get("degraded"))),
+                        analysis.get("model"),
+                        analysis.get("prompt_version"),
                     ),
                 )
+            return True
         except sqlite3.Error as e:
             logger.error(
                 f"Ошибка при сохранении анализа для сообщения {message_id}: {e}"
             )
+            return False
+
+    @metrics.timed(DB_WRITE_SECONDS, "save_processed_message")
+    def save_processed_message(
+        self,
+        channel_id: str,
+        message: Dict[str, Any],
+        analysis: Dict[str, Any],
+        notification_text: str,
+        chat_ids: List[int],
+    ) -> Optional[int]:
+        """
+        Атомарно сохраняет сообщение, его анализ, уведомления для чатов
+        и сдвигает курсор канала. Возвращает ID анализа или None при ошибке.
+
+        Все записи делаются в одной транзакции: если процесс упадет, то либо
+        пост целиком попадет в очередь уведомлений, либо курсор не сдвинется
+        и пост будет обработан заново.
+        """
+        if not self.conn:
+            return None
+
+        if not isinstance(analysis, dict):
+            analysis = analysis.dict()
+
+        now = datetime.now().isoformat()
+        try:
+            with self.conn:
+                self.conn.execute(
+                    """
+                    INSERT OR IGNORE INTO messages
+                        (channel_id, message_id, text, date, media, edited_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        channel_id,
+                        message["id"],
+                        message["text"],
+                        message["date"],
+                        _media_json(message),
+                        message.get("edit_date"),
+                    ),
+                )
+                cursor = self.conn.execute(
+                    """
+                    INSERT INTO analyses
+                        (channel_id, message_id, summary, sentiment, hashtags,
+                         analysis_date, degraded, model, prompt_version)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        channel_id,
+                        message["id"],
+                        analysis.get("summary", ""),
+                        analysis.get("sentiment", ""),
+                        json.dumps(analysis.get("hashtags", [])),
+                        now,
+                        int(bool(analysis.get("degraded"))),
+                        analysis.get("model"),
+                        analysis.get("prompt_version"),
+                    ),
+                )
+                analysis_id = cursor.lastrowid
+                if chat_ids:
+                    self.conn.execute(
+                        "INSERT INTO notification_payloads (analysis_id, text) VALUES (?, ?)",
+                        (analysis_id, notification_text),
+                    )
+                    next_attempt_at = time.time()
+                    self.conn.executemany(
+                        """
+                        INSERT OR IGNORE INTO notification_outbox
+                            (analysis_id, chat_id, next_attempt_at, created_at)
+                        VALUES (?, ?, ?, ?)
+                        """,
+                        [
+                            (analysis_id, chat_id, next_attempt_at, now)
+                            for chat_id in chat_ids
+                        ],
+                    )
+                self.conn.execute(
+                    """
+                    INSERT INTO last_processed_ids (channel_id, last_message_id)
+                    VALUES (?, ?)
+                    ON CONFLICT(channel_id) DO UPDATE SET last_message_id = excluded.last_message_id;
+                    """,
+                    # Для альбома курсор встает на его последнее сообщение
+                    (channel_id, message.get("last_id", message["id"])),
+                )
+                return analysis_id
+        except sqlite3.Error as e:
+            logger.error(
+                f"Ошибка при сохранении обработанного сообщения {message.get('id')}: {e}"
+            )
+            return None
+
+    def get_due_notifications(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Возвращает уведомления из очереди, время отправки которых наступило."""
+        if not self.conn:
+            return []
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                """
+                SELECT o.id, o.analysis_id, o.chat_id, o.attempts, o.status,
+                       o.sent_message_id, p.text
+                FROM notification_outbox o
+                JOIN notification_payloads p ON p.analysis_id = o.analysis_id
+                WHERE o.status IN ('pending', 'edit') AND o.next_attempt_at <= ?
+                ORDER BY o.id
+                LIMIT ?
+                """,
+                (time.time(), limit),
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при чтении очереди уведомлений: {e}")
+            return []
+
+    def get_next_notification_time(self) -> Optional[float]:
+        """Возвращает время ближайшей запланированной отправки или None."""
+        if not self.conn:
+            return None
+        try:
+            row = self.conn.execute(
+                """
+                SELECT MIN(next_attempt_at) FROM notification_outbox
+                WHERE status IN ('pending', 'edit')
+                """
+            ).fetchone()
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при чтении очереди уведомлений: {e}")
+            return None
+
+    def count_pending_notifications(self) -> int:
+        """Возвращает число уведомлений, ожидающих доставки."""
+        if not self.conn:
+            return 0
+        try:
+            row = self.conn.execute(
+                """
+                SELECT COUNT(*) FROM notification_outbox
+                WHERE status IN ('pending', 'edit')
+                """
+            ).fetchone()
+            return row[0]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при чтении очереди уведомлений: {e}")
+            return 0
+
+    @metrics.timed(DB_WRITE_SECONDS, "mark_notification_sent")
+    def mark_notification_sent(
+        self,
+        notification_id: int,
+        sent_message_id: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """
+        Отмечает уведомление как доставленное. sent_message_id - ID сообщения
+        бота (нужен, чтобы отредактировать уведомление после правки поста);
+        error - причина, по которой не удалось применить правку.
+        Возвращает False, если записать статус не удалось.
+        """
+        if not self.conn:
+            return False
+        try:
+            with self.conn:
+                self.conn.execute(
+                    """
+                    UPDATE notification_outbox
+                    SET status = 'sent', attempts = attempts + 1, sent_at = ?,
+                        last_error = ?,
+                        sent_message_id = COALESCE(?, sent_message_id)
+                    WHERE id = ?
+                    """,
+                    (
+                        datetime.now().isoformat(),
+                        error,
+                        sent_message_id,
+                        notification_id,
+                    ),
+                )
+            return True
+        except sqlite3.Error as e:
+            logger.error(
+                f"Ошибка при отметке уведомления {notification_id} как доставленного: {e}"
+            )
+            return False
+
+    @metrics.timed(DB_WRITE_SECONDS, "reschedule_notification")
+    def reschedule_notification(
+        self,
+        notification_id: int,
+        next_attempt_at: float,
+        error: str,
+        count_attempt: bool = True,
+    ):
+        """Переносит уведомление на повторную попытку."""
+        if not self.conn:
+            return
+        try:
+            with self.conn:
+                self.conn.execute(
+                    """
+                    UPDATE notification_outbox
+                    SET attempts = attempts + ?, next_attempt_at = ?, last_error = ?
+                    WHERE id = ?
+                    """,
+                    (int(count_attempt), next_attempt_at, error, notification_id),
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при переносе уведомления {notification_id}: {e}")
+
+    @metrics.timed(DB_WRITE_SECONDS, "mark_notification_dead")
+    def mark_notification_dead(self, notification_id: int, error: str):
+        """Переводит уведомление в dead-letter: больше оно не отправляется."""
+        if not self.conn:
+            return
+        try:
+            with self.conn:
+                self.conn.execute(
+                    """
+                    UPDATE notification_outbox
+                    SET status = 'dead', attempts = attempts + 1, last_error = ?
+                    WHERE id = ?
+                    """,
+                    (error, notification_id),
+                )
+        except sqlite3.Error as e:
+            logger.error(
+                f"Ошибка при переводе уведомления {notification_id} в dead-letter: {e}"
+            )
+
+    @metrics.timed(DB_WRITE_SECONDS, "purge_sent_notifications")
+    def purge_sent_notifications(self, older_than_days: int):
+        """Удаляет доставленные уведомления старше указанного числа дней."""
+        if not self.conn:
+            return
+        cutoff = datetime.fromtimestamp(
+            time.time() - older_than_days * 86400
+        ).isoformat()
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM notification_outbox WHERE status = 'sent' AND sent_at < ?",
+                    (cutoff,),
+                )
+                self.conn.execute(
+                    """
+                    DELETE FROM notification_payloads
+                    WHERE analysis_id NOT IN (SELECT analysis_id FROM notification_outbox)
+                    """
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при очистке очереди уведомлений: {e}")
+
+    def get_edit_candidates(
+        self, channel_id: str, message_ids: List[int]
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Проанализированные посты канала из message_ids: текст, по которому
+        сделан анализ (None, если перенесен в архив), и учтенное время правки.
+        """
+        if not self.conn or not message_ids:
+            return {}
+        try:
+            cursor = self.conn.execute(
+                f"""
+                SELECT m.message_id, m.text, m.edited_at
+                FROM messages m
+                JOIN analyses a
+                    ON a.channel_id = m.channel_id AND a.message_id = m.message_id
+                WHERE m.channel_id = ?
+                  AND m.message_id IN ({', '.join('?' * len(message_ids))})
+                """,
+                (channel_id, *message_ids),
+            )
+            return {row["message_id"]: dict(row) for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при чтении постов для проверки правок: {e}")
+            return {}
+
+    @metrics.timed(DB_WRITE_SECONDS, "mark_message_edited")
+    def mark_message_edited(self, channel_id: str, message_id: int, edited_at: str):
+        """Запоминает правку поста, не потребовавшую повторного анализа."""
+        if not self.conn:
+            return
+        try:
+            with self.conn:
+                self.conn.execute(
+                    """
+                    UPDATE messages SET edited_at = ?
+                    WHERE channel_id = ? AND message_id = ?
+                    """,
+                    (edited_at, channel_id, message_id),
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при отметке правки сообщения {message_id}: {e}")
+
+    @metrics.timed(DB_WRITE_SECONDS, "save_edited_analysis")
+    def save_edited_analysis(
+        self,
+        channel_id: str,
+        message_id: int,
+        text: str,
+        edited_at: str,
+        analysis: Dict[str, Any],
+        notification_text: str,
+    ) -> Optional[int]:
+        """
+        Одной транзакцией сохраняет новый текст отредактированного поста,
+        обновляет его анализ на месте и ставит уже отправленные уведомления
+        в очередь на редактирование. Еще не отправленные уведомления уйдут
+        с новым текстом. Возвращает число уведомлений для редактирования
+        или None при ошибке.
+        """
+        if not self.conn:
+            return None
+
+        if not isinstance(analysis, dict):
+            analysis = analysis.dict()
+
+        now = datetime.now().isoformat()
+        try:
+            with self.conn:
+                self.conn.execute(
+                    """
+                    UPDATE messages SET text = ?, edited_at = ?
+                    WHERE channel_id = ? AND message_id = ?
+                    """,
+                    (text, edited_at, channel_id, message_id),
+                )
+                self.conn.execute(
+                    """
+                    UPDATE analyses
+                    SET summary = ?, sentiment = ?, hashtags = ?, analysis_date = ?,
+                        degraded = ?, model = ?, prompt_version = ?
+                    WHERE channel_id = ? AND message_id = ?
+                    """,
+                    (
+                        analysis.get("summary", ""),
+                        analysis.get("sentiment", ""),
+                        json.dumps(analysis.get("hashtags", [])),
+                        now,
+                        int(bool(analysis.get("degraded"))),
+                        analysis.get("model"),
+                        analysis.get("prompt_version"),
+                        channel_id,
+                        message_id,
+                    ),
+                )
+                row = self.conn.execute(
+                    "SELECT id FROM analyses WHERE channel_id = ? AND message_id = ?",
+                    (channel_id, message_id),
+                ).fetchone()
+                if row is None:
+                    return 0
+                analysis_id = row["id"]
+                self.conn.execute(
+                    "UPDATE notification_payloads SET text = ? WHERE analysis_id = ?",
+                    (notification_text, analysis_id),
+                )
+                cursor = self.conn.execute(
+                    """
+                    UPDATE notification_outbox
+                    SET status = 'edit', attempts = 0, next_attempt_at = ?,
+                        last_error = NULL
+                    WHERE analysis_id = ? AND status = 'sent'
+                      AND sent_message_id IS NOT NULL
+                    """,
+                    (time.time(), analysis_id),
+                )
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.error(
+                f"Ошибка при сохранении анализа отредактированного сообщения "
+                f"{message_id}: {e}"
+            )
+            return None
 
     def get_last_message_id(self, channel_id: str) -> int:
         """Возвращает ID последнего обработанного сообщения для указанного канала из таблицы 'last_processed_ids'."""
@@ -141,6 +789,7 @@ class DataManager:
             logger.error(f"Ошибка при получении последнего ID сообщения из кэша: {e}")
             return 0
 
+    @metrics.timed(DB_WRITE_SECONDS, "set_last_message_id")
     def set_last_message_id(self, channel_id: str, last_message_id: int):
         """Сохраняет ID последнего обработанного сообщения для канала."""
         if not self.conn:
@@ -195,31 +844,263 @@ class DataManager:
             logger.error(f"Ошибка при получении статистики: {e}")
             return {}
 
-    def add_subscriber(self, user_id: int):
-        """Добавляет пользователя в список подписчиков."""
+    def get_hourly_activity(self, days: int = 28) -> Dict[Tuple[int, int], int]:
+        """
+        Число сообщений всех каналов за последние days дней по ключу
+        (день недели 0-6 с воскресенья, час UTC).
+        """
+        if not self.conn:
+            return {}
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        try:
+            cursor = self.conn.execute(
+                """
+                SELECT CAST(strftime('%w', date) AS INTEGER) AS weekday,
+                       CAST(strftime('%H', date) AS INTEGER) AS hour,
+                       COUNT(*) AS posts
+                FROM messages
+                WHERE date >= ?
+                GROUP BY weekday, hour
+                """,
+                (cutoff,),
+            )
+            return {
+                (row["weekday"], row["hour"]): row["posts"] for row in cursor.fetchall()
+            }
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при подсчете активности каналов: {e}")
+            return {}
+
+    def get_trend_history(self, seconds: float) -> Optional[List[Dict[str, Any]]]:
+        """
+        Дата поста, хэштеги и summary анализов за последние seconds секунд
+        или None при ошибке.
+        """
+        if not self.conn:
+            return None
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+        try:
+            cursor = self.conn.execute(
+                """
+                SELECT m.date, a.hashtags, a.summary
+                FROM analyses a
+                JOIN messages m
+                    ON m.channel_id = a.channel_id AND m.message_id = a.message_id
+                WHERE m.date >= ?
+                """,
+                (cutoff,),
+            )
+            return [
+                {
+                    "date": row["date"],
+                    "hashtags": json.loads(row["hashtags"] or "[]"),
+                    "summary": row["summary"],
+                }
+                for row in cursor.fetchall()
+            ]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при загрузке истории трендов: {e}")
+            return None
+
+    def _backfill_filter(self, force: bool) -> str:
+        """Условие отбора сообщений, анализ которых устарел."""
+        if force:
+            return ""
+        return """
+            AND (a.id IS NULL OR a.model IS NOT ? OR a.prompt_version IS NOT ?)
+        """
+
+    def count_backfill_pending(
+        self, after_rowid: int, model: str, prompt_version: str, force: bool = False
+    ) -> int:
+        """Сколько сообщений после after_rowid ждут повторного анализа."""
+        if not self.conn:
+            return 0
+        params = [after_rowid] if force else [after_rowid, model, prompt_version]
+        try:
+            return self.conn.execute(
+                f"""
+                SELECT COUNT(*)
+                FROM messages m
+                LEFT JOIN analyses a
+                    ON a.channel_id = m.channel_id AND a.message_id = m.message_id
+                WHERE m.rowid > ? {self._backfill_filter(force)}
+                """,
+                params,
+            ).fetchone()[0]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при подсчете сообщений для повторного анализа: {e}")
+            return 0
+
+    def get_backfill_batch(
+        self,
+        after_rowid: int,
+        model: str,
+        prompt_version: str,
+        limit: int = 100,
+        force: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Следующая пачка сообщений для повторного анализа в порядке rowid
+        (порядок сохранения). Тексты из архива подставляются отдельно.
+        """
+        if not self.conn:
+            return []
+        params = [after_rowid] if force else [after_rowid, model, prompt_version]
+        try:
+            cursor = self.conn.execute(
+                f"""
+                SELECT m.rowid AS rowid, m.channel_id, m.message_id, m.text, m.date
+                FROM messages m
+                LEFT JOIN analyses a
+                    ON a.channel_id = m.channel_id AND a.message_id = m.message_id
+                WHERE m.rowid > ? {self._backfill_filter(force)}
+                ORDER BY m.rowid
+                LIMIT ?
+                """,
+                params + [limit],
+            )
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при выборке сообщений для повторного анализа: {e}")
+            return []
+
+    def get_backfill_checkpoint(self, name: str) -> Optional[Dict[str, Any]]:
+        if not self.conn:
+            return None
+        try:
+            row = self.conn.execute(
+                "SELECT * FROM backfill_state WHERE name = ?", (name,)
+            ).fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при чтении контрольной точки '{name}': {e}")
+            return None
+
+    def set_backfill_checkpoint(
+        self,
+        name: str,
+        last_rowid: int,
+        model: str,
+        prompt_version: str,
+        processed: int,
+    ):
         if not self.conn:
             return
+        try:
+            with self.conn:
+                self.conn.execute(
+                    """
+                    INSERT INTO backfill_state
+                        (name, last_rowid, model, prompt_version, processed, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET
+                        last_rowid = excluded.last_rowid,
+                        model = excluded.model,
+                        prompt_version = excluded.prompt_version,
+                        processed = excluded.processed,
+                        updated_at = excluded.updated_at
+                    """,
+                    (
+                        name,
+                        last_rowid,
+                        model,
+                        prompt_version,
+                        processed,
+                        datetime.now().isoformat(),
+                    ),
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при сохранении контрольной точки '{name}': {e}")
+
+    def get_training_examples(self, limit: int = 50000) -> List[Dict[str, Any]]:
+        """
+        Возвращает тексты с разметкой LLM для обучения локального классификатора.
+        Анализы самого классификатора (degraded) и тексты, уже перенесенные
+        в архив, не используются.
+        """
+        if not self.conn:
+            return []
+        try:
+            cursor = self.conn.execute(
+                """
+                SELECT m.text, a.sentiment, a.hashtags
+                FROM analyses a
+                JOIN messages m
+                    ON m.channel_id = a.channel_id AND m.message_id = a.message_id
+                WHERE a.degraded = 0 AND m.text IS NOT NULL
+                ORDER BY a.id
+                LIMIT ?
+                """,
+                (limit,),
+            )
+            return [
+                {
+                    "text": row["text"],
+                    "sentiment": row["sentiment"],
+                    "hashtags": json.loads(row["hashtags"] or "[]"),
+                }
+                for row in cursor.fetchall()
+            ]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при выборке данных для обучения: {e}")
+            return []
+
+    def _bump_subscribers_version(self) -> int:
+        """Увеличивает счетчик изменений подписок. Вызывается внутри транзакции."""
+        self.conn.execute("UPDATE subscribers_version SET version = version + 1")
+        row = self.conn.execute("SELECT version FROM subscribers_version").fetchone()
+        return row[0]
+
+    def get_subscribers_version(self) -> int:
+        """Возвращает текущее значение счетчика изменений подписок."""
+        if not self.conn:
+            return 0
+        try:
+            row = self.conn.execute(
+                "SELECT version FROM subscribers_version"
+            ).fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при чтении версии подписок: {e}")
+            return 0
+
+    @metrics.timed(DB_WRITE_SECONDS, "add_subscriber")
+    def add_subscriber(self, user_id: int) -> Optional[int]:
+        """Добавляет пользователя в список подписчиков. Возвращает новую версию подписок."""
+        if not self.conn:
+            return None
         try:
             with self.conn:
                 self.conn.execute(
                     "INSERT OR IGNORE INTO subscribers (user_id) VALUES (?)", (user_id,)
                 )
+                version = self._bump_subscribers_version()
                 logger.info(f"Пользователь {user_id} добавлен в подписчики.")
+                return version
         except sqlite3.Error as e:
             logger.error(f"Ошибка при добавлении подписчика {user_id}: {e}")
+            return None
 
-    def remove_subscriber(self, user_id: int):
-        """Удаляет пользователя из списка подписчиков."""
+    @metrics.timed(DB_WRITE_SECONDS, "remove_subscriber")
+    def remove_subscriber(self, user_id: int) -> Optional[int]:
+        """Удаляет пользователя из списка подписчиков. Возвращает новую версию подписок."""
         if not self.conn:
-            return
+            return None
         try:
             with self.conn:
                 self.conn.execute(
                     "DELETE FROM subscribers WHERE user_id = ?", (user_id,)
                 )
+                self.conn.execute(
+                    "DELETE FROM subscriber_filters WHERE user_id = ?", (user_id,)
+                )
+                version = self._bump_subscribers_version()
                 logger.info(f"Пользователь {user_id} удален из подписчиков.")
+                return version
         except sqlite3.Error as e:
             logger.error(f"Ошибка при удалении подписчика {user_id}: {e}")
+            return None
 
     def is_subscriber(self, user_id: int) -> bool:
         """Проверяет, является ли пользователь подписчиком."""
@@ -247,6 +1128,325 @@ class DataManager:
             logger.error(f"Ошибка при получении списка подписчиков: {e}")
             return []
 
+    @metrics.timed(DB_WRITE_SECONDS, "add_subscriber_filter")
+    def add_subscriber_filter(
+        self, user_id: int, kind: str, value: str
+    ) -> Optional[int]:
+        """Добавляет фильтр (хештег, канал или тональность) для подписчика."""
+        if not self.conn:
+            return None
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO subscriber_filters (user_id, kind, value) VALUES (?, ?, ?)",
+                    (user_id, kind, value),
+                )
+                return self._bump_subscribers_version()
+        except sqlite3.Error as e:
+            logger.error(
+                f"Ошибка при добавлении фильтра {kind}={value} для подписчика {user_id}: {e}"
+            )
+            return None
+
+    @metrics.timed(DB_WRITE_SECONDS, "remove_subscriber_filter")
+    def remove_subscriber_filter(
+        self, user_id: int, kind: str, value: str
+    ) -> Optional[int]:
+        """Удаляет фильтр подписчика."""
+        if not self.conn:
+            return None
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM subscriber_filters WHERE user_id = ? AND kind = ? AND value = ?",
+                    (user_id, kind, value),
+                )
+                return self._bump_subscribers_version()
+        except sqlite3.Error as e:
+            logger.error(
+                f"Ошибка при удалении фильтра {kind}={value} для подписчика {user_id}: {e}"
+            )
+            return None
+
+    @metrics.timed(DB_WRITE_SECONDS, "clear_subscriber_filters")
+    def clear_subscriber_filters(self, user_id: int, kind: str) -> Optional[int]:
+        """Удаляет все фильтры подписчика указанного типа."""
+        if not self.conn:
+            return None
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM subscriber_filters WHERE user_id = ? AND kind = ?",
+                    (user_id, kind),
+                )
+                return self._bump_subscribers_version()
+        except sqlite3.Error as e:
+            logger.error(
+                f"Ошибка при сбросе фильтров {kind} для подписчика {user_id}: {e}"
+            )
+            return None
+
+    def get_all_subscriber_filters(self) -> List[Dict[str, Any]]:
+        """Возвращает все фильтры подписчиков в виде списка словарей."""
+        if not self.conn:
+            return []
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT user_id, kind, value FROM subscriber_filters")
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при получении фильтров подписчиков: {e}")
+            return []
+
+    def _archive_path(self, month: str) -> str:
+        """Путь к архивной базе за месяц в формате 'YYYY-MM'."""
+        return os.path.join(self.archive_dir, f"messages_{month.replace('-', '_')}.db")
+
+    def _write_archive(self, month: str, rows: List[sqlite3.Row]):
+        """Записывает сжатые тексты сообщений в архивную базу месяца."""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archive = sqlite3.connect(self._archive_path(month))
+        try:
+            with archive:
+                archive.execute(ARCHIVE_TABLE_SQL)
+                archive.executemany(
+                    """
+                    INSERT OR REPLACE INTO messages (channel_id, message_id, date, text)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    [
+                        (
+                            row["channel_id"],
+                            row["message_id"],
+                            row["date"],
+                            zlib.compress(row["text"].encode("utf-8")),
+                        )
+                        for row in rows
+                    ],
+                )
+        finally:
+            archive.close()
+
+    @metrics.timed(DB_WRITE_SECONDS, "archive_old_messages")
+    def archive_old_messages(self, older_than_days: int, limit: int = 500) -> int:
+        """
+        Переносит тексты сообщений старше указанного числа дней в помесячные
+        архивные базы. В рабочей базе остаются ключ, дата и анализ, поэтому
+        статистика и поиск по анализам продолжают работать.
+
+        Обрабатывает не больше limit сообщений и возвращает их число.
+        Сначала пишется архив, затем очищается текст в рабочей базе: при сбое
+        между шагами повторный перенос просто перезапишет архивную запись.
+        """
+        if not self.conn:
+            return 0
+        cutoff = (
+            datetime.now(timezone.utc) - timedelta(days=older_than_days)
+        ).isoformat()
+        try:
+            rows = self.conn.execute(
+                """
+                SELECT channel_id, message_id, text, date FROM messages
+                WHERE archived_at IS NULL AND date < ?
+                ORDER BY date
+                LIMIT ?
+                """,
+                (cutoff, limit),
+            ).fetchall()
+            if not rows:
+                return 0
+            by_month: Dict[str, List[sqlite3.Row]] = {}
+            for row in rows:
+                by_month.setdefault(row["date"][:7], []).append(row)
+            for month, month_rows in by_month.items():
+                self._write_archive(month, month_rows)
+            now = datetime.now().isoformat()
+            with self.conn:
+                self.conn.executemany(
+                    """
+                    UPDATE messages SET text = NULL, archived_at = ?
+                    WHERE channel_id = ? AND message_id = ?
+                    """,
+                    [(now, row["channel_id"], row["message_id"]) for row in rows],
+                )
+            logger.info(
+                f"В архив перенесено сообщений: {len(rows)} "
+                f"(месяцы: {', '.join(sorted(by_month))})"
+            )
+            return len(rows)
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при переносе сообщений в архив: {e}")
+            return 0
+
+    def get_message_text(self, channel_id: str, message_id: int) -> Optional[str]:
+        """Возвращает текст сообщения из рабочей базы или из архива."""
+        if not self.conn:
+            return None
+        try:
+            row = self.conn.execute(
+                "SELECT text, date FROM messages WHERE channel_id = ? AND message_id = ?",
+                (channel_id, message_id),
+            ).fetchone()
+            if row is None:
+                return None
+            if row["text"] is not None:
+                return row["text"]
+            path = self._archive_path(row["date"][:7])
+            if not os.path.exists(path):
+                return None
+            archive = sqlite3.connect(path)
+            try:
+                archived = archive.execute(
+                    "SELECT text FROM messages WHERE channel_id = ? AND message_id = ?",
+                    (channel_id, message_id),
+                ).fetchone()
+            finally:
+                archive.close()
+            return zlib.decompress(archived[0]).decode("utf-8") if archived else None
+        except (sqlite3.Error, zlib.error) as e:
+            logger.error(
+                f"Ошибка при чтении текста сообщения {channel_id}/{message_id}: {e}"
+            )
+            return None
+
+    def iter_export_rows(
+        self,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        channels: Optional[List[str]] = None,
+        sentiments: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Построчно отдает сообщения с анализами для выгрузки.
+
+        Читает через отдельное read-only подключение в одной транзакции:
+        в режиме WAL это согласованный снимок базы, который не блокирует
+        запись. Строки выбираются пачками по batch_size, поэтому память
+        не зависит от объема выгрузки. Тексты, перенесенные в архив,
+        подставляются из архивных баз. date_to не включается в диапазон.
+        """
+        conditions = []
+        params: List[Any] = []
+        if date_from:
+            conditions.append("m.date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("m.date < ?")
+            params.append(date_to)
+        for column, values in (("m.channel_id", channels), ("a.sentiment", sentiments)):
+            if values:
+                conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        if tags:
+            conditions.append(
+                "EXISTS (SELECT 1 FROM json_each(a.hashtags) "
+                f"WHERE json_each.value IN ({', '.join('?' * len(tags))}))"
+            )
+            params.extend(tags)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        archives: Dict[str, sqlite3.Connection] = {}
+        try:
+            # Снимок фиксируется первым чтением и держится до конца транзакции
+            conn.execute("BEGIN")
+            cursor = conn.execute(
+                f"""
+                SELECT m.channel_id, m.message_id, m.date, m.text,
+                       a.summary, a.sentiment, a.hashtags, a.degraded,
+                       a.model, a.prompt_version, a.analysis_date
+                FROM messages m
+                LEFT JOIN analyses a
+                    ON a.channel_id = m.channel_id AND a.message_id = m.message_id
+                {where}
+                ORDER BY m.date, m.channel_id, m.message_id
+                """,
+                params,
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    item = dict(row)
+                    item["hashtags"] = json.loads(item["hashtags"] or "[]")
+                    item["degraded"] = bool(item["degraded"])
+                    if item["text"] is None:
+                        item["text"] = self._read_archived_text(archives, row)
+                    yield item
+        except (sqlite3.Error, zlib.error) as e:
+            logger.error(f"Ошибка при выгрузке сообщений: {e}")
+            raise
+        finally:
+            conn.rollback()
+            conn.close()
+            for archive in archives.values():
+                archive.close()
+
+    def _read_archived_text(
+        self, archives: Dict[str, sqlite3.Connection], row: sqlite3.Row
+    ) -> Optional[str]:
+        """Текст из архива за месяц сообщения; подключения кэшируются в archives."""
+        month = row["date"][:7]
+        if month not in archives:
+            path = self._archive_path(month)
+            if not os.path.exists(path):
+                return None
+            archives[month] = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        archived = (
+            archives[month]
+            .execute(
+                "SELECT text FROM messages WHERE channel_id = ? AND message_id = ?",
+                (row["channel_id"], row["message_id"]),
+            )
+            .fetchone()
+        )
+        return zlib.decompress(archived[0]).decode("utf-8") if archived else None
+
+    @metrics.timed(DB_WRITE_SECONDS, "incremental_vacuum")
+    def incremental_vacuum(self, pages: int = 0) -> int:
+        """
+        Возвращает файловой системе до pages свободных страниц (0 - все).
+        Возвращает число свободных страниц до очистки.
+        """
+        if not self.conn:
+            return 0
+        try:
+            freelist = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if freelist:
+                # Прагма выполняется пошагово, пока курсор не будет дочитан
+                self.conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            return freelist
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при incremental vacuum: {e}")
+            return 0
+
+    @metrics.timed(DB_WRITE_SECONDS, "checkpoint_wal")
+    def checkpoint_wal(self) -> bool:
+        """
+        Переносит WAL в основной файл базы и обрезает журнал.
+        Возвращает False, если checkpoint не завершился из-за активных читателей.
+        """
+        if not self.conn:
+            return False
+        try:
+            busy, _, _ = self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            return busy == 0
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при checkpoint WAL: {e}")
+            return False
+
+    def get_database_size(self) -> int:
+        """Размер рабочей базы вместе с WAL-журналом в байтах."""
+        size = 0
+        for path in (self.db_path, self.db_path + "-wal"):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
     def close(self):
         """Закрывает соединение с базой данных."""
         if self.conn:
@@ -0,0 +1,127 @@
+# edit_tracker.py
+import difflib
+import time
+from typing import Any, Dict
+from logger import get_logger
+import config
+import metrics
+import telegram_notifier
+
+logger = get_logger()
+
+POST_EDITS = metrics.Counter(
+    "newsbot_post_edits_total",
+    "Замеченные правки постов по результату",
+    ["channel", "result"],
+)
+
+
+def text_change(old: str, new: str) -> float:
+    """Доля изменившихся слов: 0 - текст тот же, 1 - полностью другой."""
+    old_words, new_words = old.split(), new.split()
+    if old_words == new_words:
+        return 0.0
+    matcher = difflib.SequenceMatcher(None, old_words, new_words, autojunk=False)
+    return 1.0 - matcher.ratio()
+
+
+class EditTracker:
+    """
+    Отслеживает правки уже обработанных постов.
+
+    Раз в EDITS_CHECK_INTERVAL_SECONDS для канала запрашиваются последние
+    посты, и у проанализированных сравнивается edit_date с учтенной в базе.
+    Пост анализируется заново, только если изменилась заметная доля текста
+    (EDITS_REANALYZE_THRESHOLD): тогда анализ обновляется на месте,
+    а уже отправленные уведомления редактируются, а не отправляются заново.
+    Мелкие правки (опечатки, ссылки) только запоминаются.
+    """
+
+    def __init__(self, monitor, analyzer, data_manager, notification_worker):
+        self.monitor = monitor
+        self.analyzer = analyzer
+        self.data_manager = data_manager
+        self.notification_worker = notification_worker
+        self._last_check: Dict[str, float] = {}
+
+    def due(self, channel_id: str) -> bool:
+        last = self._last_check.get(channel_id)
+        return (
+            last is None
+            or time.monotonic() - last >= config.EDITS_CHECK_INTERVAL_SECONDS
+        )
+
+    async def check_channel(self, channel_id: str):
+        """Проверяет последние посты канала на правки."""
+        self._last_check[channel_id] = time.monotonic()
+        posts = await self.monitor.get_recent_posts(
+            channel_id, config.EDITS_LOOKBACK_MESSAGES
+        )
+        edited = [post for post in posts if post.get("edit_date")]
+        if not edited:
+            return
+        stored = await self.data_manager.aio.get_edit_candidates(
+            channel_id, [post["id"] for post in edited]
+        )
+        for post in edited:
+            row = stored.get(post["id"])
+            # Не анализировался (пропущен предфильтром и т.п.) или уже в архиве
+            if row is None or row["text"] is None:
+                continue
+            if row["edited_at"] and post["edit_date"] <= row["edited_at"]:
+                continue
+            try:
+                await self._apply_edit(channel_id, post, row)
+            except Exception as e:
+                POST_EDITS.inc(channel_id, "error")
+                logger.error(
+                    f"Ошибка при обработке правки поста {post['id']} "
+                    f"из '{channel_id}': {e}",
+                    exc_info=True,
+                )
+
+    async def _apply_edit(
+        self, channel_id: str, post: Dict[str, Any], row: Dict[str, Any]
+    ):
+        change = text_change(row["text"], post["text"])
+        if change < config.EDITS_REANALYZE_THRESHOLD:
+            # Сравнение всегда идет с текстом, по которому сделан анализ,
+            # поэтому серия мелких правок в сумме тоже приведет к анализу
+            POST_EDITS.inc(channel_id, "minor")
+            await self.data_manager.aio.mark_message_edited(
+                channel_id, post["id"], post["edit_date"]
+            )
+            return
+
+        analysis = await self.analyzer.analyze_message(post["text"])
+        if not analysis:
+            # edited_at не обновляется: попробуем при следующей проверке
+            POST_EDITS.inc(channel_id, "analysis_failed")
+            logger.warning(
+                f"Не удалось проанализировать правку поста {post['id']} "
+                f"из '{channel_id}'."
+            )
+            return
+
+        notification_data = telegram_notifier.build_notification_data(
+            channel_id, post, analysis, edited=True
+        )
+        edits = await self.data_manager.aio.save_edited_analysis(
+            channel_id,
+            post["id"],
+            post["text"],
+            post["edit_date"],
+            analysis.dict(),
+            telegram_notifier.format_analysis_message(notification_data),
+        )
+        if edits is None:
+            POST_EDITS.inc(channel_id, "save_failed")
+            return
+        POST_EDITS.inc(channel_id, "reanalyzed")
+        logger.info(
+            f"Пост {post['id']} из '{channel_id}' отредактирован "
+            f"(изменено {change:.0%} текста): анализ обновлен, "
+            f"уведомлений к правке: {edits}."
+        )
+        if edits:
+            self.notification_worker.wake()
@@ -0,0 +1,206 @@
+# export.py
+"""
+Потоковая выгрузка сообщений и их анализов в CSV, JSONL или Parquet.
+
+Строки читаются из согласованного снимка базы (iter_export_rows хранилища)
+пачками и сразу пишутся в файл, поэтому память не зависит от объема
+выгрузки, а мониторинг продолжает писать в базу. CSV и JSONL сжимаются
+gzip, Parquet пишется группами строк со сжатием zstd (нужен pyarrow).
+
+    python export.py --format jsonl --since 2024-05-01 --tag экономика
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from logger import get_logger
+import config
+
+logger = get_logger()
+
+EXPORT_COLUMNS = [
+    "channel_id",
+    "message_id",
+    "date",
+    "text",
+    "summary",
+    "sentiment",
+    "hashtags",
+    "degraded",
+    "model",
+    "prompt_version",
+    "analysis_date",
+]
+
+# Формат -> расширение файла
+EXPORT_FORMATS = {
+    "csv": ".csv.gz",
+    "jsonl": ".jsonl.gz",
+    "parquet": ".parquet",
+}
+
+
+def _write_csv(rows: Iterable[Dict[str, Any]], path: str) -> int:
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, "hashtags": " ".join(row["hashtags"])})
+            count += 1
+    return count
+
+
+def _write_jsonl(rows: Iterable[Dict[str, Any]], path: str) -> int:
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def _batches(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict]]:
+    iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _write_parquet(rows: Iterable[Dict[str, Any]], path: str) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError(
+            "Для выгрузки в Parquet нужен pyarrow: pip install pyarrow"
+        ) from None
+
+    schema = pa.schema(
+        [
+            ("channel_id", pa.string()),
+            ("message_id", pa.int64()),
+            ("date", pa.string()),
+            ("text", pa.string()),
+            ("summary", pa.string()),
+            ("sentiment", pa.string()),
+            ("hashtags", pa.list_(pa.string())),
+            ("degraded", pa.bool_()),
+            ("model", pa.string()),
+            ("prompt_version", pa.string()),
+            ("analysis_date", pa.string()),
+        ]
+    )
+    count = 0
+    # Одна пачка - одна группа строк: в памяти не больше EXPORT_BATCH_SIZE строк
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for batch in _batches(rows, config.EXPORT_BATCH_SIZE):
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            count += len(batch)
+    return count
+
+
+_WRITERS = {
+    "csv": _write_csv,
+    "jsonl": _write_jsonl,
+    "parquet": _write_parquet,
+}
+
+
+def export_to_file(
+    data_manager,
+    path: str,
+    fmt: str = "jsonl",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    channels: Optional[List[str]] = None,
+    sentiments: Optional[List[str]] = None,
+    tags: Optional[List[str]] = None,
+) -> int:
+    """
+    Выгружает отфильтрованные сообщения в файл и возвращает число строк.
+
+    Синхронная функция: из event loop вызывается через asyncio.to_thread.
+    При ошибке недописанный файл удаляется.
+    """
+    if fmt not in _WRITERS:
+        raise ValueError(
+            f"Неизвестный формат '{fmt}', доступны: {', '.join(EXPORT_FORMATS)}"
+        )
+    if tags:
+        # Хэштеги хранятся без '#'
+        tags = [tag.lstrip("#") for tag in tags]
+    rows = data_manager.iter_export_rows(
+        date_from=date_from,
+        date_to=date_to,
+        channels=channels,
+        sentiments=sentiments,
+        tags=tags,
+        batch_size=config.EXPORT_BATCH_SIZE,
+    )
+    try:
+        count = _WRITERS[fmt](rows, path)
+    except BaseException:
+        rows.close()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    logger.info(f"Выгружено {count} сообщений в {path} ({fmt}).")
+    return count
+
+
+def main(argv: Optional[list] = None) -> int:
+    # Импорт здесь: без Telethon, бота и LLM из services
+    from storage import create_storage
+
+    parser = argparse.ArgumentParser(
+        description="Выгрузка сообщений и анализов в CSV, JSONL или Parquet"
+    )
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="jsonl")
+    parser.add_argument(
+        "--output", help="Файл выгрузки (по умолчанию export_<время><расширение>)"
+    )
+    parser.add_argument("--since", help="Начало периода, YYYY-MM-DD (включительно)")
+    parser.add_argument("--until", help="Конец периода, YYYY-MM-DD (не включительно)")
+    parser.add_argument("--days", type=int, help="Последние N дней (вместо --since)")
+    parser.add_argument("--channel", action="append", help="Канал (можно несколько)")
+    parser.add_argument(
+        "--sentiment", action="append", help="Тональность (можно несколько)"
+    )
+    parser.add_argument("--tag", action="append", help="Хэштег (можно несколько)")
+    args = parser.parse_args(argv)
+
+    since = args.since
+    if args.days:
+        since = (datetime.now(timezone.utc) - timedelta(days=args.days)).isoformat()
+    output = args.output or (
+        f"export_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        f"{EXPORT_FORMATS[args.format]}"
+    )
+
+    data_manager = create_storage()
+    try:
+        export_to_file(
+            data_manager,
+            output,
+            args.format,
+            date_from=since,
+            date_to=args.until,
+            channels=args.channel,
+            sentiments=args.sentiment,
+            tags=args.tag,
+        )
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки: {e}")
+        return 1
+    finally:
+        data_manager.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,330 @@
+# fallback_classifier.py
+"""
+Локальный классификатор тональности и категорий на случай, когда LLM
+недоступна или не успевает за потоком сообщений.
+
+Признаки - хешированные униграммы и биграммы слов со взвешиванием TF-IDF,
+модели - линейные (softmax для тональности, независимые сигмоиды для
+категорий), обучаются мини-батчами на NumPy по уже сохраненным анализам
+LLM. Предсказание для одного поста занимает доли миллисекунды.
+
+Обучение:
+    python fallback_classifier.py --output data/fallback_classifier.npz
+"""
+import argparse
+import re
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _hashed_terms(text: str, n_features: int) -> Counter:
+    """Частоты хешированных униграмм и биграмм текста."""
+    words = _TOKEN_RE.findall(text.lower())
+    terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    # crc32, а не hash(): хеш строк в Python меняется между запусками
+    return Counter(zlib.crc32(term.encode("utf-8")) % n_features for term in terms)
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def _sigmoid(logits: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-logits))
+
+
+def _sparse_logits(batch: Tuple, weights: np.ndarray) -> np.ndarray:
+    """Логиты для разреженного батча без построения плотной матрицы."""
+    columns, values, row_ids, n_rows = batch
+    logits = np.zeros((n_rows, weights.shape[1]), dtype=np.float32)
+    np.add.at(logits, row_ids, values[:, None] * weights[columns])
+    return logits
+
+
+def _sparse_step(
+    weights: np.ndarray,
+    bias: np.ndarray,
+    batch: Tuple,
+    error: np.ndarray,
+    learning_rate: float,
+    l2: float,
+):
+    """Шаг градиентного спуска: обновляются только строки встреченных признаков."""
+    columns, values, row_ids, _ = batch
+    weights *= 1 - learning_rate * l2
+    np.add.at(weights, columns, -learning_rate * values[:, None] * error[row_ids])
+    bias -= learning_rate * error.sum(axis=0)
+
+
+class FallbackClassifier:
+    def __init__(
+        self,
+        sentiments: Sequence[str],
+        categories: Sequence[str],
+        idf: np.ndarray,
+        sentiment_weights: np.ndarray,
+        sentiment_bias: np.ndarray,
+        category_weights: np.ndarray,
+        category_bias: np.ndarray,
+        trained_on: int = 0,
+    ):
+        self.sentiments = list(sentiments)
+        self.categories = list(categories)
+        self.n_features = len(idf)
+        self.idf = idf
+        self.sentiment_weights = sentiment_weights
+        self.sentiment_bias = sentiment_bias
+        self.category_weights = category_weights
+        self.category_bias = category_bias
+        self.trained_on = trained_on
+
+    def _vectorize(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Разреженный TF-IDF вектор: индексы признаков и нормированные веса."""
+        counts = _hashed_terms(text, self.n_features)
+        index = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        values = (1.0 + np.log(tf)) * self.idf[index]
+        norm = np.linalg.norm(values)
+        if norm > 0:
+            values /= norm
+        return index, values
+
+    def predict(
+        self, text: str, max_tags: int = 3, threshold: float = 0.5
+    ) -> Dict[str, Any]:
+        """Тональность, категории и уверенность для одного текста."""
+        index, values = self._vectorize(text)
+        sentiment_probs = _softmax(
+            values @ self.sentiment_weights[index] + self.sentiment_bias
+        )
+        category_probs = _sigmoid(
+            values @ self.category_weights[index] + self.category_bias
+        )
+        order = np.argsort(-category_probs)
+        # Хотя бы одна категория, даже если ни одна не прошла порог
+        tags = [
+            self.categories[i]
+            for rank, i in enumerate(order[:max_tags])
+            if rank == 0 or category_probs[i] >= threshold
+        ]
+        best = int(np.argmax(sentiment_probs))
+        return {
+            "sentiment": self.sentiments[best],
+            "hashtags": tags,
+            "confidence": float(sentiment_probs[best]),
+        }
+
+    def save(self, path: str):
+        np.savez_compressed(
+            path,
+            sentiments=np.array(self.sentiments),
+            categories=np.array(self.categories),
+            idf=self.idf,
+            sentiment_weights=self.sentiment_weights,
+            sentiment_bias=self.sentiment_bias,
+            category_weights=self.category_weights,
+            category_bias=self.category_bias,
+            trained_on=np.array(self.trained_on),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "FallbackClassifier":
+        with np.load(path) as data:
+            return cls(
+                sentiments=[str(s) for s in data["sentiments"]],
+                categories=[str(c) for c in data["categories"]],
+                idf=data["idf"],
+                sentiment_weights=data["sentiment_weights"],
+                sentiment_bias=data["sentiment_bias"],
+                category_weights=data["category_weights"],
+                category_bias=data["category_bias"],
+                trained_on=int(data["trained_on"]),
+            )
+
+    @classmethod
+    def train(
+        cls,
+        texts: List[str],
+        sentiments: List[str],
+        hashtags: List[List[str]],
+        sentiment_labels: Sequence[str],
+        category_labels: Sequence[str],
+        n_features: int = 2**16,
+        epochs: int = 15,
+        learning_rate: float = 2.0,
+        l2: float = 1e-5,
+        batch_size: int = 256,
+        seed: int = 0,
+    ) -> "FallbackClassifier":
+        """Обучает модели мини-батчевым градиентным спуском."""
+        n = len(texts)
+        terms = [_hashed_terms(text, n_features) for text in texts]
+
+        document_frequency = np.zeros(n_features, dtype=np.float32)
+        for counts in terms:
+            document_frequency[list(counts.keys())] += 1
+        idf = (np.log((1 + n) / (1 + document_frequency)) + 1).astype(np.float32)
+
+        sentiment_index = {label: i for i, label in enumerate(sentiment_labels)}
+        category_index = {label: i for i, label in enumerate(category_labels)}
+        y_sentiment = np.zeros((n, len(sentiment_labels)), dtype=np.float32)
+        y_category = np.zeros((n, len(category_labels)), dtype=np.float32)
+        for row, (sentiment, tags) in enumerate(zip(sentiments, hashtags)):
+            y_sentiment[row, sentiment_index[sentiment]] = 1.0
+            for tag in tags:
+                if tag in category_index:
+                    y_category[row, category_index[tag]] = 1.0
+
+        model = cls(
+            sentiment_labels,
+            category_labels,
+            idf,
+            np.zeros((n_features, len(sentiment_labels)), dtype=np.float32),
+            np.zeros(len(sentiment_labels), dtype=np.float32),
+            np.zeros((n_features, len(category_labels)), dtype=np.float32),
+            np.zeros(len(category_labels), dtype=np.float32),
+            trained_on=n,
+        )
+        vectors = [model._vectorize(text) for text in texts]
+
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(n)
+            for start in range(0, n, batch_size):
+                rows = order[start : start + batch_size]
+                # Батч в разреженном виде: (строка, признак, значение)
+                columns = np.concatenate([vectors[row][0] for row in rows])
+                values = np.concatenate([vectors[row][1] for row in rows])
+                row_ids = np.repeat(
+                    np.arange(len(rows)), [len(vectors[row][0]) for row in rows]
+                )
+                batch = (columns, values, row_ids, len(rows))
+
+                error = (
+                    _softmax(
+                        _sparse_logits(batch, model.sentiment_weights)
+                        + model.sentiment_bias
+                    )
+                    - y_sentiment[rows]
+                ) / len(rows)
+                _sparse_step(
+                    model.sentiment_weights,
+                    model.sentiment_bias,
+                    batch,
+                    error,
+                    learning_rate,
+                    l2,
+                )
+
+                error = (
+                    _sigmoid(
+                        _sparse_logits(batch, model.category_weights)
+                        + model.category_bias
+                    )
+                    - y_category[rows]
+                ) / len(rows)
+                _sparse_step(
+                    model.category_weights,
+                    model.category_bias,
+                    batch,
+                    error,
+                    learning_rate,
+                    l2,
+                )
+        return model
+
+
+def _evaluate(
+    model: FallbackClassifier,
+    texts: List[str],
+    sentiments: List[str],
+    hashtags: List[List[str]],
+) -> Dict[str, float]:
+    """Точность тональности и доля верной главной категории."""
+    sentiment_hits = 0
+    category_hits = 0
+    for text, sentiment, tags in zip(texts, sentiments, hashtags):
+        prediction = model.predict(text)
+        sentiment_hits += prediction["sentiment"] == sentiment
+        category_hits += bool(prediction["hashtags"]) and (
+            prediction["hashtags"][0] in tags
+        )
+    total = max(len(texts), 1)
+    return {
+        "sentiment_accuracy": sentiment_hits / total,
+        "top_category_accuracy": category_hits / total,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    # Импорты здесь: llm_analyzer сам импортирует этот модуль
+    import config
+    from storage import create_storage
+    from llm_analyzer import NEWS_CATEGORIES, SENTIMENTS
+    from logger import get_logger
+
+    logger = get_logger()
+    parser = argparse.ArgumentParser(
+        description="Обучение локального классификатора по сохраненным анализам LLM"
+    )
+    parser.add_argument("--output", default=config.FALLBACK_MODEL_PATH)
+    parser.add_argument("--limit", type=int, default=50000)
+    parser.add_argument("--features", type=int, default=2**16)
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--holdout", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    data_manager = create_storage()
+    examples = [
+        example
+        for example in data_manager.get_training_examples(args.limit)
+        if example["sentiment"] in SENTIMENTS
+    ]
+    if len(examples) < 50:
+        logger.error(
+            f"Недостаточно данных для обучения: {len(examples)} примеров (нужно от 50)."
+        )
+        return 1
+
+    split = int(len(examples) * (1 - args.holdout))
+    train, test = examples[:split], examples[split:]
+    started = time.perf_counter()
+    model = FallbackClassifier.train(
+        [e["text"] for e in train],
+        [e["sentiment"] for e in train],
+        [e["hashtags"] for e in train],
+        SENTIMENTS,
+        NEWS_CATEGORIES,
+        n_features=args.features,
+        epochs=args.epochs,
+    )
+    logger.info(
+        f"Классификатор обучен на {len(train)} примерах за "
+        f"{time.perf_counter() - started:.1f} с."
+    )
+    if test:
+        scores = _evaluate(
+            model,
+            [e["text"] for e in test],
+            [e["sentiment"] for e in test],
+            [e["hashtags"] for e in test],
+        )
+        logger.info(
+            f"Отложенная выборка ({len(test)}): тональность "
+            f"{scores['sentiment_accuracy']:.1%}, главная категория "
+            f"{scores['top_category_accuracy']:.1%}."
+        )
+    model.save(args.output)
+    logger.info(f"Модель сохранена в {args.output}")
+    data_manager.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
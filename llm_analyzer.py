@@ -1,11 +1,185 @@
 # llm_analyzer.py
-import json
+import asyncio
+import os
 import re
-from typing import Optional, List, Dict, Any
+import math
+import time
+from collections import deque
+from contextlib import aclosing
+from typing import Optional, List, Dict, Any, Awaitable, Union
+import aiohttp
 from langchain_community.llms import Ollama
 from pydantic import BaseModel, Field
 from logger import get_logger
+from prompt_builder import PromptTemplate, estimate_tokens, extract_key_sentences
+from fallback_classifier import FallbackClassifier
+from structured_output import JsonObjectStream, parse_json_object
 import config
+import metrics
+
+LLM_REQUEST_SECONDS = metrics.Histogram(
+    "newsbot_llm_request_seconds", "Длительность одного запроса к LLM", ["kind"]
+)
+LLM_TOKENS = metrics.Counter(
+    "newsbot_llm_tokens_total", "Токены промпта и ответа LLM", ["kind", "direction"]
+)
+ANALYZE_SECONDS = metrics.Histogram(
+    "newsbot_analyze_message_seconds",
+    "Полная длительность analyze_message, включая повторный запрос",
+)
+ANALYSES_TOTAL = metrics.Counter(
+    "newsbot_analyses_total", "Результаты analyze_message", ["result"]
+)
+ANALYSIS_STAGE_SECONDS = metrics.Histogram(
+    "newsbot_analysis_stage_seconds",
+    "Длительность этапов каскадного анализа (summary, classification, total)",
+    ["stage"],
+)
+LLM_COLD_STARTS = metrics.Counter(
+    "newsbot_llm_cold_starts_total",
+    "Запросы к модели, которой не было в памяти Ollama",
+    ["model"],
+)
+FALLBACK_ANALYSES = metrics.Counter(
+    "newsbot_fallback_analyses_total",
+    "Упрощенные анализы локальным классификатором по причине",
+    ["reason"],
+)
+
+# Фиксированный набор категорий-хештегов, которые может выдавать LLM
+NEWS_CATEGORIES = [
+    "политика",
+    "экономика",
+    "происшествия",
+    "спорт",
+    "наука_и_технологии",
+    "культура",
+    "общество",
+    "другие_страны",
+]
+
+CATEGORIES_PROMPT = ", ".join(f"'{category}'" for category in NEWS_CATEGORIES)
+
+# Допустимые значения тональности
+SENTIMENTS = ["Позитивная", "Негативная", "Нейтральная"]
+
+# Шаблоны разбираются один раз при импорте модуля
+ANALYSIS_PROMPT = PromptTemplate(
+    f"""
+Проанализируй новость и предоставь СТРОГО JSON-ответ со следующими ключами: "summary", "sentiment", "hashtags".
+
+**Правила анализа:**
+1.  **summary**: Сделай краткое, но емкое содержание новости на русском языке.
+2.  **sentiment**: Определи тональность. Ответ должен быть ОДНИМ из этих слов: 'Позитивная', 'Негативная', 'Нейтральная'.
+3.  **hashtags**: Создай список из 3-5 УНИКАЛЬНЫХ и ОЧЕНЬ ОБЩИХ хештегов.
+    - Хештеги должны быть на русском языке и отражать одну из следующих категорий:
+      {CATEGORIES_PROMPT}.
+    - Используй ТОЛЬКО предложенные категории. Не придумывай свои.
+    - Хештеги НЕ должны дублироваться.
+    - Выбери наиболее подходящие категории для данной новости.
+
+**Текст новости для анализа:**
+{{message_text}}
+""",
+    budget_field="message_text",
+)
+
+# Запрос на исправление: отправляется только сломанный ответ, без текста новости
+REPAIR_PROMPT = PromptTemplate(
+    """Исправь ответ так, чтобы он стал корректным JSON-объектом с ключами "summary" (строка), "sentiment" (одно из: 'Позитивная', 'Негативная', 'Нейтральная') и "hashtags" (список строк). Верни ТОЛЬКО JSON.
+
+Ответ для исправления:
+{response}""",
+    budget_field="response",
+)
+
+# JSON Schema для ограниченного декодирования (OLLAMA_OUTPUT_FORMAT=schema)
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "sentiment": {"type": "string", "enum": SENTIMENTS},
+        "hashtags": {
+            "type": "array",
+            "items": {"type": "string", "enum": NEWS_CATEGORIES},
+            "maxItems": 5,
+        },
+    },
+    "required": ["summary", "sentiment", "hashtags"],
+}
+
+# Каскад (OLLAMA_CLASSIFIER_MODEL): основная модель пишет только summary
+# обычным текстом, малая - возвращает короткий JSON с тональностью и категориями
+SUMMARY_PROMPT = PromptTemplate(
+    """Сделай краткое, но емкое содержание новости на русском языке. Верни ТОЛЬКО текст содержания, без вступлений и пояснений.
+
+**Текст новости:**
+{message_text}
+""",
+    budget_field="message_text",
+)
+
+CLASSIFICATION_PROMPT = PromptTemplate(
+    f"""Определи тональность и категории новости. Верни СТРОГО JSON с ключами:
+"sentiment" - ОДНО из слов: 'Позитивная', 'Негативная', 'Нейтральная';
+"hashtags" - список из 1-3 категорий, ТОЛЬКО из этих: {CATEGORIES_PROMPT}.
+
+**Текст новости:**
+{{message_text}}
+""",
+    budget_field="message_text",
+)
+
+CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sentiment": {"type": "string", "enum": SENTIMENTS},
+        "hashtags": {
+            "type": "array",
+            "items": {"type": "string", "enum": NEWS_CATEGORIES},
+            "maxItems": 3,
+        },
+    },
+    "required": ["sentiment", "hashtags"],
+}
+
+CHAT_PROMPT = PromptTemplate(
+    """Ты - дружелюбный ассистент. Ответь на сообщение пользователя кратко и по существу.
+Сообщение пользователя: {text}""",
+    budget_field="text",
+)
+
+
+# Значение model у анализов локального классификатора
+FALLBACK_MODEL_NAME = "fallback"
+
+# Загрузка дольше этого порога (load_duration в ответе Ollama) - холодный старт
+COLD_LOAD_SECONDS = 0.5
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_keep_alive(value: str) -> Union[int, str]:
+    """
+    Значение keep_alive для Ollama: число секунд или строка длительности
+    ("30m", "1h30m"). Отрицательное значение - держать модель всегда.
+    """
+    value = value.strip()
+    if re.fullmatch(r"-?\d+", value):
+        return int(value)
+    if not re.fullmatch(r"(\d+(\.\d+)?(ms|s|m|h))+", value):
+        raise ValueError(f"Некорректное значение keep_alive: {value!r}")
+    return value
+
+
+def keep_alive_seconds(value: Union[int, str]) -> float:
+    """Сколько секунд Ollama держит модель в памяти после запроса."""
+    if isinstance(value, int):
+        return math.inf if value < 0 else float(value)
+    return sum(
+        float(number) * _DURATION_UNITS[unit]
+        for number, _, unit in re.findall(r"(\d+(\.\d+)?)(ms|s|m|h)", value)
+    )
 
 
 # Pydantic модель для структурированного вывода от LLM
@@ -17,6 +191,11 @@ class NewsAnalysis(BaseModel):
     hashtags: List[str] = Field(
         description="Список из 3-5 уникальных и обобщенных хештегов."
     )
+    # True, если анализ сделан локальным классификатором без LLM
+    degraded: bool = False
+    # Чем сделан анализ: модель(и) и версия промпта, см. backfill.py
+    model: Optional[str] = None
+    prompt_version: Optional[str] = None
 
     def format_hashtags(self) -> str:
         """Форматирует хештеги в строку для вывода."""
@@ -33,15 +212,174 @@ class OllamaAnalyzer:
         self, model: str = config.OLLAMA_MODEL, base_url: str = config.OLLAMA_BASE_URL
     ):
         self.logger = get_logger()
+        # Токены последнего вызова и накопленные счетчики
+        self.last_usage: Dict[str, Any] = {}
+        self.usage_totals: Dict[str, int] = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "truncated": 0,
+        }
+        # LLM считается недоступной до этого момента после ошибки соединения
+        self._unavailable_until = 0.0
+        self.fallback: Optional[FallbackClassifier] = None
+        self.load_fallback()
+        # Длительность этапов последнего каскадного анализа, секунды
+        self.last_stage_timings: Dict[str, float] = {}
+        self.classifier_llm: Optional[Ollama] = None
+        self.base_url = base_url
+        self.keep_alive = parse_keep_alive(config.OLLAMA_KEEP_ALIVE)
+        self.keep_alive_seconds = keep_alive_seconds(self.keep_alive)
+        # Когда модель последний раз отвечала: по этому и keep_alive
+        # определяется, выгрузила ли ее Ollama
+        self._last_used: Dict[str, float] = {}
+        self.cold_latencies: deque = deque(maxlen=200)
+        self.warm_latencies: deque = deque(maxlen=200)
         try:
-            self.llm = Ollama(model=model, base_url=base_url)
+            self.llm = Ollama(
+                model=model,
+                base_url=base_url,
+                num_ctx=config.OLLAMA_NUM_CTX,
+                num_predict=config.OLLAMA_NUM_PREDICT,
+                keep_alive=self.keep_alive,
+            )
             # Простая проверка соединения
             self.llm.invoke("Hi", temperature=0.0)
+            self._last_used[model] = time.monotonic()
             self.logger.info(f"OllamaAnalyzer инициализирован с моделью {model}")
+            if config.OLLAMA_CLASSIFIER_MODEL:
+                self.classifier_llm = Ollama(
+                    model=config.OLLAMA_CLASSIFIER_MODEL,
+                    base_url=base_url,
+                    num_ctx=config.OLLAMA_NUM_CTX,
+                    num_predict=config.OLLAMA_CLASSIFIER_NUM_PREDICT,
+                    temperature=0.0,
+                    keep_alive=self.keep_alive,
+                )
+                self.logger.info(
+                    f"Каскад моделей: классификация - {config.OLLAMA_CLASSIFIER_MODEL}, "
+                    f"summary - {model}"
+                )
         except Exception as e:
             self.logger.error(f"Не удалось инициализировать Ollama: {e}")
             raise
 
+    def load_fallback(self, path: str = config.FALLBACK_MODEL_PATH) -> bool:
+        """Загружает локальный классификатор, если он обучен."""
+        if not config.FALLBACK_ENABLED or not os.path.exists(path):
+            return False
+        try:
+            self.fallback = FallbackClassifier.load(path)
+            self.logger.info(
+                f"Резервный классификатор загружен из {path} "
+                f"(обучен на {self.fallback.trained_on} примерах)."
+            )
+            return True
+        except Exception as e:
+            self.logger.error(f"Не удалось загрузить резервный классификатор: {e}")
+            return False
+
+    def llm_available(self) -> bool:
+        return time.monotonic() >= self._unavailable_until
+
+    @property
+    def model_version(self) -> str:
+        """Модели, которыми делается анализ; сохраняется с каждым анализом."""
+        if self.classifier_llm is None:
+            return self.llm.model
+        return f"{self.llm.model}+{self.classifier_llm.model}"
+
+    @property
+    def prompt_version(self) -> str:
+        """Версия промптов анализа; меняется при любом изменении шаблонов."""
+        if self.classifier_llm is None:
+            return ANALYSIS_PROMPT.version
+        return f"{SUMMARY_PROMPT.version}+{CLASSIFICATION_PROMPT.version}"
+
+    @property
+    def models(self) -> List[str]:
+        """Все модели, которые использует анализатор."""
+        models = [self.llm.model]
+        if self.classifier_llm is not None:
+            models.append(self.classifier_llm.model)
+        return list(dict.fromkeys(models))
+
+    def idle_seconds(self, model: str) -> float:
+        """Сколько секунд модель не использовалась (inf - ни разу с запуска)."""
+        last = self._last_used.get(model)
+        return math.inf if last is None else time.monotonic() - last
+
+    def is_resident(self, model: str) -> bool:
+        """Ожидается ли, что модель еще в памяти Ollama (по keep_alive)."""
+        return self.idle_seconds(model) < self.keep_alive_seconds
+
+    async def load_model(self, model: str) -> float:
+        """
+        Загружает модель в память Ollama (запрос без промпта) и продлевает
+        ее keep_alive. Возвращает время запроса в секундах.
+        """
+        started = time.perf_counter()
+        timeout = aiohttp.ClientTimeout(total=config.OLLAMA_LOAD_TIMEOUT_SECONDS)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(
+                f"{self.base_url}/api/generate",
+                json={"model": model, "keep_alive": self.keep_alive},
+            ) as response:
+                response.raise_for_status()
+                await response.read()
+        self._last_used[model] = time.monotonic()
+        return time.perf_counter() - started
+
+    def _record_latency(
+        self, model: str, cold: bool, info: Dict[str, Any], elapsed: float
+    ):
+        """Разделяет задержку запросов на холодный старт и прогретую модель."""
+        self._last_used[model] = time.monotonic()
+        load_seconds = (info.get("load_duration") or 0) / 1e9
+        if cold or load_seconds >= COLD_LOAD_SECONDS:
+            self.cold_latencies.append(elapsed)
+            LLM_COLD_STARTS.inc(model)
+            self.logger.info(
+                f"Холодный старт модели {model}: запрос занял {elapsed:.2f} с."
+            )
+        else:
+            self.warm_latencies.append(elapsed)
+
+    def latency_stats(self) -> Dict[str, Any]:
+        """Медиана и максимум задержки запросов к прогретой и холодной модели."""
+
+        def summarize(values: deque) -> Dict[str, float]:
+            ordered = sorted(values)
+            if not ordered:
+                return {"count": 0, "p50": 0.0, "max": 0.0}
+            return {
+                "count": len(ordered),
+                "p50": ordered[len(ordered) // 2],
+                "max": ordered[-1],
+            }
+
+        return {
+            "warm": summarize(self.warm_latencies),
+            "cold": summarize(self.cold_latencies),
+        }
+
+    def _fallback_analysis(self, message_text: str, reason: str) -> NewsAnalysis:
+        """Упрощенный анализ: тональность и категории локально, summary - выдержка."""
+        prediction = self.fallback.predict(message_text)
+        FALLBACK_ANALYSES.inc(reason)
+        ANALYSES_TOTAL.inc("fallback")
+        self.logger.info(
+            f"Упрощенный анализ ({reason}): {prediction['sentiment']}, "
+            f"{prediction['hashtags']}, уверенность {prediction['confidence']:.2f}"
+        )
+        return NewsAnalysis(
+            summary=extract_key_sentences(message_text, config.FALLBACK_SUMMARY_TOKENS),
+            sentiment=prediction["sentiment"],
+            hashtags=prediction["hashtags"],
+            degraded=True,
+            model=FALLBACK_MODEL_NAME,
+        )
+
     def _clean_and_validate_hashtags(self, hashtags: List[Any]) -> List[str]:
         """Очищает, валидирует и дедуплицирует хештеги."""
         cleaned_hashtags = []
@@ -59,56 +397,310 @@ class OllamaAnalyzer:
         # Удаляем дубликаты, сохраняя порядок
         return list(dict.fromkeys(cleaned_hashtags))
 
-    async def analyze_message(self, message_text: str) -> Optional[NewsAnalysis]:
-        """Анализирует текст сообщения и возвращает структурированный результат."""
-        prompt = f"""
-Проанализируй новость и предоставь СТРОГО JSON-ответ со следующими ключами: "summary", "sentiment", "hashtags".
+    def _max_prompt_tokens(self, template: PromptTemplate) -> int:
+        """Бюджет промпта: не больше контекста за вычетом места под ответ."""
+        return min(
+            config.OLLAMA_NUM_CTX - config.OLLAMA_NUM_PREDICT,
+            template.static_tokens + config.LLM_MAX_INPUT_TOKENS,
+        )
 
-**Правила анализа:**
-1.  **summary**: Сделай краткое, но емкое содержание новости на русском языке.
-2.  **sentiment**: Определи тональность. Ответ должен быть ОДНИМ из этих слов: 'Позитивная', 'Негативная', 'Нейтральная'.
-3.  **hashtags**: Создай список из 3-5 УНИКАЛЬНЫХ и ОЧЕНЬ ОБЩИХ хештегов.
-    - Хештеги должны быть на русском языке и отражать одну из следующих категорий:
-      'политика', 'экономика', 'происшествия', 'спорт', 'наука_и_технологии', 'культура', 'общество', 'другие_страны'.
-    - Используй ТОЛЬКО предложенные категории. Не придумывай свои.
-    - Хештеги НЕ должны дублироваться.
-    - Выбери наиболее подходящие категории для данной новости.
+    def _record_usage(
+        self, kind: str, prompt: str, info: Dict[str, Any], elapsed: float
+    ):
+        """Запоминает число токенов промпта и ответа для последнего вызова."""
+        prompt_tokens = info.get("prompt_eval_count") or estimate_tokens(prompt)
+        completion_tokens = info.get("eval_count") or 0
+        self.last_usage = {
+            "kind": kind,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "seconds": elapsed,
+        }
+        self.usage_totals["calls"] += 1
+        self.usage_totals["prompt_tokens"] += prompt_tokens
+        self.usage_totals["completion_tokens"] += completion_tokens
+        LLM_REQUEST_SECONDS.observe(elapsed, kind)
+        LLM_TOKENS.inc(kind, "prompt", amount=prompt_tokens)
+        LLM_TOKENS.inc(kind, "completion", amount=completion_tokens)
+        self.logger.info(
+            f"LLM ({kind}): промпт {prompt_tokens} ток., ответ {completion_tokens} ток., "
+            f"{elapsed:.2f} с"
+        )
 
-**Текст новости для анализа:**
-{message_text}
-"""
+    async def _generate(self, kind: str, prompt: str, **kwargs) -> str:
+        """Вызывает LLM и фиксирует использование токенов."""
+        cold = not self.is_resident(self.llm.model)
+        started = time.perf_counter()
+        result = await self.llm.agenerate([prompt], **kwargs)
+        generation = result.generations[0][0]
+        info = generation.generation_info or {}
+        elapsed = time.perf_counter() - started
+        self._record_usage(kind, prompt, info, elapsed)
+        self._record_latency(self.llm.model, cold, info, elapsed)
+        return generation.text
+
+    def _output_format(
+        self, schema: Dict[str, Any] = ANALYSIS_SCHEMA
+    ) -> Dict[str, Any]:
+        """Параметры ограниченного декодирования для Ollama."""
+        if config.OLLAMA_OUTPUT_FORMAT == "schema":
+            return {"format": schema}
+        if config.OLLAMA_OUTPUT_FORMAT:
+            return {"format": config.OLLAMA_OUTPUT_FORMAT}
+        return {}
+
+    async def _generate_json(
+        self,
+        kind: str,
+        prompt: str,
+        llm: Optional[Ollama] = None,
+        schema: Dict[str, Any] = ANALYSIS_SCHEMA,
+    ) -> str:
+        """
+        Потоково получает ответ LLM и прерывает генерацию, как только
+        закрылся JSON-объект верхнего уровня.
+        """
+        llm = llm or self.llm
+        cold = not self.is_resident(llm.model)
+        started = time.perf_counter()
+        stream = JsonObjectStream()
+        async with aclosing(
+            llm.astream(prompt, **self._output_format(schema))
+        ) as chunks:
+            async for chunk in chunks:
+                if stream.feed(chunk):
+                    break
+        elapsed = time.perf_counter() - started
+        # При досрочной остановке Ollama не присылает счетчики, оцениваем сами
+        self._record_usage(
+            kind, prompt, {"eval_count": estimate_tokens(stream.text)}, elapsed
+        )
+        self._record_latency(llm.model, cold, {}, elapsed)
+        return stream.text
+
+    def _normalize_sentiment(self, sentiment: Any) -> Optional[str]:
+        """Приводит тональность к одному из допустимых значений."""
+        if not isinstance(sentiment, str):
+            return None
+        value = sentiment.strip().lower()
+        for allowed in SENTIMENTS:
+            if value.startswith(allowed.lower()[:5]):
+                return allowed
+        return None
+
+    def _parse_analysis(self, response: str) -> Optional[NewsAnalysis]:
+        """Разбирает и валидирует ответ LLM."""
+        data = parse_json_object(response)
+        if data is None:
+            return None
+        hashtags = data.get("hashtags", [])
+        if isinstance(hashtags, str):
+            hashtags = re.split(r"[,\s]+", hashtags)
+        summary = data.get("summary")
+        sentiment = self._normalize_sentiment(data.get("sentiment"))
+        if not isinstance(summary, str) or not summary.strip() or not sentiment:
+            return None
         try:
-            response = await self.llm.ainvoke(prompt)
-            match = re.search(r"\{.*\}", response, re.DOTALL)
-            if not match:
-                self.logger.warning(f"Не удалось найти JSON в ответе LLM: {response}")
-                return None
-
-            json_string = match.group(0)
-            try:
-                analysis_data = json.loads(json_string)
+            return NewsAnalysis(
+                summary=summary.strip(),
+                sentiment=sentiment,
                 # Очистка и валидация хештегов
-                analysis_data["hashtags"] = self._clean_and_validate_hashtags(
-                    analysis_data.get("hashtags", [])
-                )
+                hashtags=self._clean_and_validate_hashtags(hashtags),
+            )
+        except (TypeError, ValueError):
+            return None
 
-                return NewsAnalysis(**analysis_data)
-            except (json.JSONDecodeError, TypeError) as e:
-                self.logger.error(
-                    f"Ошибка декодирования/валидации JSON: {e} из ответа: {json_string}"
-                )
-                return None
+    def _parse_classification(self, response: str) -> Optional[Dict[str, Any]]:
+        """Разбирает ответ модели-классификатора: тональность и хештеги."""
+        data = parse_json_object(response)
+        if data is None:
+            return None
+        sentiment = self._normalize_sentiment(data.get("sentiment"))
+        if not sentiment:
+            return None
+        hashtags = data.get("hashtags", [])
+        if isinstance(hashtags, str):
+            hashtags = re.split(r"[,\s]+", hashtags)
+        return {
+            "sentiment": sentiment,
+            "hashtags": self._clean_and_validate_hashtags(hashtags),
+        }
+
+    async def analyze_message(
+        self, message_text: str, backlog: int = 0
+    ) -> Optional[NewsAnalysis]:
+        """
+        Анализирует текст сообщения и возвращает структурированный результат.
 
+        backlog - сколько сообщений ждет анализа после этого. Если очередь
+        больше config.FALLBACK_BACKLOG_THRESHOLD, LLM недоступна или не смогла
+        ответить, используется локальный классификатор (если он обучен),
+        а результат помечается как degraded.
+        """
+        if self.fallback is not None:
+            if backlog > config.FALLBACK_BACKLOG_THRESHOLD:
+                return self._fallback_analysis(message_text, "backlog")
+            if not self.llm_available():
+                return self._fallback_analysis(message_text, "llm_unavailable")
+        with ANALYZE_SECONDS.time():
+            analysis = await self._analyze_message(message_text)
+        if analysis is None and self.fallback is not None:
+            return self._fallback_analysis(message_text, "llm_failed")
+        if analysis is not None and not analysis.degraded:
+            analysis.model = self.model_version
+            analysis.prompt_version = self.prompt_version
+        return analysis
+
+    def _build_prompt(
+        self, template: PromptTemplate, message_text: str, count: bool = True
+    ) -> str:
+        """Собирает промпт анализа, сокращая текст новости до бюджета."""
+        prompt, truncated = template.build(
+            self._max_prompt_tokens(template), {"message_text": message_text}
+        )
+        if truncated and count:
+            self.usage_totals["truncated"] += 1
+            self.logger.info(
+                f"Текст новости ({len(message_text)} симв., ~{estimate_tokens(message_text)} ток.) "
+                f"сокращен до бюджета промпта."
+            )
+        return prompt
+
+    async def _analyze_message(self, message_text: str) -> Optional[NewsAnalysis]:
+        try:
+            if self.classifier_llm is not None:
+                return await self._analyze_cascade(message_text)
+            return await self._analyze_single(message_text)
         except Exception as e:
+            ANALYSES_TOTAL.inc("error")
+            # Не ждем таймаута на каждом следующем посте: некоторое время
+            # считаем LLM недоступной
+            self._unavailable_until = (
+                time.monotonic() + config.FALLBACK_LLM_RETRY_SECONDS
+            )
             self.logger.error(f"Ошибка при анализе сообщения: {e}")
             return None
 
+    async def _analyze_single(self, message_text: str) -> Optional[NewsAnalysis]:
+        """Один запрос к основной модели: summary, тональность и хештеги сразу."""
+        prompt = self._build_prompt(ANALYSIS_PROMPT, message_text)
+        response = await self._generate_json("analysis", prompt)
+        analysis = self._parse_analysis(response)
+        if analysis:
+            ANALYSES_TOTAL.inc("ok")
+            return analysis
+
+        # Один дешевый повторный запрос: только исправление формата
+        self.logger.warning(
+            f"Некорректный JSON в ответе LLM, запрашиваю исправление: {response}"
+        )
+        repair_prompt, _ = REPAIR_PROMPT.build(
+            self._max_prompt_tokens(REPAIR_PROMPT), {"response": response}
+        )
+        repaired = await self._generate_json("repair", repair_prompt)
+        analysis = self._parse_analysis(repaired)
+        if analysis:
+            ANALYSES_TOTAL.inc("repaired")
+            return analysis
+
+        ANALYSES_TOTAL.inc("invalid")
+        self.logger.error(
+            f"Не удалось получить корректный JSON от LLM после повтора: {repaired}"
+        )
+        return None
+
+    async def _timed_stage(
+        self, stage: str, coro: Awaitable[Any], timings: Dict[str, float]
+    ) -> Any:
+        started = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            elapsed = time.perf_counter() - started
+            timings[stage] = elapsed
+            ANALYSIS_STAGE_SECONDS.observe(elapsed, stage)
+
+    async def _analyze_cascade(self, message_text: str) -> Optional[NewsAnalysis]:
+        """
+        Каскад моделей: основная модель пишет summary, малая параллельно
+        определяет тональность и категории. Задержка поста - самый долгий
+        из этапов, а не их сумма.
+        """
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
+        summary_prompt = self._build_prompt(SUMMARY_PROMPT, message_text)
+        classification_prompt = self._build_prompt(
+            CLASSIFICATION_PROMPT, message_text, count=False
+        )
+        summary_task = asyncio.create_task(
+            self._timed_stage(
+                "summary", self._generate("summary", summary_prompt), timings
+            )
+        )
+        classification_task = asyncio.create_task(
+            self._timed_stage(
+                "classification",
+                self._generate_json(
+                    "classification",
+                    classification_prompt,
+                    llm=self.classifier_llm,
+                    schema=CLASSIFICATION_SCHEMA,
+                ),
+                timings,
+            )
+        )
+        try:
+            summary, response = await asyncio.gather(summary_task, classification_task)
+        finally:
+            # Если один этап упал, второй не должен занимать модель впустую
+            summary_task.cancel()
+            classification_task.cancel()
+
+        total = time.perf_counter() - started
+        ANALYSIS_STAGE_SECONDS.observe(total, "total")
+        timings["total"] = total
+        self.last_stage_timings = timings
+        self.logger.info(
+            f"Каскад: summary {timings['summary']:.2f} с, классификация "
+            f"{timings['classification']:.2f} с, всего {total:.2f} с "
+            f"(против {timings['summary'] + timings['classification']:.2f} с последовательно)"
+        )
+
+        summary = summary.strip()
+        if not summary:
+            ANALYSES_TOTAL.inc("invalid")
+            self.logger.error("Основная модель вернула пустое summary.")
+            return None
+        classification = self._parse_classification(response)
+        if classification is not None:
+            ANALYSES_TOTAL.inc("ok")
+            return NewsAnalysis(summary=summary, **classification)
+        if self.fallback is None:
+            ANALYSES_TOTAL.inc("invalid")
+            self.logger.error(f"Некорректный ответ модели-классификатора: {response}")
+            return None
+        # summary уже есть, тональность и категории - от локального классификатора
+        self.logger.warning(
+            f"Некорректный ответ модели-классификатора, использую локальный: {response}"
+        )
+        prediction = self.fallback.predict(message_text)
+        FALLBACK_ANALYSES.inc("classification_invalid")
+        ANALYSES_TOTAL.inc("partial")
+        return NewsAnalysis(
+            summary=summary,
+            sentiment=prediction["sentiment"],
+            hashtags=prediction["hashtags"],
+            degraded=True,
+            model=FALLBACK_MODEL_NAME,
+        )
+
     async def get_chat_response(self, text: str) -> str:
         """Получает прямой ответ от LLM для функции чата."""
-        prompt = f"""Ты - дружелюбный ассистент. Ответь на сообщение пользователя кратко и по существу.
-Сообщение пользователя: {text}"""
+        prompt, _ = CHAT_PROMPT.build(
+            self._max_prompt_tokens(CHAT_PROMPT), {"text": text}
+        )
         try:
-            response = await self.llm.ainvoke(prompt)
+            response = await self._generate("chat", prompt)
             return response.strip()
         except Exception as e:
             self.logger.error(f"Ошибка при генерации ответа в чате: {e}")
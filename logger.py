@@ -1,34 +1,209 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import time
+from collections import deque
 from datetime import datetime
+import config
 
 # Создаем директорию для логов, если её нет
-LOGS_DIR = "logs"
+LOGS_DIR = config.LOG_DIR
 if not os.path.exists(LOGS_DIR):
     os.makedirs(LOGS_DIR)
 
-# Формируем имя файла лога с текущей датой
-current_date = datetime.now().strftime("%Y-%m-%d")
-log_file = os.path.join(LOGS_DIR, f"telelytics_{current_date}.log")
+# Текущий файл лога; ротированные копии получают суффикс с датой
+log_file = os.path.join(LOGS_DIR, "telelytics.log")
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: удобно для сборщиков логов."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "module": record.module,
+            "thread": record.threadName,
+        }
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class TimedSizeRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """
+    Ротация по времени (например, в полночь) и дополнительно по размеру файла.
+    Если за один период файл ротируется несколько раз, копии получают
+    суффикс .1, .2 и т.д. и учитываются в backupCount.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = 0, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes <= 0 or self.stream is None:
+            return False
+        self.stream.seek(0, 2)
+        return self.stream.tell() >= self.max_bytes
+
+    def rotation_filename(self, default_name: str) -> str:
+        name = super().rotation_filename(default_name)
+        index = 0
+        candidate = name
+        while os.path.exists(candidate):
+            index += 1
+            candidate = f"{name}.{index}"
+        return candidate
+
+    def doRollover(self):
+        # Ротация по размеру не должна сдвигать момент следующей ротации по времени
+        rollover_at = self.rolloverAt
+        super().doRollover()
+        if time.time() < rollover_at:
+            self.rolloverAt = rollover_at
+
+
+# Как часто поток записи проверяет резервный буфер, если очередь пуста
+OVERFLOW_POLL_SECONDS = 0.5
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Кладет записи в ограниченную очередь, никогда не блокируя event loop.
+
+    Когда очередь переполнена, записи ниже WARNING отбрасываются сразу,
+    а WARNING и выше кладутся в небольшой резервный буфер overflow, который
+    поток записи разбирает в первую очередь; отбрасываются они, только если
+    заполнен и он. Число отброшенных записей сообщается следующей успешно
+    поставленной записью, а dropped_total считает их с момента запуска.
+    """
+
+    def __init__(self, log_queue: queue.Queue, overflow: deque, overflow_size: int):
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.overflow_size = overflow_size
+        self.dropped = 0
+        self.dropped_total = 0
+        self._formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Минимальная подготовка: сообщение и traceback вычисляются здесь,
+        # пока живы аргументы, а форматирование строки - уже в потоке записи
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def _put(self, record: logging.LogRecord) -> bool:
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            pass
+        if (
+            record.levelno >= logging.WARNING
+            and len(self.overflow) < self.overflow_size
+        ):
+            self.overflow.append(record)
+            return True
+        self.dropped += 1
+        self.dropped_total += 1
+        return False
+
+    def enqueue(self, record: logging.LogRecord):
+        if not self._put(record) or not self.dropped:
+            return
+        dropped, self.dropped = self.dropped, 0
+        notice = logging.LogRecord(
+            record.name,
+            logging.WARNING,
+            __file__,
+            0,
+            f"Очередь логов переполнена, пропущено записей: {dropped}",
+            None,
+            None,
+        )
+        self._put(notice)
+
+
+class OverflowQueueListener(logging.handlers.QueueListener):
+    """QueueListener, который перед каждой записью из очереди разбирает overflow."""
+
+    def __init__(self, log_queue: queue.Queue, overflow: deque, *handlers, **kwargs):
+        super().__init__(log_queue, *handlers, **kwargs)
+        self.overflow = overflow
+
+    def _drain_overflow(self):
+        while self.overflow:
+            self.handle(self.overflow.popleft())
+
+    def dequeue(self, block: bool) -> logging.LogRecord:
+        # Записи из overflow обрабатываются здесь же, мимо task_done очереди
+        while True:
+            self._drain_overflow()
+            try:
+                return self.queue.get(timeout=OVERFLOW_POLL_SECONDS)
+            except queue.Empty:
+                continue
+
+    def enqueue_sentinel(self):
+        # При завершении очередь может быть заполнена: ждем места для маркера
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        super().stop()
+        self._drain_overflow()
+
 
 # Настраиваем форматтер для логов
-formatter = logging.Formatter(
-    "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-)
+if config.LOG_FORMAT == "json":
+    formatter = JsonFormatter()
+else:
+    formatter = logging.Formatter(
+        "%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+    )
 
-# Настраиваем файловый handler
-file_handler = logging.FileHandler(log_file, encoding="utf-8")
+# Настраиваем файловый handler с ротацией по времени и размеру
+file_handler = TimedSizeRotatingFileHandler(
+    log_file,
+    max_bytes=config.LOG_MAX_BYTES,
+    when=config.LOG_ROTATE_WHEN,
+    backupCount=config.LOG_BACKUP_COUNT,
+    encoding="utf-8",
+)
 file_handler.setFormatter(formatter)
 
 # Настраиваем консольный handler
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(formatter)
 
+# Запись на диск и в консоль выполняет фоновый поток QueueListener,
+# поэтому вызовы logger.* в event loop только кладут запись в очередь
+log_queue: queue.Queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+log_overflow: deque = deque()
+queue_handler = DroppingQueueHandler(log_queue, log_overflow, config.LOG_OVERFLOW_SIZE)
+listener = OverflowQueueListener(
+    log_queue, log_overflow, file_handler, console_handler, respect_handler_level=True
+)
+listener.start()
+# Дописываем оставшиеся в очереди записи при завершении процесса
+atexit.register(listener.stop)
+
 # Настраиваем корневой logger
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+logger.setLevel(config.LOG_LEVEL)
+logger.addHandler(queue_handler)
 
 
 def get_logger():
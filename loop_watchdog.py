@@ -0,0 +1,133 @@
+# loop_watchdog.py
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+from logger import get_logger
+import metrics
+
+logger = get_logger()
+
+LOOP_LAG_SECONDS = metrics.Histogram(
+    "newsbot_event_loop_lag_seconds",
+    "Задержка планирования event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+LOOP_STALLS = metrics.Counter(
+    "newsbot_event_loop_stalls_total", "Блокировки event loop дольше порога"
+)
+
+
+class LoopWatchdog:
+    """
+    Следит за отзывчивостью event loop.
+
+    Корутина-пульс засыпает на interval и измеряет, насколько позже она
+    проснулась: это задержка планирования, которую видят все задачи цикла.
+    Отдельный поток проверяет, что пульс не остановился; если цикл занят
+    дольше slow_threshold, поток снимает стек потока event loop и пишет его
+    в лог - это и есть блокирующий вызов.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.5,
+        slow_threshold: float = 0.5,
+        unhealthy_threshold: float = 10.0,
+        window: int = 120,
+    ):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.unhealthy_threshold = unhealthy_threshold
+        self.stalls = 0
+        self.last_lag = 0.0
+        self._lags: deque = deque(maxlen=window)
+        self._last_tick: Optional[float] = None
+        self._loop_ident: Optional[int] = None
+        self._reported_tick: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def _check_stall(self):
+        """Вызывается из потока-наблюдателя: снимает стек зависшего цикла."""
+        tick = self._last_tick
+        if tick is None or tick == self._reported_tick:
+            return
+        stalled_for = time.monotonic() - tick - self.interval
+        if stalled_for < self.slow_threshold:
+            return
+        self._reported_tick = tick
+        self.stalls += 1
+        LOOP_STALLS.inc()
+        frame = sys._current_frames().get(self._loop_ident)
+        stack = "".join(traceback.format_stack(frame)) if frame else "стек недоступен"
+        logger.warning(
+            f"Event loop заблокирован уже {stalled_for:.2f} с. "
+            f"Стек потока event loop:\n{stack}"
+        )
+
+    def _watch(self):
+        while True:
+            time.sleep(self.slow_threshold / 2)
+            try:
+                self._check_stall()
+            except Exception as e:
+                logger.error(f"Ошибка в потоке наблюдения за event loop: {e}")
+
+    def _start_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._watch, name="loop-watchdog", daemon=True
+            )
+            self._thread.start()
+
+    async def run(self):
+        """Пульс event loop. Запускается отдельной задачей."""
+        self._loop_ident = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._start_thread()
+        logger.info("Запуск наблюдения за event loop.")
+        while True:
+            started = self._last_tick
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self._last_tick = now
+            self.last_lag = lag
+            self._lags.append(lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            if self._reported_tick == started:
+                logger.warning(
+                    f"Event loop снова отвечает после блокировки {lag:.2f} с."
+                )
+
+    def current_stall(self) -> float:
+        """Сколько секунд пульс уже не срабатывал сверх интервала."""
+        if self._last_tick is None:
+            return 0.0
+        return max(0.0, time.monotonic() - self._last_tick - self.interval)
+
+    def stats(self) -> Dict[str, Any]:
+        """Сводка для /status: текущая, p99 и максимальная задержка за окно."""
+        lags = sorted(self._lags)
+        p99 = lags[min(len(lags) - 1, int(0.99 * len(lags)))] if lags else 0.0
+        return {
+            "last_lag": self.last_lag,
+            "p99_lag": p99,
+            "max_lag": lags[-1] if lags else 0.0,
+            "stalls": self.stalls,
+            "window_seconds": len(lags) * self.interval,
+        }
+
+    def health(self) -> Tuple[bool, str]:
+        """Проверка для /health: цикл жив и не тормозит дольше допустимого."""
+        if self._last_tick is None:
+            return False, "наблюдение за event loop не запущено"
+        stall = self.current_stall()
+        if stall > self.unhealthy_threshold:
+            return False, f"пульс event loop не срабатывал {stall:.1f} с"
+        if self.last_lag > self.unhealthy_threshold:
+            return False, f"задержка event loop {self.last_lag:.1f} с"
+        return True, f"задержка event loop {self.last_lag * 1000:.1f} мс"
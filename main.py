@@ -1,18 +1,43 @@
 # main.py
 import asyncio
+import signal
 from logger import get_logger
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 import config
 
 # Импортируем dp из нового файла
 from bot_services import dp
-from services import telegram_monitor, data_manager
+from services import (
+    telegram_monitor,
+    data_manager,
+    loop_watchdog,
+    model_keeper,
+    subscriber_router,
+    trend_detector,
+)
 from monitoring_service import MonitoringService
+from notification_worker import NotificationWorker
+from storage_maintenance import StorageMaintenance
+from webhook_server import WebhookServer
+import metrics
 
 logger = get_logger()
 
+
+def create_bot() -> Bot:
+    """Бот, при необходимости работающий через другой сервер Bot API."""
+    if not config.TELEGRAM_BOT_API_URL:
+        return Bot(token=config.TELEGRAM_BOT_TOKEN)
+    session = AiohttpSession(
+        api=TelegramAPIServer.from_base(config.TELEGRAM_BOT_API_URL)
+    )
+    return Bot(token=config.TELEGRAM_BOT_TOKEN, session=session)
+
+
 # Инициализация бота
-bot = Bot(token=config.TELEGRAM_BOT_TOKEN)
+bot = create_bot()
 
 # dp уже импортирован из bot_services, здесь его создавать не нужно
 
@@ -20,30 +45,99 @@ bot = Bot(token=config.TELEGRAM_BOT_TOKEN)
 async def main():
     """
     Основная функция для инициализации и запуска всех сервисов.
+
+    APP_ROLE позволяет запускать обработку команд бота и мониторинг
+    в разных процессах, например несколько процессов бота в режиме
+    вебхука и один процесс мониторинга.
     """
-    # Инициализация сервиса мониторинга
-    # Бот передается для отправки уведомлений
-    monitoring_service = MonitoringService(bot=bot)
+    # docker stop присылает SIGTERM: завершаемся так же, как по Ctrl+C,
+    # чтобы дождаться начатых обновлений и закрыть соединения
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
+    run_bot = config.APP_ROLE in ("all", "bot")
+    run_monitor = config.APP_ROLE in ("all", "monitor")
+
+    # Счетчики трендов за окно и базовый период из уже сохраненных анализов
+    await trend_detector.load(data_manager)
 
     # Задачи для одновременного выполнения
-    monitor_task = asyncio.create_task(monitoring_service.run())
-    bot_task = asyncio.create_task(dp.start_polling(bot))
+    tasks = []
+    if run_monitor:
+        # Воркер доставляет уведомления из очереди в БД,
+        # в том числе оставшиеся недоставленными после перезапуска
+        notification_worker = NotificationWorker(bot=bot)
+
+        # Инициализация сервиса мониторинга
+        monitoring_service = MonitoringService(
+            bot=bot, notification_worker=notification_worker
+        )
+
+        # Архивация старых сообщений, vacuum и checkpoint WAL
+        storage_maintenance = StorageMaintenance()
+
+        tasks.append(asyncio.create_task(monitoring_service.run()))
+        tasks.append(asyncio.create_task(notification_worker.run()))
+        tasks.append(asyncio.create_task(storage_maintenance.run()))
+        # Предзагрузка моделей Ollama и продление keep_alive в активные часы
+        tasks.append(asyncio.create_task(model_keeper.run()))
+    # Сверка подписок с базой: их меняют и другие процессы бота
+    tasks.append(asyncio.create_task(subscriber_router.run()))
+    # Пульс event loop: задержка в /status и /health, стек при блокировках
+    tasks.append(asyncio.create_task(loop_watchdog.run()))
+    metrics.register_health_check("event_loop", loop_watchdog.health)
+
+    if not run_monitor:
+        # Посты анализирует отдельный процесс мониторинга: тренды берутся из базы
+        tasks.append(asyncio.create_task(trend_detector.run_reload(data_manager)))
+
+    webhook_server = None
+    if run_bot and config.BOT_MODE == "webhook":
+        webhook_server = WebhookServer(dp, bot)
+        tasks.append(asyncio.create_task(webhook_server.run()))
+    elif run_bot:
+        # Сигналы и сессию бота обрабатывает main, а не aiogram
+        tasks.append(
+            asyncio.create_task(
+                dp.start_polling(bot, handle_signals=False, close_bot_session=False)
+            )
+        )
+
+    # Эндпоинты /metrics и /health работают в том же event loop. /health
+    # нужен healthcheck Docker, поэтому сервер запускается и без метрик
+    metrics_runner = None
+    try:
+        metrics_runner = await metrics.start_server(
+            config.METRICS_HOST, config.METRICS_PORT, config.METRICS_ENABLED
+        )
+    except OSError as e:
+        logger.error(f"Не удалось запустить сервер метрик: {e}")
 
-    logger.info("Все сервисы запущены.")
+    logger.info(f"Все сервисы запущены (роль: {config.APP_ROLE}).")
 
     try:
-        # Ожидаем завершения обеих задач
-        await asyncio.gather(monitor_task, bot_task)
+        # Ожидаем завершения всех задач
+        await asyncio.gather(*tasks)
     except Exception as e:
         logger.error(f"Произошла критическая ошибка в main: {e}", exc_info=True)
     finally:
         logger.info("Завершение работы сервисов...")
+        # Сначала дорабатываем начатые обновления: им еще нужны БД и бот
+        if webhook_server:
+            await webhook_server.stop()
+        # Останавливаем фоновые задачи до закрытия БД и сессии бота
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if metrics_runner:
+            await metrics_runner.cleanup()
         # Корректно отключаем клиент Telethon
         if telegram_monitor:
             await telegram_monitor.disconnect()
         # Закрываем соединение с БД
         if data_manager:
             data_manager.close()
+        await bot.session.close()
         logger.info("Все сервисы остановлены.")
 
 
@@ -51,7 +145,7 @@ if __name__ == "__main__":
     try:
         logger.info("Запуск системы...")
         asyncio.run(main())
-    except (KeyboardInterrupt, SystemExit):
+    except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
         logger.info("Система остановлена пользователем.")
     except Exception as e:
         logger.critical(f"Непредвиденная ошибка на верхнем уровне: {e}", exc_info=True)
@@ -0,0 +1,277 @@
+# metrics.py
+"""
+Встроенные метрики в формате Prometheus.
+
+Счетчики, гистограммы и gauge хранятся в обычных словарях и обновляются
+за несколько операций, поэтому их можно вызывать на горячем пути
+обработки каждого сообщения. Обновления идут под блокировкой метрики:
+запросы к PostgreSQL измеряются в рабочих потоках asyncio.to_thread. Значения, которые дорого считать (например,
+размер очереди в БД), задаются функцией и вычисляются только при запросе
+/metrics.
+
+/health отвечает из того же event loop, поэтому заблокированный цикл
+не ответит на него вовсе - это и проверяет healthcheck Docker.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from aiohttp import web
+from logger import get_logger
+
+logger = get_logger()
+
+# Границы гистограмм по умолчанию (секунды): от миллисекунд до минут
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+_REGISTRY: List["_Metric"] = []
+# Проверки для /health: имя -> функция, возвращающая (здоров ли, описание)
+_HEALTH_CHECKS: Dict[str, Callable[[], Tuple[bool, str]]] = {}
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = ""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Gauge(_Metric):
+    """Значение, которое может расти и уменьшаться."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, *labels: str):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def set_function(self, function: Callable[[], float]):
+        """Значение вычисляется функцией в момент запроса метрик."""
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        if self._function is not None:
+            try:
+                return [f"{self.name} {self._function()}"]
+            except Exception as e:
+                logger.warning(f"Не удалось вычислить метрику {self.name}: {e}")
+                return []
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Histogram(_Metric):
+    """Гистограмма длительностей с фиксированными границами."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счетчики по корзинам (+Inf последняя), сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bucket] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *labels: str) -> int:
+        state = self._values.get(labels)
+        return state[2] if state else 0
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Контекстный менеджер, измеряющий длительность блока."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = [
+                (labels, list(counts), total, count)
+                for labels, (counts, total, count) in self._values.items()
+            ]
+        lines = []
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                label_str = _format_labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{label_str} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {total}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+
+def timed(histogram: Histogram, *labels: str):
+    """Декоратор для синхронных функций: записывает длительность вызова."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, *labels)
+
+        return wrapper
+
+    return decorator
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    return "\n".join(metric.render() for metric in _REGISTRY) + "\n"
+
+
+def register_health_check(name: str, check: Callable[[], Tuple[bool, str]]):
+    """Добавляет проверку, результат которой отдается на /health."""
+    _HEALTH_CHECKS[name] = check
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def _handle_health(request: web.Request) -> web.Response:
+    healthy = True
+    lines = []
+    for name, check in _HEALTH_CHECKS.items():
+        try:
+            ok, detail = check()
+        except Exception as e:
+            ok, detail = False, f"ошибка проверки: {e}"
+        healthy = healthy and ok
+        lines.append(f"{name}: {'ok' if ok else 'fail'} ({detail})")
+    return web.Response(
+        text="\n".join(lines) + "\n",
+        status=200 if healthy else 503,
+        content_type="text/plain",
+        charset="utf-8",
+    )
+
+
+async def start_server(
+    host: str, port: int, with_metrics: bool = True
+) -> web.AppRunner:
+    """
+    Запускает HTTP-сервер с эндпоинтами /health и (если with_metrics)
+    /metrics в текущем event loop.
+    """
+    app = web.Application()
+    if with_metrics:
+        app.router.add_get("/metrics", _handle_metrics)
+    app.router.add_get("/health", _handle_health)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    if with_metrics:
+        logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    else:
+        logger.info(f"Проверка состояния доступна на http://{host}:{port}/health")
+    return runner
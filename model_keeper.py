@@ -0,0 +1,138 @@
+# model_keeper.py
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from logger import get_logger
+import config
+import metrics
+
+logger = get_logger()
+
+MODEL_LOAD_SECONDS = metrics.Histogram(
+    "newsbot_ollama_model_load_seconds",
+    "Длительность запросов на загрузку и продление keep_alive моделей",
+    ["model"],
+    buckets=(0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+EXPECTED_POSTS = metrics.Gauge(
+    "newsbot_expected_posts_per_hour", "Прогноз числа постов в ближайший час"
+)
+
+# Профиль активности пересчитывается не чаще раза в час
+ACTIVITY_REFRESH_SECONDS = 3600
+
+
+class ModelKeeper:
+    """
+    Управляет тем, какие модели Ollama находятся в памяти.
+
+    При запуске загружает все модели анализатора, а затем периодически
+    продлевает их keep_alive, если по истории каналов в ближайший час
+    ожидаются посты. В тихие часы модели не пингуются, и Ollama выгружает
+    их по истечении keep_alive, освобождая память.
+    """
+
+    def __init__(self, analyzer, data_manager):
+        self.analyzer = analyzer
+        self.data_manager = data_manager
+        self.keep_warm = True
+        self.expected_posts = 0.0
+        self._activity: Dict[Tuple[int, int], int] = {}
+        self._activity_updated: Optional[float] = None
+        if self.analyzer.keep_alive_seconds <= config.OLLAMA_KEEP_WARM_INTERVAL_SECONDS:
+            logger.warning(
+                f"OLLAMA_KEEP_ALIVE ({self.analyzer.keep_alive}) не больше интервала "
+                f"прогрева ({config.OLLAMA_KEEP_WARM_INTERVAL_SECONDS:.0f} с): "
+                "модели будут выгружаться между проверками."
+            )
+
+    async def _refresh_activity(self):
+        if (
+            self._activity_updated is not None
+            and time.monotonic() - self._activity_updated < ACTIVITY_REFRESH_SECONDS
+        ):
+            return
+        self._activity = await self.data_manager.aio.get_hourly_activity(
+            config.ACTIVITY_HISTORY_DAYS
+        )
+        self._activity_updated = time.monotonic()
+
+    def forecast(self, at: datetime) -> float:
+        """Среднее число постов в час того же дня недели и часа по истории."""
+        # strftime('%w') в SQLite: 0 - воскресенье
+        key = ((at.weekday() + 1) % 7, at.hour)
+        weeks = max(config.ACTIVITY_HISTORY_DAYS / 7, 1.0)
+        return self._activity.get(key, 0) / weeks
+
+    def should_keep_warm(self) -> bool:
+        """Ожидается ли активность в текущем или следующем часе."""
+        if not self._activity:
+            # Истории еще нет: держим модели прогретыми
+            self.expected_posts = 0.0
+            return True
+        now = datetime.now(timezone.utc)
+        self.expected_posts = max(
+            self.forecast(now), self.forecast(now + timedelta(hours=1))
+        )
+        EXPECTED_POSTS.set(self.expected_posts)
+        return self.expected_posts >= config.OLLAMA_KEEP_WARM_MIN_POSTS_PER_HOUR
+
+    async def load(self, model: str) -> bool:
+        try:
+            elapsed = await self.analyzer.load_model(model)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить модель {model} в Ollama: {e}")
+            return False
+        MODEL_LOAD_SECONDS.observe(elapsed, model)
+        logger.info(f"Модель {model} в памяти Ollama (запрос {elapsed:.2f} с).")
+        return True
+
+    async def preload(self):
+        """Загружает все модели анализатора, чтобы первый пост не ждал загрузки."""
+        for model in self.analyzer.models:
+            await self.load(model)
+
+    async def run_once(self):
+        await self._refresh_activity()
+        keep_warm = self.should_keep_warm()
+        if keep_warm != self.keep_warm:
+            logger.info(
+                f"Ожидается {self.expected_posts:.1f} постов в час: модели "
+                + ("держатся в памяти." if keep_warm else "могут быть выгружены.")
+            )
+        self.keep_warm = keep_warm
+        if not keep_warm:
+            return
+        # Пингуем только модели, чей keep_alive истечет до следующей проверки
+        # (с запасом на неточность таймера): запросы к модели сами его продлевают
+        horizon = 2 * config.OLLAMA_KEEP_WARM_INTERVAL_SECONDS
+        for model in self.analyzer.models:
+            idle = self.analyzer.idle_seconds(model)
+            if idle + horizon >= self.analyzer.keep_alive_seconds:
+                await self.load(model)
+
+    async def run(self):
+        """Основной цикл управления моделями."""
+        logger.info(
+            f"Запуск прогрева моделей {', '.join(self.analyzer.models)} "
+            f"(keep_alive {self.analyzer.keep_alive})."
+        )
+        await self.preload()
+        while True:
+            await asyncio.sleep(config.OLLAMA_KEEP_WARM_INTERVAL_SECONDS)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка при прогреве моделей: {e}", exc_info=True)
+
+    def status(self) -> Dict[str, Any]:
+        """Сводка для /status."""
+        resident: List[str] = [
+            model for model in self.analyzer.models if self.analyzer.is_resident(model)
+        ]
+        return {
+            "keep_warm": self.keep_warm,
+            "expected_posts": self.expected_posts,
+            "resident": resident,
+        }
@@ -1,28 +1,119 @@
 # monitoring_service.py
 import asyncio
+from typing import Any, Dict, Optional, Tuple
+from datetime import datetime, timezone
 from logger import get_logger
 import config
-from services import data_manager, llm_analyzer, telegram_monitor
+import metrics
+from services import (
+    data_manager,
+    llm_analyzer,
+    prefilter,
+    subscriber_registry,
+    telegram_monitor,
+    trend_detector,
+)
 import telegram_notifier
+from notification_worker import NotificationWorker
+from edit_tracker import EditTracker
+from telegram_monitor import TelegramMonitor
 from aiogram import Bot
 
 logger = get_logger()
 
+MONITOR_QUEUE_DEPTH = metrics.Gauge(
+    "newsbot_monitor_queue_depth", "Полученные сообщения, ожидающие анализа"
+)
+CURSOR_LAG_MESSAGES = metrics.Gauge(
+    "newsbot_channel_cursor_lag_messages",
+    "Сообщения канала между курсором и последним полученным постом",
+    ["channel"],
+)
+CURSOR_LAG_SECONDS = metrics.Gauge(
+    "newsbot_channel_cursor_lag_seconds",
+    "Возраст самого старого необработанного сообщения канала",
+    ["channel"],
+)
+MESSAGES_PROCESSED = metrics.Counter(
+    "newsbot_messages_processed_total",
+    "Обработанные сообщения по результату",
+    ["channel", "result"],
+)
+MONITOR_CYCLE_SECONDS = metrics.Histogram(
+    "newsbot_monitor_cycle_seconds", "Длительность цикла проверки всех каналов"
+)
+
+
+def _age_seconds(iso_date: str) -> float:
+    """Возраст сообщения в секундах по дате в формате ISO."""
+    try:
+        date = datetime.fromisoformat(iso_date)
+    except (TypeError, ValueError):
+        return 0.0
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((datetime.now(timezone.utc) - date).total_seconds(), 0.0)
+
 
 class MonitoringService:
-    def __init__(self, bot: Bot):
+    def __init__(
+        self,
+        bot: Bot,
+        notification_worker: NotificationWorker,
+        monitor: Optional[TelegramMonitor] = None,
+    ):
         self.bot = bot
-        self.monitor = telegram_monitor
+        self.notification_worker = notification_worker
+        # monitor подменяется в бенчмарке поддельным источником постов
+        self.monitor = monitor or telegram_monitor
+        self.prefilter = prefilter
         self.analyzer = llm_analyzer
         self.data_manager = data_manager
+        self.trends = trend_detector
+        self.edits = EditTracker(
+            self.monitor, self.analyzer, self.data_manager, notification_worker
+        )
         self.channel_ids = config.TELEGRAM_CHANNEL_IDS
+        self._alerts_task: Optional[asyncio.Task] = None
+        # Посты, анализ которых не удалось сохранить: (канал, ID) ->
+        # (анализ, число попыток). При повторе LLM не вызывается заново
+        self._unsaved: Dict[Tuple[str, int], Tuple[Any, int]] = {}
+
+    async def _broadcast_trend_alerts(self, trends):
+        """Рассылает оповещение о новых трендах всем подписчикам."""
+        text = telegram_notifier.format_trend_alert(trends)
+        sent = 0
+        for chat_id in subscriber_registry.snapshot():
+            try:
+                await telegram_notifier.send_notification(self.bot, chat_id, text)
+                sent += 1
+            except Exception as e:
+                logger.warning(
+                    f"Не удалось отправить оповещение о трендах {chat_id}: {e}"
+                )
+        logger.info(
+            f"Оповещение о трендах ({', '.join(t['topic'] for t in trends)}) "
+            f"отправлено {sent} подписчикам."
+        )
+
+    def _check_trend_alerts(self):
+        # Рассылка идет в фоне, чтобы не задерживать обработку каналов
+        if self._alerts_task and not self._alerts_task.done():
+            return
+        trends = self.trends.pop_alerts()
+        if trends:
+            self._alerts_task = asyncio.create_task(
+                self._broadcast_trend_alerts(trends)
+            )
 
     async def _process_channel(self, channel_id: str):
         """Обрабатывает один канал: получает и анализирует новые сообщения."""
         logger.info(f"Проверка канала: {channel_id}")
         try:
             # Получаем ID последнего обработанного сообщения для этого канала
-            last_message_id = self.data_manager.get_last_message_id(channel_id)
+            last_message_id = await self.data_manager.aio.get_last_message_id(
+                channel_id
+            )
             if last_message_id == 0:
                 logger.info(
                     f"Последний ID для '{channel_id}' не найден, получаем с канала..."
@@ -34,13 +125,23 @@ class MonitoringService:
                     logger.info(
                         f"Канал '{channel_id}' инициализирован с ID: {last_message_id}. Сохраняем в базу."
                     )
-                    self.data_manager.set_last_message_id(channel_id, last_message_id)
+                    await self.data_manager.aio.set_last_message_id(
+                        channel_id, last_message_id
+                    )
                     # Пропускаем первую итерацию, чтобы не дублировать последнее сообщение
                     return
 
-            messages = await self.monitor.get_new_messages(channel_id, last_message_id)
+            messages, consumed_id = await self.monitor.get_new_messages(
+                channel_id, last_message_id
+            )
 
             if not messages:
+                if consumed_id > last_message_id:
+                    # Только сообщения без текста (медиа без подписи, стикеры,
+                    # служебные): сдвигаем курсор, иначе канал застрянет на них
+                    await self.data_manager.aio.set_last_message_id(
+                        channel_id, consumed_id
+                    )
                 logger.info(f"В канале '{channel_id}' новых сообщений нет.")
                 return
 
@@ -48,52 +149,124 @@ class MonitoringService:
                 f"В канале '{channel_id}' найдено {len(messages)} новых сообщений."
             )
 
-            for message in messages:
+            MONITOR_QUEUE_DEPTH.inc(amount=len(messages))
+            for index, message in enumerate(messages):
+                CURSOR_LAG_MESSAGES.set(len(messages) - index, channel_id)
+                CURSOR_LAG_SECONDS.set(_age_seconds(message["date"]), channel_id)
                 try:
-                    analysis = await self.analyzer.analyze_message(message["text"])
+                    # Реклама, репосты и короткие посты не доходят до LLM
+                    rule = self.prefilter.check(channel_id, message)
+                    if rule:
+                        MESSAGES_PROCESSED.inc(channel_id, "filtered")
+                        logger.info(
+                            f"Сообщение ID {message['id']} из '{channel_id}' пропущено "
+                            f"предфильтром (правило '{rule}')."
+                        )
+                        await self.data_manager.aio.set_last_message_id(
+                            channel_id, message.get("last_id", message["id"])
+                        )
+                        continue
+
+                    key = (channel_id, message["id"])
+                    analysis, attempts = self._unsaved.pop(key, (None, 0))
+                    if analysis is None:
+                        # При большой очереди анализ может выполнить локальный классификатор
+                        analysis = await self.analyzer.analyze_message(
+                            message["text"], backlog=len(messages) - index - 1
+                        )
                     if not analysis:
+                        MESSAGES_PROCESSED.inc(channel_id, "analysis_failed")
                         logger.warning(
                             f"Не удалось проанализировать сообщение ID: {message['id']} из канала {channel_id}"
                         )
                         continue
 
-                    self.data_manager.save_message(message)
-                    self.data_manager.save_analysis(message["id"], analysis.dict())
-
-                    # Формируем и отправляем уведомление
-                    message_link = (
-                        f"https://t.me/{message['channel_username']}/{message['id']}"
-                        if message.get("channel_username")
-                        else "N/A"
+                    # Формируем уведомление
+                    notification_data = telegram_notifier.build_notification_data(
+                        channel_id, message, analysis
                     )
-                    notification_data = {
-                        "channel_title": message.get(
-                            "channel_title", "Неизвестный источник"
-                        ),
-                        "message_link": message_link,
-                        "summary": analysis.summary,
-                        "sentiment": analysis.sentiment,
-                        "hashtags_formatted": analysis.format_hashtags(),
-                    }
-                    await telegram_notifier.send_analysis_result(
-                        self.bot, notification_data
+                    recipients = telegram_notifier.get_recipients(notification_data)
+
+                    # Сообщение, анализ, очередь уведомлений и ID последнего
+                    # сообщения канала сохраняются одной транзакцией
+                    analysis_id = await self.data_manager.aio.save_processed_message(
+                        channel_id,
+                        message,
+                        analysis.dict(),
+                        telegram_notifier.format_analysis_message(notification_data),
+                        recipients,
                     )
+                    if analysis_id is None:
+                        attempts += 1
+                        if attempts < config.SAVE_MAX_ATTEMPTS:
+                            # База недоступна: курсор не двигаем, иначе следующее
+                            # сохранение перескочит этот пост. Канал продолжим
+                            # с него при следующей проверке, анализ сохраним
+                            MESSAGES_PROCESSED.inc(channel_id, "save_retry")
+                            self._unsaved[key] = (analysis, attempts)
+                            logger.warning(
+                                f"Не удалось сохранить сообщение ID {message['id']} "
+                                f"из '{channel_id}' (попытка {attempts}), повтор "
+                                "при следующей проверке канала."
+                            )
+                            # Остальные посты пачки тоже ждут следующей проверки
+                            MONITOR_QUEUE_DEPTH.dec(amount=len(messages) - index - 1)
+                            return
+                        MESSAGES_PROCESSED.inc(channel_id, "save_failed")
+                        logger.error(
+                            f"Сообщение ID {message['id']} из '{channel_id}' не сохранено "
+                            f"после {attempts} попыток: пропускаю его, уведомления "
+                            "подписчикам не отправлены."
+                        )
+                        await self.data_manager.aio.set_last_message_id(
+                            channel_id, message.get("last_id", message["id"])
+                        )
+                        continue
 
-                    # Обновляем ID последнего сообщения для этого канала
-                    self.data_manager.set_last_message_id(channel_id, message["id"])
+                    logger.info(
+                        f"Анализ сообщения ID {message['id']} из '{channel_id}' поставлен "
+                        f"в очередь для {len(recipients)} подписчиков."
+                    )
+                    MESSAGES_PROCESSED.inc(
+                        channel_id, "degraded" if analysis.degraded else "analyzed"
+                    )
+                    self.notification_worker.wake()
+                    self.trends.add(
+                        message["date"], analysis.hashtags, analysis.summary
+                    )
 
                 except Exception as e:
+                    MESSAGES_PROCESSED.inc(channel_id, "error")
                     logger.error(
                         f"Ошибка при обработке сообщения ID {message.get('id')} из канала {channel_id}: {e}",
                         exc_info=True,
                     )
                     continue
+                finally:
+                    MONITOR_QUEUE_DEPTH.dec()
+            CURSOR_LAG_MESSAGES.set(0, channel_id)
+            CURSOR_LAG_SECONDS.set(0, channel_id)
+            if config.TRENDS_ALERTS_ENABLED:
+                self._check_trend_alerts()
+            if self.prefilter.enabled:
+                logger.info(
+                    f"Срабатывания предфильтра для '{channel_id}': "
+                    f"{self.prefilter.summary(channel_id)}"
+                )
         except Exception as e:
             logger.error(
                 f"Критическая ошибка при обработке канала {channel_id}: {e}",
                 exc_info=True,
             )
 
+    async def _check_edits(self, channel_id: str):
+        try:
+            await self.edits.check_channel(channel_id)
+        except Exception as e:
+            logger.error(
+                f"Ошибка при проверке правок в канале {channel_id}: {e}", exc_info=True
+            )
+
     async def run(self):
         """Основной цикл мониторинга по всем каналам."""
         logger.info(
@@ -109,8 +282,11 @@ class MonitoringService:
 
         while True:
             logger.info("Начало нового цикла проверки всех каналов.")
-            for channel_id in self.channel_ids:
-                await self._process_channel(channel_id)
+            with MONITOR_CYCLE_SECONDS.time():
+                for channel_id in self.channel_ids:
+                    await self._process_channel(channel_id)
+                    if config.EDITS_ENABLED and self.edits.due(channel_id):
+                        await self._check_edits(channel_id)
 
             logger.info(
                 f"Все каналы проверены. Следующая проверка через {config.CHECK_INTERVAL_SECONDS} секунд."
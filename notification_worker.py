@@ -0,0 +1,237 @@
+# notification_worker.py
+import asyncio
+import random
+import time
+from typing import Any, Dict, Optional
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from logger import get_logger
+import config
+from services import data_manager, subscriber_router
+import telegram_notifier
+import metrics
+
+logger = get_logger()
+
+NOTIFY_SEND_SECONDS = metrics.Histogram(
+    "newsbot_notification_send_seconds", "Длительность отправки одного уведомления"
+)
+NOTIFICATIONS_TOTAL = metrics.Counter(
+    "newsbot_notifications_total", "Результаты попыток доставки уведомлений", ["result"]
+)
+OUTBOX_PENDING = metrics.Gauge(
+    "newsbot_notification_outbox_pending", "Уведомления, ожидающие доставки"
+)
+
+# Как часто удалять доставленные уведомления из очереди (секунды)
+PURGE_INTERVAL_SECONDS = 3600
+# Максимальное время ожидания новых уведомлений между проверками очереди
+IDLE_POLL_SECONDS = 30.0
+
+
+class NotificationWorker:
+    """
+    Доставляет уведомления из очереди 'notification_outbox'.
+
+    Строки попадают в очередь в одной транзакции с анализом, поэтому после
+    перезапуска воркер просто продолжает с того места, где остановился.
+    Доставка "как минимум один раз": уведомление отмечается отправленным
+    только после успешного ответа Telegram.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.data_manager = data_manager
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(config.NOTIFY_CONCURRENCY)
+        # Глобальная пауза после flood-limit от Telegram
+        self._paused_until = 0.0
+        self._last_purge = 0.0
+        # Доставленные уведомления, статус которых не удалось записать в базу
+        # (ID -> ID сообщения бота): они остаются в очереди, но при следующей
+        # выборке их нужно только отметить, а не отправлять снова
+        self._unrecorded: Dict[int, Optional[int]] = {}
+
+    def wake(self):
+        """Сообщает воркеру, что в очереди появились новые уведомления."""
+        self._wakeup.set()
+
+    def _backoff(self, attempts: int) -> float:
+        """Экспоненциальная задержка с джиттером."""
+        delay = config.NOTIFY_BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0))
+        delay = min(delay, config.NOTIFY_BACKOFF_MAX_SECONDS)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, item: Dict[str, Any]):
+        """
+        Отправляет одно уведомление (или редактирует отправленное после
+        правки поста) и обновляет его статус в очереди.
+        """
+        notification_id = item["id"]
+        chat_id = item["chat_id"]
+        attempts = item["attempts"] + 1
+        editing = item.get("status") == "edit"
+        async with self._semaphore:
+            pause = self._paused_until - time.time()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            try:
+                with NOTIFY_SEND_SECONDS.time():
+                    if editing:
+                        await telegram_notifier.edit_notification(
+                            self.bot, chat_id, item["sent_message_id"], item["text"]
+                        )
+                        sent_message_id = None
+                    else:
+                        sent_message_id = await telegram_notifier.send_notification(
+                            self.bot, chat_id, item["text"]
+                        )
+                if not await self.data_manager.aio.mark_notification_sent(
+                    notification_id, sent_message_id
+                ):
+                    self._unrecorded[notification_id] = sent_message_id
+                NOTIFICATIONS_TOTAL.inc("edited" if editing else "sent")
+                return True
+            except TelegramRetryAfter as e:
+                NOTIFICATIONS_TOTAL.inc("flood_wait")
+                # Flood-limit: ждем указанное время, попытка не засчитывается
+                self._paused_until = max(
+                    self._paused_until, time.time() + e.retry_after
+                )
+                await self.data_manager.aio.reschedule_notification(
+                    notification_id,
+                    time.time() + e.retry_after,
+                    str(e),
+                    count_attempt=False,
+                )
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                if editing and isinstance(e, TelegramBadRequest):
+                    # Уведомление удалено из чата или текст не изменился: правка
+                    # не применяется, новое уведомление не отправляется
+                    NOTIFICATIONS_TOTAL.inc("edit_skipped")
+                    logger.info(
+                        f"Не удалось отредактировать уведомление {notification_id} "
+                        f"в чате {chat_id}: {e}"
+                    )
+                    await self.data_manager.aio.mark_notification_sent(
+                        notification_id, error=str(e)
+                    )
+                    return False
+                # Повторять бессмысленно: бот заблокирован, чат удален и т.п.
+                NOTIFICATIONS_TOTAL.inc("dead")
+                logger.warning(
+                    f"Не удалось отправить уведомление пользователю {chat_id}: {e}"
+                )
+                await self.data_manager.aio.mark_notification_dead(
+                    notification_id, str(e)
+                )
+                if isinstance(e, TelegramForbiddenError) or "chat not found" in str(e):
+                    logger.info(
+                        f"Пользователь {chat_id} недоступен (заблокировал бота). Удаляю из подписчиков."
+                    )
+                    await subscriber_router.remove_subscriber(chat_id)
+            except Exception as e:
+                if attempts >= config.NOTIFY_MAX_ATTEMPTS and editing:
+                    # Исходное уведомление доставлено: остается как есть
+                    NOTIFICATIONS_TOTAL.inc("edit_skipped")
+                    await self.data_manager.aio.mark_notification_sent(
+                        notification_id, error=str(e)
+                    )
+                elif attempts >= config.NOTIFY_MAX_ATTEMPTS:
+                    NOTIFICATIONS_TOTAL.inc("dead")
+                    logger.error(
+                        f"Уведомление {notification_id} для {chat_id} не доставлено "
+                        f"после {attempts} попыток, перевожу в dead-letter: {e}"
+                    )
+                    await self.data_manager.aio.mark_notification_dead(
+                        notification_id, str(e)
+                    )
+                else:
+                    NOTIFICATIONS_TOTAL.inc("retry")
+                    delay = self._backoff(attempts)
+                    logger.warning(
+                        f"Ошибка отправки уведомления пользователю {chat_id} "
+                        f"(попытка {attempts}), повтор через {delay:.0f} с: {e}"
+                    )
+                    await self.data_manager.aio.reschedule_notification(
+                        notification_id, time.time() + delay, str(e)
+                    )
+            return False
+
+    async def _record_unrecorded(self, item: Dict[str, Any]) -> bool:
+        """
+        Повторяет запись статуса уже доставленного уведомления. Возвращает
+        True, если уведомление доставлено раньше и отправлять его не нужно.
+        """
+        notification_id = item["id"]
+        if notification_id not in self._unrecorded:
+            return False
+        if await self.data_manager.aio.mark_notification_sent(
+            notification_id, self._unrecorded[notification_id]
+        ):
+            del self._unrecorded[notification_id]
+        return True
+
+    async def drain(self) -> int:
+        """Отправляет все уведомления, срок которых наступил. Возвращает число доставленных."""
+        delivered = 0
+        # Уведомления, уже обработанные в этом проходе. Если записать их
+        # статус не удалось (например, база заблокирована), они снова попадут
+        # в выборку, и без этой проверки проход отправлял бы их по кругу
+        attempted = set()
+        while True:
+            batch = [
+                item
+                for item in await self.data_manager.aio.get_due_notifications(
+                    config.NOTIFY_BATCH_SIZE
+                )
+                if item["id"] not in attempted
+            ]
+            if not batch:
+                return delivered
+            attempted.update(item["id"] for item in batch)
+            batch = [item for item in batch if not await self._record_unrecorded(item)]
+            if not batch:
+                continue
+            results = await asyncio.gather(*(self._deliver(item) for item in batch))
+            sent = sum(1 for ok in results if ok)
+            delivered += sent
+            logger.info(f"Доставлено уведомлений: {sent}/{len(batch)}.")
+
+    async def _next_wait(self) -> float:
+        next_time: Optional[float] = (
+            await self.data_manager.aio.get_next_notification_time()
+        )
+        if next_time is None:
+            return IDLE_POLL_SECONDS
+        return min(max(next_time - time.time(), 0.1), IDLE_POLL_SECONDS)
+
+    async def run(self):
+        """Основной цикл доставки уведомлений."""
+        logger.info("Запуск воркера доставки уведомлений.")
+        while True:
+            try:
+                self._wakeup.clear()
+                await self.drain()
+                # Считаем здесь, а не в обработчике /metrics: там запрос
+                # к серверной базе остановил бы event loop
+                OUTBOX_PENDING.set(
+                    await self.data_manager.aio.count_pending_notifications()
+                )
+                if time.time() - self._last_purge > PURGE_INTERVAL_SECONDS:
+                    await self.data_manager.aio.purge_sent_notifications(
+                        config.NOTIFY_RETENTION_DAYS
+                    )
+                    self._last_purge = time.time()
+            except Exception as e:
+                logger.error(f"Ошибка в воркере уведомлений: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), timeout=await self._next_wait()
+                )
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,1339 @@
+# postgres_storage.py
+import asyncio
+import json
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+import asyncpg
+from logger import get_logger
+import config
+import metrics
+from data_manager import DB_WRITE_SECONDS, SCHEMA_VERSION
+from storage import StorageBackend
+
+logger = get_logger()
+
+# Сбой запроса, разрыв соединения или недоступный сервер
+DB_ERRORS = (asyncpg.PostgresError, asyncpg.InterfaceError, OSError)
+
+DB_POOL_SIZE = metrics.Gauge(
+    "newsbot_db_pool_connections", "Открытые соединения пула PostgreSQL"
+)
+DB_POOL_IDLE = metrics.Gauge(
+    "newsbot_db_pool_idle_connections", "Свободные соединения пула PostgreSQL"
+)
+
+# Та же схема, что и в SQLite; даты хранятся ISO-строками, хэштеги и медиа -
+# JSON-строками. rowid задает порядок сохранения для повторного анализа.
+SCHEMA_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS schema_info (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS messages (
+        channel_id TEXT NOT NULL,
+        message_id BIGINT NOT NULL,
+        rowid BIGINT GENERATED BY DEFAULT AS IDENTITY UNIQUE,
+        text TEXT, -- NULL, если текст перенесен в архив
+        date TEXT NOT NULL,
+        archived_at TEXT,
+        media TEXT, -- JSON-список вложений; для альбома message_id - первый ID
+        edited_at TEXT, -- edit_date поста, учтенная при последней проверке правок
+        PRIMARY KEY (channel_id, message_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analyses (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        channel_id TEXT NOT NULL,
+        message_id BIGINT NOT NULL,
+        summary TEXT NOT NULL,
+        sentiment TEXT NOT NULL,
+        hashtags TEXT, -- JSON-строка
+        analysis_date TEXT NOT NULL,
+        degraded INTEGER NOT NULL DEFAULT 0, -- 1: без LLM, локальный классификатор
+        model TEXT,
+        prompt_version TEXT,
+        UNIQUE (channel_id, message_id),
+        FOREIGN KEY (channel_id, message_id) REFERENCES messages (channel_id, message_id)
+    )
+    """,
+    # Архив: текст сжат zlib и вынесен из рабочей таблицы
+    """
+    CREATE TABLE IF NOT EXISTS message_archive (
+        channel_id TEXT NOT NULL,
+        message_id BIGINT NOT NULL,
+        date TEXT NOT NULL,
+        text BYTEA NOT NULL,
+        PRIMARY KEY (channel_id, message_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS last_processed_ids (
+        channel_id TEXT PRIMARY KEY,
+        last_message_id BIGINT NOT NULL
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS subscribers (user_id BIGINT PRIMARY KEY)",
+    """
+    CREATE TABLE IF NOT EXISTS subscribers_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version BIGINT NOT NULL
+    )
+    """,
+    """
+    INSERT INTO subscribers_version (id, version) VALUES (1, 0)
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS subscriber_filters (
+        user_id BIGINT NOT NULL,
+        kind TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (user_id, kind, value)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_subscriber_filters_kind_value
+    ON subscriber_filters (kind, value)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS notification_payloads (
+        analysis_id BIGINT PRIMARY KEY REFERENCES analyses (id),
+        text TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        analysis_id BIGINT NOT NULL REFERENCES analyses (id),
+        chat_id BIGINT NOT NULL,
+        -- pending / sent / dead; edit - отправленное уведомление
+        -- нужно отредактировать после правки поста
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at DOUBLE PRECISION NOT NULL,
+        last_error TEXT,
+        created_at TEXT NOT NULL,
+        sent_at TEXT,
+        sent_message_id BIGINT, -- ID сообщения бота в чате
+        UNIQUE (analysis_id, chat_id)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+    ON notification_outbox (status, next_attempt_at)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS backfill_state (
+        name TEXT PRIMARY KEY,
+        last_rowid BIGINT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        processed INTEGER NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_messages_unarchived_date
+    ON messages (date) WHERE archived_at IS NULL
+    """,
+]
+
+# Колонки, добавленные в версиях схемы после первой; базы, созданные
+# предыдущими версиями, догоняются так же, как в SQLite
+MIGRATION_COLUMNS = [
+    ("analyses", "degraded", "INTEGER NOT NULL DEFAULT 0"),
+    ("analyses", "model", "TEXT"),
+    ("analyses", "prompt_version", "TEXT"),
+    ("messages", "media", "TEXT"),
+    ("messages", "edited_at", "TEXT"),
+    ("notification_outbox", "sent_message_id", "BIGINT"),
+]
+
+# Произвольный ключ advisory-блокировки: схему обновляет один процесс
+SCHEMA_LOCK_ID = 7_246_019
+
+
+def _media_json(message: Dict[str, Any]) -> Optional[str]:
+    media = message.get("media")
+    return json.dumps(media, ensure_ascii=False) if media else None
+
+
+def _analysis_values(analysis: Dict[str, Any]) -> Tuple[Any, ...]:
+    """summary, sentiment, hashtags, degraded, model, prompt_version."""
+    return (
+        analysis.get("summary", ""),
+        analysis.get("sentiment", ""),
+        json.dumps(analysis.get("hashtags", [])),
+        int(bool(analysis.get("degraded"))),
+        analysis.get("model"),
+        analysis.get("prompt_version"),
+    )
+
+
+def _rowcount(status: str) -> int:
+    """Число строк из статуса команды asyncpg ('UPDATE 3')."""
+    return int(status.split()[-1])
+
+
+class PostgresStorage(StorageBackend):
+    """
+    Хранилище в PostgreSQL с пулом соединений asyncpg.
+
+    Интерфейс синхронный, как у DataManager: пул и запросы живут в event loop
+    отдельного потока, а методы передают в него корутины и ждут результата.
+    Синхронные методы - для CLI и потоков (выгрузка, повторный анализ);
+    сервисы в event loop приложения обращаются к хранилищу через aio,
+    и ожидание ответа сервера не останавливает их цикл. Несколько
+    процессов и узлов пишут в одну базу одновременно.
+    """
+
+    offload_calls = True
+
+    def __init__(self, dsn: str = config.DATABASE_URL):
+        self.dsn = dsn
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="postgres-storage", daemon=True
+        )
+        self._thread.start()
+        self.pool: Optional[asyncpg.Pool] = None
+        try:
+            self.pool = self._submit(self._create_pool())
+        except DB_ERRORS as e:
+            logger.error(f"Ошибка при подключении к PostgreSQL: {e}")
+            return
+        self._run(self._create_schema, None, "Ошибка при создании схемы PostgreSQL")
+        DB_POOL_SIZE.set_function(self.pool.get_size)
+        DB_POOL_IDLE.set_function(self.pool.get_idle_size)
+        logger.info(
+            f"PostgresStorage инициализирован: {self.pool.get_size()} соединений "
+            f"(до {config.DB_POOL_MAX_SIZE})"
+        )
+
+    async def _create_pool(self) -> asyncpg.Pool:
+        return await asyncpg.create_pool(
+            self.dsn,
+            min_size=config.DB_POOL_MIN_SIZE,
+            max_size=config.DB_POOL_MAX_SIZE,
+            command_timeout=config.DB_COMMAND_TIMEOUT_SECONDS,
+        )
+
+    def _submit(self, coro: Awaitable[Any]) -> Any:
+        """Выполняет корутину в потоке хранилища и ждет результата."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _with_connection(
+        self, query: Callable[[asyncpg.Connection], Awaitable[Any]], transaction: bool
+    ) -> Any:
+        async with self.pool.acquire() as conn:
+            if not transaction:
+                return await query(conn)
+            async with conn.transaction():
+                return await query(conn)
+
+    def _run(
+        self,
+        query: Callable[[asyncpg.Connection], Awaitable[Any]],
+        default: Any,
+        error: str,
+        transaction: bool = False,
+    ) -> Any:
+        """
+        Выполняет query(conn) на соединении из пула (в транзакции, если
+        transaction). При ошибке базы логирует error и возвращает default.
+        """
+        if not self.pool:
+            return default
+        try:
+            return self._submit(self._with_connection(query, transaction))
+        except DB_ERRORS as e:
+            logger.error(f"{error}: {e}")
+            return default
+
+    async def _create_schema(self, conn: asyncpg.Connection):
+        """Создает таблицы и обновляет схему до SCHEMA_VERSION."""
+        async with conn.transaction():
+            # Процессы, стартующие одновременно, создают схему по очереди
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK_ID)
+            for statement in SCHEMA_SQL:
+                await conn.execute(statement)
+            version = await conn.fetchval("SELECT version FROM schema_info")
+            if version is None or version < SCHEMA_VERSION:
+                for table, column, definition in MIGRATION_COLUMNS:
+                    await conn.execute(
+                        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}"
+                    )
+                await conn.execute(
+                    """
+                    INSERT INTO schema_info (id, version) VALUES (1, $1)
+                    ON CONFLICT (id) DO UPDATE SET version = excluded.version
+                    """,
+                    SCHEMA_VERSION,
+                )
+        logger.info(f"Схема PostgreSQL проверена (версия {SCHEMA_VERSION}).")
+
+    # --- Сообщения и анализы ---
+
+    @metrics.timed(DB_WRITE_SECONDS, "save_message")
+    def save_message(self, message: Dict[str, Any]):
+        """Сохраняет одно сообщение в базу данных."""
+
+        async def query(conn):
+            await conn.execute(
+                """
+                INSERT INTO messages (channel_id, message_id, text, date, media)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT DO NOTHING
+                """,
+                message.get("channel_id", ""),
+                message["id"],
+                message["text"],
+                message["date"],
+                _media_json(message),
+            )
+
+        self._run(query, None, f"Ошибка при сохранении сообщения {message.get('id')}")
+
+    @metrics.timed(DB_WRITE_SECONDS, "save_analysis")
+    def save_analysis(
+        self, channel_id: str, message_id: int, analysis: Dict[str, Any]
+    ) -> bool:
+        """Сохраняет анализ; повторный анализ заменяет прежний с тем же ID."""
+        if not isinstance(analysis, dict):
+            analysis = analysis.dict()
+        summary, sentiment, hashtags, degraded, model, prompt_version = (
+            _analysis_values(analysis)
+        )
+
+        async def query(conn):
+            await conn.execute(
+                """
+                INSERT INTO analyses
+                    (channel_id, message_id, summary, sentiment, hashtags,
+                     analysis_date, degraded, model, prompt_version)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                ON CONFLICT (channel_id, message_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    sentiment = excluded.sentiment,
+                    hashtags = excluded.hashtags,
+                    analysis_date = excluded.analysis_date,
+                    degraded = excluded.degraded,
+                    model = excluded.model,
+                    prompt_version = excluded.prompt_version
+                """,
+                channel_id,
+                message_id,
+                summary,
+                sentiment,
+                hashtags,
+                datetime.now().isoformat(),
+                degraded,
+                model,
+                prompt_version,
+            )
+            return True
+
+        return self._run(
+            query, False, f"Ошибка при сохранении анализа для сообщения {message_id}"
+        )
+
+    @metrics.timed(DB_WRITE_SECONDS, "save_processed_message")
+    def save_processed_message(
+        self,
+        channel_id: str,
+        message: Dict[str, Any],
+        analysis: Dict[str, Any],
+        notification_text: str,
+        chat_ids: List[int],
+    ) -> Optional[int]:
+        """
+        Одной транзакцией сохраняет сообщение, анализ, уведомления для чатов
+        и курсор канала. Строки очереди уведомлений загружаются через COPY.
+        """
+        if not isinstance(analysis, dict):
+            analysis = analysis.dict()
+        now = datetime.now().isoformat()
+
+        async def query(conn):
+            await conn.execute(
+                """
+                INSERT INTO messages
+                    (channel_id, message_id, text, date, media, edited_at)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT DO NOTHING
+                """,
+                channel_id,
+                message["id"],
+                message["text"],
+                message["date"],
+                _media_json(message),
+                message.get("edit_date"),
+            )
+            summary, sentiment, hashtags, degraded, model, prompt_version = (
+                _analysis_values(analysis)
+            )
+            analysis_id = await conn.fetchval(
+                """
+                INSERT INTO analyses
+                    (channel_id, message_id, summary, sentiment, hashtags,
+                     analysis_date, degraded, model, prompt_version)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                RETURNING id
+                """,
+                channel_id,
+                message["id"],
+                summary,
+                sentiment,
+                hashtags,
+                now,
+                degraded,
+                model,
+                prompt_version,
+            )
+            if chat_ids:
+                await conn.execute(
+                    "INSERT INTO notification_payloads (analysis_id, text) VALUES ($1, $2)",
+                    analysis_id,
+                    notification_text,
+                )
+                next_attempt_at = time.time()
+                # Анализ только что создан, поэтому конфликтов по
+                # (analysis_id, chat_id) нет и можно грузить через COPY
+                await conn.copy_records_to_table(
+                    "notification_outbox",
+                    columns=("analysis_id", "chat_id", "next_attempt_at", "created_at"),
+                    records=[
+                        (analysis_id, chat_id, next_attempt_at, now)
+                        for chat_id in dict.fromkeys(chat_ids)
+                    ],
+                )
+            await conn.execute(
+                """
+                INSERT INTO last_processed_ids (channel_id, last_message_id)
+                VALUES ($1, $2)
+                ON CONFLICT (channel_id) DO UPDATE
+                SET last_message_id = excluded.last_message_id
+                """,
+                # Для альбома курсор встает на его последнее сообщение
+                channel_id,
+                message.get("last_id", message["id"]),
+            )
+            return analysis_id
+
+        return self._run(
+            query,
+            None,
+            f"Ошибка при сохранении обработанного сообщения {message.get('id')}",
+            transaction=True,
+        )
+
+    def get_edit_candidates(
+        self, channel_id: str, message_ids: List[int]
+    ) -> Dict[int, Dict[str, Any]]:
+        """Проанализированные посты канала из message_ids для проверки правок."""
+        if not message_ids:
+            return {}
+
+        async def query(conn):
+            rows = await conn.fetch(
+                """
+                SELECT m.message_id, m.text, m.edited_at
+                FROM messages m
+                JOIN analyses a
+                    ON a.channel_id = m.channel_id AND a.message_id = m.message_id
+                WHERE m.channel_id = $1 AND m.message_id = ANY($2::bigint[])
+                """,
+                channel_id,
+                list(message_ids),
+            )
+            return {row["message_id"]: dict(row) for row in rows}
+
+        return self._run(query, {}, "Ошибка при чтении постов для проверки правок")
+
+    @metrics.timed(DB_WRITE_SECONDS, "mark_message_edited")
+    def mark_message_edited(self, channel_id: str, message_id: int, edited_at: str):
+        """Запоминает правку поста, не потребовавшую повторного анализа."""
+
+        async def query(conn):
+            await conn.execute(
+                """
+                UPDATE messages SET edited_at = $1
+                WHERE channel_id = $2 AND message_id = $3
+                """,
+                edited_at,
+                channel_id,
+                message_id,
+            )
+
+        self._run(query, None, f"Ошибка при отметке правки сообщения {message_id}")
+
+    @metrics.timed(DB_WRITE_SECONDS, "save_edited_analysis")
+    def save_edited_analysis(
+        self,
+        channel_id: str,
+        message_id: int,
+        text: str,
+        edited_at: str,
+        analysis: Dict[str, Any],
+        notification_text: str,
+    ) -> Optional[int]:
+        """
+        Одной транзакцией сохраняет правку поста, обновляет анализ на месте
+        и ставит отправленные уведомления в очередь на редактирование.
+        """
+        if not isinstance(analysis, dict):
+            analysis = analysis.dict()
+
+        async def query(conn):
+            await conn.execute(
+                """
+                UPDATE messages SET text = $1, edited_at = $2
+                WHERE channel_id = $3 AND message_id = $4
+                """,
+                text,
+                edited_at,
+                channel_id,
+                message_id,
+            )
+            summary, sentiment, hashtags, degraded, model, prompt_version = (
+                _analysis_values(analysis)
+            )
+            analysis_id = await conn.fetchval(
+                """
+                UPDATE analyses
+                SET summary = $1, sentiment = $2, hashtags = $3, analysis_date = $4,
+                    degraded = $5, model = $6, prompt_version = $7
+                WHERE channel_id = $8 AND message_id = $9
+                RETURNING id
+                """,
+                summary,
+                sentiment,
+                hashtags,
+                datetime.now().isoformat(),
+                degraded,
+                model,
+                prompt_version,
+                channel_id,
+                message_id,
+            )
+            if analysis_id is None:
+                return 0
+            await conn.execute(
+                "UPDATE notification_payloads SET text = $1 WHERE analysis_id = $2",
+                notification_text,
+                analysis_id,
+            )
+            status = await conn.execute(
+                """
+                UPDATE notification_outbox
+                SET status = 'edit', attempts = 0, next_attempt_at = $1,
+                    last_error = NULL
+                WHERE analysis_id = $2 AND status = 'sent'
+                  AND sent_message_id IS NOT NULL
+                """,
+                time.time(),
+                analysis_id,
+            )
+            return _rowcount(status)
+
+        return self._run(
+            query,
+            None,
+            f"Ошибка при сохранении анализа отредактированного сообщения {message_id}",
+            transaction=True,
+        )
+
+    def get_message_text(self, channel_id: str, message_id: int) -> Optional[str]:
+        """Возвращает текст сообщения из рабочей таблицы или из архива."""
+
+        async def query(conn):
+            row = await conn.fetchrow(
+                """
+                SELECT m.text, ar.text AS archived
+                FROM messages m
+                LEFT JOIN message_archive ar
+                    ON ar.channel_id = m.channel_id AND ar.message_id = m.message_id
+                WHERE m.channel_id = $1 AND m.message_id = $2
+                """,
+                channel_id,
+                message_id,
+            )
+            if row is None:
+                return None
+            if row["text"] is not None:
+                return row["text"]
+            if row["archived"] is None:
+                return None
+            return zlib.decompress(row["archived"]).decode("utf-8")
+
+        try:
+            return self._run(
+                query,
+                None,
+                f"Ошибка при чтении текста сообщения {channel_id}/{message_id}",
+            )
+        except zlib.error as e:
+            logger.error(
+                f"Ошибка при чтении текста сообщения {channel_id}/{message_id}: {e}"
+            )
+            return None
+
+    def get_last_message_id(self, channel_id: str) -> int:
+        """Возвращает ID последнего обработанного сообщения канала."""
+
+        async def query(conn):
+            value = await conn.fetchval(
+                "SELECT last_message_id FROM last_processed_ids WHERE channel_id = $1",
+                channel_id,
+            )
+            return value or 0
+
+        return self._run(
+            query, 0, "Ошибка при получении последнего ID сообщения из кэша"
+        )
+
+    @metrics.timed(DB_WRITE_SECONDS, "set_last_message_id")
+    def set_last_message_id(self, channel_id: str, last_message_id: int):
+        """Сохраняет ID последнего обработанного сообщения для канала."""
+
+        async def query(conn):
+            await conn.execute(
+                """
+                INSERT INTO last_processed_ids (channel_id, last_message_id)
+                VALUES ($1, $2)
+                ON CONFLICT (channel_id) DO UPDATE
+                SET last_message_id = excluded.last_message_id
+                """,
+                channel_id,
+                last_message_id,
+            )
+
+        self._run(
+            query,
+            None,
+            f"Ошибка при сохранении последнего ID сообщения для канала {channel_id}",
+        )
+
+    # --- Очередь уведомлений ---
+
+    def get_due_notifications(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Возвращает уведомления из очереди, время отправки которых наступило."""
+
+        async def query(conn):
+            rows = await conn.fetch(
+                """
+                SELECT o.id, o.analysis_id, o.chat_id, o.attempts, o.status,
+                       o.sent_message_id, p.text
+                FROM notification_outbox o
+                JOIN notification_payloads p ON p.analysis_id = o.analysis_id
+                WHERE o.status IN ('pending', 'edit') AND o.next_attempt_at <= $1
+                ORDER BY o.id
+                LIMIT $2
+                """,
+                time.time(),
+                limit,
+            )
+            return [dict(row) for row in rows]
+
+        return self._run(query, [], "Ошибка при чтении очереди уведомлений")
+
+    def get_next_notification_time(self) -> Optional[float]:
+        """Возвращает время ближайшей запланированной отправки или None."""
+
+        async def query(conn):
+            return await conn.fetchval(
+                """
+                SELECT MIN(next_attempt_at) FROM notification_outbox
+                WHERE status IN ('pending', 'edit')
+                """
+            )
+
+        return self._run(query, None, "Ошибка при чтении очереди уведомлений")
+
+    def count_pending_notifications(self) -> int:
+        """Возвращает число уведомлений, ожидающих доставки."""
+
+        async def query(conn):
+            return await conn.fetchval(
+                """
+                SELECT COUNT(*) FROM notification_outbox
+                WHERE status IN ('pending', 'edit')
+                """
+            )
+
+        return self._run(query, 0, "Ошибка при чтении очереди уведомлений")
+
+    @metrics.timed(DB_WRITE_SECONDS, "mark_notification_sent")
+    def mark_notification_sent(
+        self,
+        notification_id: int,
+        sent_message_id: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """Отмечает уведомление как доставленное; False при ошибке записи."""
+
+        async def query(conn):
+            await conn.execute(
+                """
+                UPDATE notification_outbox
+                SET status = 'sent', attempts = attempts + 1, sent_at = $1,
+                    last_error = $2,
+                    sent_message_id = COALESCE($3, sent_message_id)
+                WHERE id = $4
+                """,
+                datetime.now().isoformat(),
+                error,
+                sent_message_id,
+                notification_id,
+            )
+            return True
+
+        return self._run(
+            query,
+            False,
+            f"Ошибка при отметке уведомления {notification_id} как доставленного",
+        )
+
+    @metrics.timed(DB_WRITE_SECONDS, "reschedule_notification")
+    def reschedule_notification(
+        self,
+        notification_id: int,
+        next_attempt_at: float,
+        error: str,
+        count_attempt: bool = True,
+    ):
+        """Переносит уведомление на повторную попытку."""
+
+        async def query(conn):
+            await conn.execute(
+                """
+                UPDATE notification_outbox
+                SET attempts = attempts + $1, next_attempt_at = $2, last_error = $3
+                WHERE id = $4
+                """,
+                int(count_attempt),
+                next_attempt_at,
+                error,
+                notification_id,
+            )
+
+        self._run(query, None, f"Ошибка при переносе уведомления {notification_id}")
+
+    @metrics.timed(DB_WRITE_SECONDS, "mark_notification_dead")
+    def mark_notification_dead(self, notification_id: int, error: str):
+        """Переводит уведомление в dead-letter: больше оно не отправляется."""
+
+        async def query(conn):
+            await conn.execute(
+                """
+                UPDATE notification_outbox
+                SET status = 'dead', attempts = attempts + 1, last_error = $1
+                WHERE id = $2
+                """,
+                error,
+                notification_id,
+            )
+
+        self._run(
+            query,
+            None,
+            f"Ошибка при переводе уведомления {notification_id} в dead-letter",
+        )
+
+    @metrics.timed(DB_WRITE_SECONDS, "purge_sent_notifications")
+    def purge_sent_notifications(self, older_than_days: int):
+        """Удаляет доставленные уведомления старше указанного числа дней."""
+        cutoff = datetime.fromtimestamp(
+            time.time() - older_than_days * 86400
+        ).isoformat()
+
+        async def query(conn):
+            await conn.execute(
+                "DELETE FROM notification_outbox WHERE status = 'sent' AND sent_at < $1",
+                cutoff,
+            )
+            await conn.execute(
+                """
+                DELETE FROM notification_payloads p
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM notification_outbox o
+                    WHERE o.analysis_id = p.analysis_id
+                )
+                """
+            )
+
+        self._run(
+            query,
+            None,
+            "Ошибка при очистке очереди уведомлений",
+            transaction=True,
+        )
+
+    # --- Статистика, тренды, прогноз активности ---
+
+    def get_statistics(self) -> Dict[str, Any]:
+        """Возвращает статистику анализа из базы данных."""
+
+        async def query(conn):
+            total_messages = await conn.fetchval("SELECT COUNT(id) FROM analyses")
+            sentiment_counts = await conn.fetch(
+                "SELECT sentiment, COUNT(id) AS count FROM analyses GROUP BY sentiment"
+            )
+            # Хэштеги считаются в базе, без выгрузки всех анализов
+            hashtag_counts = await conn.fetch(
+                """
+                SELECT tag, COUNT(*) AS count
+                FROM analyses, jsonb_array_elements_text(
+                    COALESCE(hashtags, '[]')::jsonb
+                ) AS tag
+                GROUP BY tag
+                ORDER BY count DESC, tag
+                LIMIT 10
+                """
+            )
+            return {
+                "total_messages": total_messages,
+                "sentiment_counts": {
+                    row["sentiment"]: row["count"] for row in sentiment_counts
+                },
+                "popular_hashtags": [row["tag"] for row in hashtag_counts],
+            }
+
+        return self._run(query, {}, "Ошибка при получении статистики")
+
+    def get_hourly_activity(self, days: int = 28) -> Dict[Tuple[int, int], int]:
+        """
+        Число сообщений всех каналов за последние days дней по ключу
+        (день недели 0-6 с воскресенья, час UTC).
+        """
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+
+        async def query(conn):
+            rows = await conn.fetch(
+                """
+                SELECT EXTRACT(DOW FROM utc)::int AS weekday,
+                       EXTRACT(HOUR FROM utc)::int AS hour,
+                       COUNT(*) AS posts
+                FROM (
+                    SELECT date::timestamptz AT TIME ZONE 'UTC' AS utc
+                    FROM messages
+                    WHERE date >= $1
+                ) m
+                GROUP BY weekday, hour
+                """,
+                cutoff,
+            )
+            return {(row["weekday"], row["hour"]): row["posts"] for row in rows}
+
+        return self._run(query, {}, "Ошибка при подсчете активности каналов")
+
+    def get_trend_history(self, seconds: float) -> Optional[List[Dict[str, Any]]]:
+        """
+        Дата поста, хэштеги и summary анализов за последние seconds секунд
+        или None при ошибке.
+        """
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=seconds)).isoformat()
+
+        async def query(conn):
+            rows = await conn.fetch(
+                """
+                SELECT m.date, a.hashtags, a.summary
+                FROM analyses a
+                JOIN messages m
+                    ON m.channel_id = a.channel_id AND m.message_id = a.message_id
+                WHERE m.date >= $1
+                """,
+                cutoff,
+            )
+            return [
+                {
+                    "date": row["date"],
+                    "hashtags": json.loads(row["hashtags"] or "[]"),
+                    "summary": row["summary"],
+                }
+                for row in rows
+            ]
+
+        return self._run(query, None, "Ошибка при загрузке истории трендов")
+
+    # --- Повторный анализ и обучение классификатора ---
+
+    @staticmethod
+    def _backfill_filter(force: bool) -> str:
+        """Условие отбора сообщений, анализ которых устарел ($2, $3)."""
+        if force:
+            return ""
+        return """
+            AND (a.id IS NULL OR a.model IS DISTINCT FROM $2
+                 OR a.prompt_version IS DISTINCT FROM $3)
+        """
+
+    def count_backfill_pending(
+        self, after_rowid: int, model: str, prompt_version: str, force: bool = False
+    ) -> int:
+        """Сколько сообщений после after_rowid ждут повторного анализа."""
+        params = [after_rowid] if force else [after_rowid, model, prompt_version]
+
+        async def query(conn):
+            return await conn.fetchval(
+                f"""
+                SELECT COUNT(*)
+                FROM messages m
+                LEFT JOIN analyses a
+                    ON a.channel_id = m.channel_id AND a.message_id = m.message_id
+                WHERE m.rowid > $1 {self._backfill_filter(force)}
+                """,
+                *params,
+            )
+
+        return self._run(
+            query, 0, "Ошибка при подсчете сообщений для повторного анализа"
+        )
+
+    def get_backfill_batch(
+        self,
+        after_rowid: int,
+        model: str,
+        prompt_version: str,
+        limit: int = 100,
+        force: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Следующая пачка сообщений для повторного анализа в порядке rowid."""
+        params = [after_rowid] if force else [after_rowid, model, prompt_version]
+
+        async def query(conn):
+            rows = await conn.fetch(
+                f"""
+                SELECT m.rowid, m.channel_id, m.message_id, m.text, m.date
+                FROM messages m
+                LEFT JOIN analyses a
+                    ON a.channel_id = m.channel_id AND a.message_id = m.message_id
+                WHERE m.rowid > $1 {self._backfill_filter(force)}
+                ORDER BY m.rowid
+                LIMIT ${len(params) + 1}
+                """,
+                *params,
+                limit,
+            )
+            return [dict(row) for row in rows]
+
+        return self._run(
+            query, [], "Ошибка при выборке сообщений для повторного анализа"
+        )
+
+    def get_backfill_checkpoint(self, name: str) -> Optional[Dict[str, Any]]:
+        async def query(conn):
+            row = await conn.fetchrow(
+                "SELECT * FROM backfill_state WHERE name = $1", name
+            )
+            return dict(row) if row else None
+
+        return self._run(query, None, f"Ошибка при чтении контрольной точки '{name}'")
+
+    def set_backfill_checkpoint(
+        self,
+        name: str,
+        last_rowid: int,
+        model: str,
+        prompt_version: str,
+        processed: int,
+    ):
+        async def query(conn):
+            await conn.execute(
+                """
+                INSERT INTO backfill_state
+                    (name, last_rowid, model, prompt_version, processed, updated_at)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (name) DO UPDATE SET
+                    last_rowid = excluded.last_rowid,
+                    model = excluded.model,
+                    prompt_version = excluded.prompt_version,
+                    processed = excluded.processed,
+                    updated_at = excluded.updated_at
+                """,
+                name,
+                last_rowid,
+                model,
+                prompt_version,
+                processed,
+                datetime.now().isoformat(),
+            )
+
+        self._run(query, None, f"Ошибка при сохранении контрольной точки '{name}'")
+
+    def get_training_examples(self, limit: int = 50000) -> List[Dict[str, Any]]:
+        """Тексты с разметкой LLM (без анализов классификатора и архива)."""
+
+        async def query(conn):
+            rows = await conn.fetch(
+                """
+                SELECT m.text, a.sentiment, a.hashtags
+                FROM analyses a
+                JOIN messages m
+                    ON m.channel_id = a.channel_id AND m.message_id = a.message_id
+                WHERE a.degraded = 0 AND m.text IS NOT NULL
+                ORDER BY a.id
+                LIMIT $1
+                """,
+                limit,
+            )
+            return [
+                {
+                    "text": row["text"],
+                    "sentiment": row["sentiment"],
+                    "hashtags": json.loads(row["hashtags"] or "[]"),
+                }
+                for row in rows
+            ]
+
+        return self._run(query, [], "Ошибка при выборке данных для обучения")
+
+    # --- Подписчики ---
+
+    @staticmethod
+    async def _bump_subscribers_version(conn: asyncpg.Connection) -> int:
+        """Увеличивает счетчик изменений подписок. Вызывается внутри транзакции."""
+        return await conn.fetchval(
+            "UPDATE subscribers_version SET version = version + 1 RETURNING version"
+        )
+
+    def get_subscribers_version(self) -> int:
+        """Возвращает текущее значение счетчика изменений подписок."""
+
+        async def query(conn):
+            return await conn.fetchval("SELECT version FROM subscribers_version") or 0
+
+        return self._run(query, 0, "Ошибка при чтении версии подписок")
+
+    @metrics.timed(DB_WRITE_SECONDS, "add_subscriber")
+    def add_subscriber(self, user_id: int) -> Optional[int]:
+        """Добавляет пользователя в подписчики. Возвращает новую версию подписок."""
+
+        async def query(conn):
+            await conn.execute(
+                "INSERT INTO subscribers (user_id) VALUES ($1) ON CONFLICT DO NOTHING",
+                user_id,
+            )
+            return await self._bump_subscribers_version(conn)
+
+        version = self._run(
+            query,
+            None,
+            f"Ошибка при добавлении подписчика {user_id}",
+            transaction=True,
+        )
+        if version is not None:
+            logger.info(f"Пользователь {user_id} добавлен в подписчики.")
+        return version
+
+    @metrics.timed(DB_WRITE_SECONDS, "remove_subscriber")
+    def remove_subscriber(self, user_id: int) -> Optional[int]:
+        """Удаляет пользователя из подписчиков. Возвращает новую версию подписок."""
+
+        async def query(conn):
+            await conn.execute("DELETE FROM subscribers WHERE user_id = $1", user_id)
+            await conn.execute(
+                "DELETE FROM subscriber_filters WHERE user_id = $1", user_id
+            )
+            return await self._bump_subscribers_version(conn)
+
+        version = self._run(
+            query,
+            None,
+            f"Ошибка при удалении подписчика {user_id}",
+            transaction=True,
+        )
+        if version is not None:
+            logger.info(f"Пользователь {user_id} удален из подписчиков.")
+        return version
+
+    def is_subscriber(self, user_id: int) -> bool:
+        """Проверяет, является ли пользователь подписчиком."""
+
+        async def query(conn):
+            return (
+                await conn.fetchval(
+                    "SELECT 1 FROM subscribers WHERE user_id = $1", user_id
+                )
+                is not None
+            )
+
+        return self._run(
+            query, False, f"Ошибка при проверке подписки для пользователя {user_id}"
+        )
+
+    def get_all_subscribers(self) -> List[int]:
+        """Возвращает список ID всех подписчиков."""
+
+        async def query(conn):
+            rows = await conn.fetch("SELECT user_id FROM subscribers")
+            return [row["user_id"] for row in rows]
+
+        return self._run(query, [], "Ошибка при получении списка подписчиков")
+
+    @metrics.timed(DB_WRITE_SECONDS, "add_subscriber_filter")
+    def add_subscriber_filter(
+        self, user_id: int, kind: str, value: str
+    ) -> Optional[int]:
+        """Добавляет фильтр (хештег, канал или тональность) для подписчика."""
+
+        async def query(conn):
+            await conn.execute(
+                """
+                INSERT INTO subscriber_filters (user_id, kind, value)
+                VALUES ($1, $2, $3)
+                ON CONFLICT DO NOTHING
+                """,
+                user_id,
+                kind,
+                value,
+            )
+            return await self._bump_subscribers_version(conn)
+
+        return self._run(
+            query,
+            None,
+            f"Ошибка при добавлении фильтра {kind}={value} для подписчика {user_id}",
+            transaction=True,
+        )
+
+    @metrics.timed(DB_WRITE_SECONDS, "remove_subscriber_filter")
+    def remove_subscriber_filter(
+        self, user_id: int, kind: str, value: str
+    ) -> Optional[int]:
+        """Удаляет фильтр подписчика."""
+
+        async def query(conn):
+            await conn.execute(
+                """
+                DELETE FROM subscriber_filters
+                WHERE user_id = $1 AND kind = $2 AND value = $3
+                """,
+                user_id,
+                kind,
+                value,
+            )
+            return await self._bump_subscribers_version(conn)
+
+        return self._run(
+            query,
+            None,
+            f"Ошибка при удалении фильтра {kind}={value} для подписчика {user_id}",
+            transaction=True,
+        )
+
+    @metrics.timed(DB_WRITE_SECONDS, "clear_subscriber_filters")
+    def clear_subscriber_filters(self, user_id: int, kind: str) -> Optional[int]:
+        """Удаляет все фильтры подписчика указанного типа."""
+
+        async def query(conn):
+            await conn.execute(
+                "DELETE FROM subscriber_filters WHERE user_id = $1 AND kind = $2",
+                user_id,
+                kind,
+            )
+            return await self._bump_subscribers_version(conn)
+
+        return self._run(
+            query,
+            None,
+            f"Ошибка при сбросе фильтров {kind} для подписчика {user_id}",
+            transaction=True,
+        )
+
+    def get_all_subscriber_filters(self) -> List[Dict[str, Any]]:
+        """Возвращает все фильтры подписчиков в виде списка словарей."""
+
+        async def query(conn):
+            rows = await conn.fetch(
+                "SELECT user_id, kind, value FROM subscriber_filters"
+            )
+            return [dict(row) for row in rows]
+
+        return self._run(query, [], "Ошибка при получении фильтров подписчиков")
+
+    # --- Выгрузка и обслуживание ---
+
+    def iter_export_rows(
+        self,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        channels: Optional[List[str]] = None,
+        sentiments: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Построчно отдает сообщения с анализами для выгрузки.
+
+        Читает серверным курсором в read-only транзакции REPEATABLE READ:
+        все пачки берутся из одного снимка, а запись в базу не блокируется.
+        Тексты, перенесенные в архив, подставляются из message_archive.
+        date_to не включается в диапазон.
+        """
+        conditions = []
+        params: List[Any] = []
+
+        def add(condition: str, value: Any):
+            params.append(value)
+            conditions.append(condition.format(f"${len(params)}"))
+
+        if date_from:
+            add("m.date >= {}", date_from)
+        if date_to:
+            add("m.date < {}", date_to)
+        if channels:
+            add("m.channel_id = ANY({}::text[])", list(channels))
+        if sentiments:
+            add("a.sentiment = ANY({}::text[])", list(sentiments))
+        if tags:
+            add("COALESCE(a.hashtags, '[]')::jsonb ?| {}::text[]", list(tags))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"""
+            SELECT m.channel_id, m.message_id, m.date,
+                   m.text, ar.text AS archived,
+                   a.summary, a.sentiment, a.hashtags, a.degraded,
+                   a.model, a.prompt_version, a.analysis_date
+            FROM messages m
+            LEFT JOIN analyses a
+                ON a.channel_id = m.channel_id AND a.message_id = m.message_id
+            LEFT JOIN message_archive ar
+                ON m.text IS NULL
+               AND ar.channel_id = m.channel_id AND ar.message_id = m.message_id
+            {where}
+            ORDER BY m.date, m.channel_id, m.message_id
+        """
+
+        async def open_cursor():
+            conn = await self.pool.acquire()
+            transaction = conn.transaction(isolation="repeatable_read", readonly=True)
+            try:
+                await transaction.start()
+                cursor = await conn.cursor(sql, *params)
+            except BaseException:
+                await self.pool.release(conn)
+                raise
+            return conn, transaction, cursor
+
+        async def close_cursor(conn, transaction):
+            try:
+                await transaction.rollback()
+            finally:
+                await self.pool.release(conn)
+
+        if not self.pool:
+            return
+        try:
+            conn, transaction, cursor = self._submit(open_cursor())
+        except DB_ERRORS as e:
+            logger.error(f"Ошибка при выгрузке сообщений: {e}")
+            raise
+        try:
+            while True:
+                rows = self._submit(cursor.fetch(batch_size))
+                if not rows:
+                    break
+                for row in rows:
+                    item = dict(row)
+                    archived = item.pop("archived")
+                    if item["text"] is None and archived is not None:
+                        item["text"] = zlib.decompress(archived).decode("utf-8")
+                    item["hashtags"] = json.loads(item["hashtags"] or "[]")
+                    item["degraded"] = bool(item["degraded"])
+                    yield item
+        except (*DB_ERRORS, zlib.error) as e:
+            logger.error(f"Ошибка при выгрузке сообщений: {e}")
+            raise
+        finally:
+            self._submit(close_cursor(conn, transaction))
+
+    @metrics.timed(DB_WRITE_SECONDS, "archive_old_messages")
+    def archive_old_messages(self, older_than_days: int, limit: int = 500) -> int:
+        """
+        Переносит тексты сообщений старше указанного числа дней в таблицу
+        message_archive (сжатыми zlib) одной транзакцией. Строки, которые
+        переносит другой процесс, пропускаются (SKIP LOCKED).
+        """
+        cutoff = (
+            datetime.now(timezone.utc) - timedelta(days=older_than_days)
+        ).isoformat()
+
+        async def query(conn):
+            rows = await conn.fetch(
+                """
+                SELECT channel_id, message_id, text, date FROM messages
+                WHERE archived_at IS NULL AND date < $1
+                ORDER BY date
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+                """,
+                cutoff,
+                limit,
+            )
+            if not rows:
+                return 0
+            await conn.executemany(
+                """
+                INSERT INTO message_archive (channel_id, message_id, date, text)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (channel_id, message_id) DO UPDATE SET text = excluded.text
+                """,
+                [
+                    (
+                        row["channel_id"],
+                        row["message_id"],
+                        row["date"],
+                        zlib.compress((row["text"] or "").encode("utf-8")),
+                    )
+                    for row in rows
+                ],
+            )
+            now = datetime.now().isoformat()
+            await conn.executemany(
+                """
+                UPDATE messages SET text = NULL, archived_at = $1
+                WHERE channel_id = $2 AND message_id = $3
+                """,
+                [(now, row["channel_id"], row["message_id"]) for row in rows],
+            )
+            return len(rows)
+
+        moved = self._run(
+            query, 0, "Ошибка при переносе сообщений в архив", transaction=True
+        )
+        if moved:
+            logger.info(f"В архив перенесено сообщений: {moved}")
+        return moved
+
+    def incremental_vacuum(self, pages: int = 0) -> int:
+        """Место освобождает autovacuum PostgreSQL; здесь ничего не делается."""
+        return 0
+
+    def checkpoint_wal(self) -> bool:
+        """Журналом PostgreSQL управляет сервер; здесь ничего не делается."""
+        return True
+
+    def get_database_size(self) -> int:
+        """Размер базы данных в байтах."""
+
+        async def query(conn):
+            return await conn.fetchval("SELECT pg_database_size(current_database())")
+
+        return self._run(query, 0, "Ошибка при чтении размера базы данных")
+
+    def close(self):
+        """Закрывает пул соединений и поток хранилища."""
+        if self.pool:
+            self._submit(self.pool.close())
+            self.pool = None
+            logger.info("Соединения с базой данных закрыты.")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,204 @@
+# prefilter.py
+"""
+Дешевый предварительный фильтр перед анализом LLM.
+
+Отсекает посты, которые не стоит отправлять в модель: репосты (если это
+включено для канала), слишком короткие и emoji-only сообщения, явную
+рекламу по маркерам и посты, набравшие высокий "рекламный" балл по простым признакам (ключевые слова,
+ссылки, упоминания, emoji, восклицательные знаки). Проверка занимает
+микросекунды и не требует внешних зависимостей.
+
+Правила задаются по умолчанию и переопределяются для отдельных каналов
+в JSON-файле config.PREFILTER_RULES_PATH:
+
+    {
+        "default": {"min_length": 40},
+        "channels": {"digest_channel": {"skip_forwards": true, "max_links": 5}}
+    }
+
+В режиме dry-run фильтр только считает и логирует срабатывания,
+пропуская все сообщения дальше.
+"""
+import json
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Optional
+from logger import get_logger
+import config
+import metrics
+
+logger = get_logger()
+
+PREFILTER_HITS = metrics.Counter(
+    "newsbot_prefilter_hits_total",
+    "Срабатывания правил предварительного фильтра",
+    ["channel", "rule", "mode"],
+)
+
+RULE_FORWARD = "forward"
+RULE_MIN_LENGTH = "min_length"
+RULE_BLOCK_PATTERN = "block_pattern"
+RULE_LINKS = "links"
+RULE_AD_SCORE = "ad_score"
+
+DEFAULT_RULES: Dict[str, Any] = {
+    "enabled": True,
+    # Репосты из других каналов (fwd_from в Telethon); включается для
+    # отдельных каналов, так как новостные каналы часто репостят друг друга
+    "skip_forwards": False,
+    # Минимум букв в тексте без ссылок: отсекает emoji-only и однострочные посты
+    "min_length": 40,
+    # Больше ссылок - скорее подборка или реклама, чем новость
+    "max_links": 3,
+    # Явные маркеры рекламы (регулярные выражения в нижнем регистре):
+    # одного совпадения достаточно
+    "block_patterns": [r"#реклам", r"\berid\b", r"на правах рекламы"],
+    # Слабые признаки рекламы (регулярные выражения в нижнем регистре):
+    # каждое совпадение добавляет к баллу. Только рекламные обороты с
+    # границами слов: основы вроде "подпис" или "акци" встречаются и в
+    # обычных новостях ("подписал указ", "акции компании")
+    "ad_keywords": [
+        r"\bподпиш(?:ись|итесь)\b",
+        r"\bпромокод",
+        r"\bрозыгрыш",
+        r"\bскидк",
+        r"\bпереходи(?:те)?\b",
+        r"\bжми(?:те)?\b",
+        r"\bбесплатн",
+        r"\bуспей(?:те)?\b",
+    ],
+    "ad_score_threshold": 3.0,
+}
+
+# Проверки выполняются по тексту в нижнем регистре: регулярные выражения
+# без IGNORECASE на кириллице в несколько раз быстрее
+_LINK_RE = re.compile(r"(?:https?://|www\.|t\.me/)\S+")
+_MENTION_RE = re.compile(r"@\w{4,}")
+# Основные диапазоны emoji и пиктограмм
+_EMOJI_RE = re.compile("[\U0001f000-\U0001faff☀-➿⬀-⯿]")
+
+
+class _ChannelRules:
+    """Правила канала с заранее скомпилированными регулярными выражениями."""
+
+    def __init__(self, rules: Dict[str, Any]):
+        self.enabled = bool(rules["enabled"])
+        self.skip_forwards = bool(rules["skip_forwards"])
+        self.min_length = int(rules["min_length"])
+        self.max_links = int(rules["max_links"])
+        self.ad_score_threshold = float(rules["ad_score_threshold"])
+        self.block_re = (
+            re.compile("|".join(rules["block_patterns"]))
+            if rules["block_patterns"]
+            else None
+        )
+        self.keywords_re = (
+            re.compile("|".join(rules["ad_keywords"])) if rules["ad_keywords"] else None
+        )
+
+
+class PreFilter:
+    def __init__(
+        self,
+        rules_path: str = config.PREFILTER_RULES_PATH,
+        enabled: bool = config.PREFILTER_ENABLED,
+        dry_run: bool = config.PREFILTER_DRY_RUN,
+    ):
+        self.enabled = enabled
+        self.dry_run = dry_run
+        self.hits: Counter = Counter()
+        self._default = DEFAULT_RULES
+        self._overrides: Dict[str, Dict[str, Any]] = {}
+        self._compiled: Dict[str, _ChannelRules] = {}
+        self._load(rules_path)
+
+    def _load(self, rules_path: str):
+        if not rules_path or not os.path.exists(rules_path):
+            return
+        try:
+            with open(rules_path, encoding="utf-8") as f:
+                data = json.load(f)
+            self._default = {**DEFAULT_RULES, **data.get("default", {})}
+            self._overrides = data.get("channels", {})
+            logger.info(
+                f"Правила предфильтра загружены из {rules_path} "
+                f"(переопределений для каналов: {len(self._overrides)})"
+            )
+        except (OSError, ValueError) as e:
+            logger.error(f"Не удалось загрузить правила предфильтра {rules_path}: {e}")
+
+    def _rules(self, channel_id: str) -> _ChannelRules:
+        rules = self._compiled.get(channel_id)
+        if rules is None:
+            rules = _ChannelRules(
+                {**self._default, **self._overrides.get(channel_id, {})}
+            )
+            self._compiled[channel_id] = rules
+        return rules
+
+    @staticmethod
+    def ad_score(text: str, links: int, rules: _ChannelRules) -> float:
+        """Линейный балл "рекламности" по слабым признакам."""
+        score = 0.0
+        if rules.keywords_re is not None:
+            score += len(rules.keywords_re.findall(text))
+        score += 0.5 * max(links - 1, 0)
+        score += 0.5 * len(_MENTION_RE.findall(text))
+        emoji = len(_EMOJI_RE.findall(text))
+        if text and emoji / len(text) > 0.05:
+            score += 1.0
+        if text.count("!") >= 3:
+            score += 0.5
+        return score
+
+    def match(self, channel_id: str, message: Dict[str, Any]) -> Optional[str]:
+        """Возвращает имя первого сработавшего правила или None."""
+        rules = self._rules(channel_id)
+        if not rules.enabled:
+            return None
+        if rules.skip_forwards and message.get("is_forward"):
+            return RULE_FORWARD
+        text = (message.get("text") or "").lower()
+        if rules.block_re is not None and rules.block_re.search(text):
+            return RULE_BLOCK_PATTERN
+        links = len(_LINK_RE.findall(text))
+        if links > rules.max_links:
+            return RULE_LINKS
+        text_without_links = _LINK_RE.sub("", text) if links else text
+        if sum(map(str.isalpha, text_without_links)) < rules.min_length:
+            return RULE_MIN_LENGTH
+        if self.ad_score(text, links, rules) >= rules.ad_score_threshold:
+            return RULE_AD_SCORE
+        return None
+
+    def check(self, channel_id: str, message: Dict[str, Any]) -> Optional[str]:
+        """
+        Проверяет сообщение. Возвращает правило, по которому сообщение
+        нужно пропустить, или None, если его надо анализировать.
+        В dry-run режиме всегда возвращает None.
+        """
+        if not self.enabled:
+            return None
+        rule = self.match(channel_id, message)
+        if rule is None:
+            return None
+        mode = "dry_run" if self.dry_run else "skip"
+        self.hits[(channel_id, rule)] += 1
+        PREFILTER_HITS.inc(channel_id, rule, mode)
+        if self.dry_run:
+            logger.info(
+                f"[dry-run] Сообщение ID {message.get('id')} из '{channel_id}' "
+                f"было бы пропущено правилом '{rule}'."
+            )
+            return None
+        return rule
+
+    def summary(self, channel_id: str) -> str:
+        """Срабатывания правил по каналу с момента запуска, для логов."""
+        counts = [
+            f"{rule}={count}"
+            for (channel, rule), count in sorted(self.hits.items())
+            if channel == channel_id
+        ]
+        return ", ".join(counts) if counts else "нет"
@@ -0,0 +1,124 @@
+# prompt_builder.py
+"""
+Построение промптов с контролем размера.
+
+Длинные посты (например, вставленные целиком статьи) сильно увеличивают
+время инференса и могут не поместиться в контекст модели. Здесь текст
+оценивается в токенах и при необходимости сокращается до бюджета:
+сначала извлекаются ключевые предложения, и только если этого мало,
+текст обрезается по границе слова.
+"""
+import math
+import re
+import zlib
+from collections import Counter
+from string import Formatter
+from typing import Dict, List, Tuple
+import config
+
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?…])\s+|\n+")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Короткие служебные слова почти не несут смысла для выбора предложений
+_MIN_CONTENT_WORD_LEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов по количеству символов."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / config.LLM_CHARS_PER_TOKEN)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Обрезает текст до бюджета по границе слова."""
+    max_chars = int(max_tokens * config.LLM_CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut.rstrip() + "…"
+
+
+def extract_key_sentences(text: str, max_tokens: int) -> str:
+    """
+    Оставляет наиболее информативные предложения, укладывающиеся в бюджет.
+
+    Предложения оцениваются по частоте содержательных слов текста с бонусом
+    за позицию: в новостях главное обычно сказано в начале. Выбранные
+    предложения возвращаются в исходном порядке.
+    """
+    sentences = [s.strip() for s in _SENTENCE_SPLIT_RE.split(text) if s.strip()]
+    if len(sentences) <= 1:
+        return _truncate(text, max_tokens)
+
+    words_per_sentence = [
+        [w for w in _WORD_RE.findall(s.lower()) if len(w) >= _MIN_CONTENT_WORD_LEN]
+        for s in sentences
+    ]
+    frequencies = Counter(w for words in words_per_sentence for w in words)
+
+    scored: List[Tuple[float, int]] = []
+    for i, words in enumerate(words_per_sentence):
+        score = sum(frequencies[w] for w in words) / math.sqrt(len(words) + 1)
+        score *= 1.0 + 1.0 / (i + 1)  # бонус за позицию
+        scored.append((score, i))
+
+    selected = []
+    used = 0
+    for _, i in sorted(scored, reverse=True):
+        cost = estimate_tokens(sentences[i]) + 1
+        if used + cost > max_tokens:
+            continue
+        selected.append(i)
+        used += cost
+
+    if not selected:
+        return _truncate(sentences[0], max_tokens)
+    return " ".join(sentences[i] for i in sorted(selected))
+
+
+def fit_to_budget(text: str, max_tokens: int) -> Tuple[str, bool]:
+    """Возвращает текст, укладывающийся в бюджет, и признак сокращения."""
+    if estimate_tokens(text) <= max_tokens:
+        return text, False
+    return extract_key_sentences(text, max_tokens), True
+
+
+class PromptTemplate:
+    """
+    Шаблон промпта, разобранный один раз при создании.
+
+    Статическая часть шаблона оценивается в токенах заранее, поэтому при
+    каждом вызове остается посчитать только подставляемый текст.
+    """
+
+    def __init__(self, template: str, budget_field: str):
+        self.budget_field = budget_field
+        # Меняется вместе с текстом шаблона: сохраняется с каждым анализом
+        self.version = f"{zlib.crc32(template.encode('utf-8')):08x}"
+        self._parts: List[Tuple[str, str]] = [
+            (literal, field or "")
+            for literal, field, _, _ in Formatter().parse(template)
+        ]
+        self.static_tokens = estimate_tokens(
+            "".join(literal for literal, _ in self._parts)
+        )
+
+    def render(self, values: Dict[str, str]) -> str:
+        return "".join(
+            literal + (values[field] if field else "") for literal, field in self._parts
+        )
+
+    def build(self, max_prompt_tokens: int, values: Dict[str, str]) -> Tuple[str, bool]:
+        """
+        Подставляет значения, сокращая поле budget_field так, чтобы весь
+        промпт уложился в max_prompt_tokens. Возвращает промпт и признак сокращения.
+        """
+        fixed_tokens = self.static_tokens + sum(
+            estimate_tokens(v) for k, v in values.items() if k != self.budget_field
+        )
+        budget = max(max_prompt_tokens - fixed_tokens, config.LLM_MIN_INPUT_TOKENS)
+        text, truncated = fit_to_budget(values[self.budget_field], budget)
+        return self.render({**values, self.budget_field: text}), truncated
@@ -0,0 +1,252 @@
+# rate_limiter.py
+import asyncio
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from aiogram import BaseMiddleware, types
+from aiogram.dispatcher.flags import get_flag
+from logger import get_logger
+import config
+import metrics
+
+logger = get_logger()
+
+RATE_LIMIT_REQUESTS = metrics.Counter(
+    "newsbot_rate_limit_requests_total",
+    "Запросы к командам с LLM и веб-поиском по результату проверки лимитов",
+    ["command", "result"],
+)
+RATE_LIMIT_ACTIVE = metrics.Gauge(
+    "newsbot_rate_limit_active_requests", "Выполняющиеся запросы к LLM и веб-поиску"
+)
+RATE_LIMIT_BUCKETS = metrics.Gauge(
+    "newsbot_rate_limit_buckets", "Отслеживаемые корзины токенов", ["scope"]
+)
+
+# Флаг обработчика: @dp.message(..., flags={RATE_LIMIT_FLAG: "chat"})
+RATE_LIMIT_FLAG = "rate_limit"
+
+_SPACES_RE = re.compile(r"\s+")
+
+
+async def call_directly(factory: Callable[[], Awaitable[Any]]) -> Any:
+    """Значение coalesce по умолчанию: без ограничений и объединения."""
+    return await factory()
+
+
+class TokenBucket:
+    """
+    Корзины токенов по ключам: rate токенов в секунду, не больше burst.
+
+    Хранится только время и остаток для ключей, которые недавно тратили
+    токены: корзина, успевшая заполниться, удаляется при очистке, так как
+    новая создается полной.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[Hashable, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _tokens(self, key: Hashable, now: float) -> float:
+        state = self._buckets.get(key)
+        if state is None:
+            return self.burst
+        tokens, updated = state
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def retry_after(self, key: Hashable, now: float) -> float:
+        """Через сколько секунд у ключа появится токен (0 - уже есть)."""
+        missing = 1.0 - self._tokens(key, now)
+        return max(missing, 0.0) / self.rate if self.rate > 0 else float("inf")
+
+    def consume(self, key: Hashable, now: float):
+        self._buckets[key] = (self._tokens(key, now) - 1.0, now)
+
+    def prune(self, now: float):
+        """Удаляет заполнившиеся корзины."""
+        full_after = self.burst / self.rate if self.rate > 0 else float("inf")
+        self._buckets = {
+            key: state
+            for key, state in self._buckets.items()
+            if now - state[1] < full_after
+        }
+
+
+class _Shared:
+    """
+    Общий результат одинаковых запросов, переданный обработчику как coalesce.
+
+    Первый запрос ("ведущий") выполняет вызов и публикует результат,
+    остальные, пришедшие пока он выполняется, ждут его вместо повторного
+    обращения к LLM.
+    """
+
+    def __init__(self, future: asyncio.Future, leader: bool):
+        self.future = future
+        self.leader = leader
+
+    async def __call__(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.leader:
+            try:
+                return await asyncio.shield(self.future)
+            except asyncio.CancelledError:
+                if not self.future.cancelled():
+                    raise
+                # Ведущий запрос не получил результат - выполняем свой
+                return await factory()
+        try:
+            result = await factory()
+        except BaseException:
+            self.future.cancel()
+            raise
+        if not self.future.done():
+            self.future.set_result(result)
+        return result
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """
+    Ограничивает команды, которые обращаются к LLM или веб-поиску.
+
+    Применяется к обработчикам с флагом rate_limit. Каждый запрос тратит
+    токен из корзины пользователя и корзины чата; одновременно выполняется
+    не больше max_concurrent разных запросов, чтобы чат с ботом не занимал
+    Ollama в ущерб анализу новостей. Одинаковые запросы (та же команда
+    с тем же текстом), пришедшие во время выполнения первого, получают его
+    результат через параметр обработчика coalesce и лимит параллельности
+    не занимают. Отклоненный запрос получает короткий ответ "попробуйте
+    позже" (не чаще раза за время пополнения корзины).
+    """
+
+    def __init__(
+        self,
+        user_per_minute: float = config.RATE_LIMIT_USER_PER_MINUTE,
+        user_burst: float = config.RATE_LIMIT_USER_BURST,
+        chat_per_minute: float = config.RATE_LIMIT_CHAT_PER_MINUTE,
+        chat_burst: float = config.RATE_LIMIT_CHAT_BURST,
+        max_concurrent: int = config.RATE_LIMIT_MAX_CONCURRENT,
+        exempt_user_ids=frozenset(config.ADMIN_USER_IDS),
+    ):
+        self.users = TokenBucket(user_per_minute / 60, user_burst)
+        self.chats = TokenBucket(chat_per_minute / 60, chat_burst)
+        self.max_concurrent = max_concurrent
+        self.exempt_user_ids = exempt_user_ids
+        self.active = 0
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        # Когда пользователю последний раз отвечали об ограничении
+        self._notified: Dict[int, float] = {}
+        self._pruned_at = time.monotonic()
+
+    @staticmethod
+    def request_key(command: str, message: types.Message, data: Dict[str, Any]):
+        """Ключ для объединения запросов: команда и нормализованный текст."""
+        command_object = data.get("command")
+        text = command_object.args if command_object else message.text
+        return command, _SPACES_RE.sub(" ", (text or "").strip().lower())
+
+    @property
+    def _notice_interval(self) -> float:
+        """Как часто напоминать пользователю об ограничении."""
+        return 1 / self.users.rate if self.users.rate > 0 else 60.0
+
+    def _prune(self, now: float):
+        if now - self._pruned_at < 60:
+            return
+        self._pruned_at = now
+        self.users.prune(now)
+        self.chats.prune(now)
+        RATE_LIMIT_BUCKETS.set(len(self.users), "user")
+        RATE_LIMIT_BUCKETS.set(len(self.chats), "chat")
+        self._notified = {
+            user_id: at
+            for user_id, at in self._notified.items()
+            if now - at < self._notice_interval
+        }
+
+    def _check_buckets(
+        self, user_id: int, chat_id: int, now: float
+    ) -> Optional[Tuple[str, float]]:
+        """Тратит по токену пользователя и чата или возвращает причину отказа."""
+        if user_id in self.exempt_user_ids:
+            return None
+        wait = self.users.retry_after(user_id, now)
+        if wait > 0:
+            return "user_limited", wait
+        wait = self.chats.retry_after(chat_id, now)
+        if wait > 0:
+            return "chat_limited", wait
+        self.users.consume(user_id, now)
+        self.chats.consume(chat_id, now)
+        RATE_LIMIT_BUCKETS.set(len(self.users), "user")
+        RATE_LIMIT_BUCKETS.set(len(self.chats), "chat")
+        return None
+
+    async def _reject(self, message: types.Message, user_id: int, text: str):
+        now = time.monotonic()
+        if now - self._notified.get(user_id, float("-inf")) < self._notice_interval:
+            return
+        self._notified[user_id] = now
+        await message.answer(text)
+
+    async def __call__(
+        self,
+        handler: Callable[[types.Message, Dict[str, Any]], Awaitable[Any]],
+        event: types.Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        command = get_flag(data, RATE_LIMIT_FLAG)
+        if not command:
+            return await handler(event, data)
+
+        key = self.request_key(command, event, data)
+        if not key[1]:
+            # Пустой запрос: обработчик только подскажет формат команды
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._prune(now)
+        chat_id = event.chat.id
+        user_id = event.from_user.id if event.from_user else chat_id
+
+        rejected = self._check_buckets(user_id, chat_id, now)
+        if rejected:
+            reason, wait = rejected
+            RATE_LIMIT_REQUESTS.inc(command, reason)
+            await self._reject(
+                event,
+                user_id,
+                f"⏳ Слишком много запросов. Попробуйте через {max(1, round(wait))} с.",
+            )
+            return None
+
+        future = self._inflight.get(key)
+        if future is not None:
+            RATE_LIMIT_REQUESTS.inc(command, "coalesced")
+            data["coalesce"] = _Shared(future, leader=False)
+            return await handler(event, data)
+
+        if self.active >= self.max_concurrent:
+            RATE_LIMIT_REQUESTS.inc(command, "overloaded")
+            await self._reject(
+                event, user_id, "⏳ Сервис сейчас загружен. Попробуйте чуть позже."
+            )
+            return None
+
+        RATE_LIMIT_REQUESTS.inc(command, "allowed")
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        self.active += 1
+        RATE_LIMIT_ACTIVE.set(self.active)
+        data["coalesce"] = _Shared(future, leader=True)
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            RATE_LIMIT_ACTIVE.set(self.active)
+            del self._inflight[key]
+            # Обработчик мог завершиться, не вызвав coalesce
+            if not future.done():
+                future.cancel()
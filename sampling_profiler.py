@@ -0,0 +1,91 @@
+# sampling_profiler.py
+"""
+Сэмплирующий профилировщик для работающего процесса.
+
+Фоновый поток с заданным интервалом снимает стеки всех потоков
+(event loop, пул executor-а, Telethon и т.д.) через sys._current_frames()
+и считает одинаковые стеки. Результат отдается в "collapsed" формате
+(одна строка "кадр;кадр;кадр количество" на стек), который открывают
+speedscope.app и flamegraph.pl.
+
+Пока профилировщик не запущен, в процессе нет ни потока, ни хуков
+трассировки, поэтому накладные расходы нулевые.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, max_duration: float):
+        """Запускает сбор стеков не дольше max_duration секунд."""
+        if self.running:
+            raise RuntimeError("Профилировщик уже запущен")
+        self.samples = 0
+        self._stacks = Counter()
+        self._stop_event.clear()
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(self.started_at + max_duration,),
+            name="sampling-profiler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> str:
+        """Останавливает сбор и возвращает стеки в collapsed формате."""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        return self.collapsed()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at if self.started_at else 0.0
+
+    def _run(self, deadline: float):
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            if time.monotonic() >= deadline:
+                break
+            self._sample(own_ident)
+
+    def _sample(self, own_ident: int):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                # Первая строка функции, а не текущая: стеки одной функции
+                # склеиваются в один столбец флеймграфа
+                stack.append(
+                    f"{code.co_name} "
+                    f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self._stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self._stacks.most_common()
+        )
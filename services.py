@@ -5,18 +5,38 @@
 """
 from logger import get_logger
 from llm_analyzer import OllamaAnalyzer
-from data_manager import DataManager
+from storage import create_storage
 from tavily_search import TavilySearch
 from telegram_monitor import TelegramMonitor
+from subscriber_registry import SubscriberRegistry
+from subscriber_router import SubscriberRouter
+from loop_watchdog import LoopWatchdog
+from prefilter import PreFilter
+from model_keeper import ModelKeeper
+from trend_detector import TrendDetector
+import config
 
 logger = get_logger()
 
 try:
     # Инициализация всех сервисов в одном месте
     llm_analyzer = OllamaAnalyzer()
-    data_manager = DataManager()
+    data_manager = create_storage()
+    model_keeper = ModelKeeper(llm_analyzer, data_manager)
+    subscriber_registry = SubscriberRegistry(data_manager)
+    subscriber_router = SubscriberRouter(data_manager, subscriber_registry)
+    # Счетчики трендов восстанавливаются из базы при запуске (main.py)
+    trend_detector = TrendDetector()
     tavily_search = TavilySearch()
-    telegram_monitor = TelegramMonitor()
+    # Клиент Telethon держит файл сессии: процессы, которые только
+    # обрабатывают команды бота (APP_ROLE=bot), его не открывают
+    telegram_monitor = TelegramMonitor() if config.APP_ROLE != "bot" else None
+    prefilter = PreFilter()
+    loop_watchdog = LoopWatchdog(
+        interval=config.LOOP_WATCHDOG_INTERVAL_SECONDS,
+        slow_threshold=config.LOOP_SLOW_THRESHOLD_SECONDS,
+        unhealthy_threshold=config.LOOP_UNHEALTHY_SECONDS,
+    )
     logger.info("Все сервисы успешно инициализированы.")
 
 except Exception as e:
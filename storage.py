@@ -0,0 +1,305 @@
+# storage.py
+"""
+Интерфейс хранилища и выбор реализации по DATABASE_URL.
+
+SQLite (путь к файлу) - DataManager из data_manager.py, PostgreSQL
+(postgresql://...) - PostgresStorage из postgres_storage.py. Остальной код
+работает с хранилищем только через методы StorageBackend.
+"""
+import asyncio
+import functools
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import config
+
+POSTGRES_SCHEMES = ("postgres://", "postgresql://")
+
+
+class StorageBackend(ABC):
+    """
+    Методы хранилища, которыми пользуются сервисы. Все методы синхронные:
+    ошибки базы логируются, а методы возвращают значение по умолчанию
+    (None, 0, пустой список), как описано в DataManager.
+
+    Из корутин хранилище вызывается через storage.aio: те же методы,
+    но с await, чтобы запрос к серверной базе не останавливал event loop.
+    """
+
+    # True: вызов может ждать сеть, и из корутин его выполняют в потоке.
+    # False: запросы быстрые и привязаны к потоку (соединение SQLite)
+    offload_calls = False
+
+    @functools.cached_property
+    def aio(self) -> "AsyncStorage":
+        """Асинхронный доступ к методам хранилища для event loop."""
+        return AsyncStorage(self)
+
+    # --- Сообщения и анализы ---
+
+    @abstractmethod
+    def save_message(self, message: Dict[str, Any]):
+        """Сохраняет одно сообщение."""
+
+    @abstractmethod
+    def save_analysis(
+        self, channel_id: str, message_id: int, analysis: Dict[str, Any]
+    ) -> bool:
+        """Сохраняет или заменяет анализ сообщения с сохранением его ID."""
+
+    @abstractmethod
+    def save_processed_message(
+        self,
+        channel_id: str,
+        message: Dict[str, Any],
+        analysis: Dict[str, Any],
+        notification_text: str,
+        chat_ids: List[int],
+    ) -> Optional[int]:
+        """Атомарно сохраняет пост, анализ, уведомления и курсор канала."""
+
+    @abstractmethod
+    def get_edit_candidates(
+        self, channel_id: str, message_ids: List[int]
+    ) -> Dict[int, Dict[str, Any]]:
+        """Проанализированные посты канала для проверки правок."""
+
+    @abstractmethod
+    def mark_message_edited(self, channel_id: str, message_id: int, edited_at: str):
+        """Запоминает правку поста без повторного анализа."""
+
+    @abstractmethod
+    def save_edited_analysis(
+        self,
+        channel_id: str,
+        message_id: int,
+        text: str,
+        edited_at: str,
+        analysis: Dict[str, Any],
+        notification_text: str,
+    ) -> Optional[int]:
+        """Сохраняет правку поста с новым анализом; число уведомлений к правке."""
+
+    @abstractmethod
+    def get_message_text(self, channel_id: str, message_id: int) -> Optional[str]:
+        """Текст сообщения из рабочей базы или из архива."""
+
+    @abstractmethod
+    def get_last_message_id(self, channel_id: str) -> int:
+        """Курсор канала: ID последнего обработанного сообщения."""
+
+    @abstractmethod
+    def set_last_message_id(self, channel_id: str, last_message_id: int):
+        """Сдвигает курсор канала."""
+
+    # --- Очередь уведомлений ---
+
+    @abstractmethod
+    def get_due_notifications(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Уведомления, время отправки которых наступило."""
+
+    @abstractmethod
+    def get_next_notification_time(self) -> Optional[float]:
+        """Время ближайшей запланированной отправки."""
+
+    @abstractmethod
+    def count_pending_notifications(self) -> int:
+        """Число уведомлений, ожидающих доставки."""
+
+    @abstractmethod
+    def mark_notification_sent(
+        self,
+        notification_id: int,
+        sent_message_id: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> bool:
+        """Отмечает уведомление доставленным; False, если записать не удалось."""
+
+    @abstractmethod
+    def reschedule_notification(
+        self,
+        notification_id: int,
+        next_attempt_at: float,
+        error: str,
+        count_attempt: bool = True,
+    ):
+        """Переносит уведомление на повторную попытку."""
+
+    @abstractmethod
+    def mark_notification_dead(self, notification_id: int, error: str):
+        """Переводит уведомление в dead-letter."""
+
+    @abstractmethod
+    def purge_sent_notifications(self, older_than_days: int):
+        """Удаляет давно доставленные уведомления."""
+
+    # --- Статистика, тренды, прогноз активности ---
+
+    @abstractmethod
+    def get_statistics(self) -> Dict[str, Any]:
+        """Число анализов, тональности и популярные хэштеги."""
+
+    @abstractmethod
+    def get_hourly_activity(self, days: int = 28) -> Dict[Tuple[int, int], int]:
+        """Число сообщений по (день недели с воскресенья, час UTC)."""
+
+    @abstractmethod
+    def get_trend_history(self, seconds: float) -> Optional[List[Dict[str, Any]]]:
+        """
+        Дата, хэштеги и summary анализов за последние seconds секунд или
+        None при ошибке базы (в отличие от пустого списка, когда анализов нет).
+        """
+
+    # --- Повторный анализ и обучение классификатора ---
+
+    @abstractmethod
+    def count_backfill_pending(
+        self, after_rowid: int, model: str, prompt_version: str, force: bool = False
+    ) -> int:
+        """Сколько сообщений после after_rowid ждут повторного анализа."""
+
+    @abstractmethod
+    def get_backfill_batch(
+        self,
+        after_rowid: int,
+        model: str,
+        prompt_version: str,
+        limit: int = 100,
+        force: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Следующая пачка сообщений для повторного анализа в порядке сохранения."""
+
+    @abstractmethod
+    def get_backfill_checkpoint(self, name: str) -> Optional[Dict[str, Any]]:
+        """Контрольная точка повторного анализа."""
+
+    @abstractmethod
+    def set_backfill_checkpoint(
+        self,
+        name: str,
+        last_rowid: int,
+        model: str,
+        prompt_version: str,
+        processed: int,
+    ):
+        """Сохраняет контрольную точку повторного анализа."""
+
+    @abstractmethod
+    def get_training_examples(self, limit: int = 50000) -> List[Dict[str, Any]]:
+        """Тексты с разметкой LLM для обучения локального классификатора."""
+
+    # --- Подписчики ---
+
+    @abstractmethod
+    def get_subscribers_version(self) -> int:
+        """Счетчик изменений подписок."""
+
+    @abstractmethod
+    def add_subscriber(self, user_id: int) -> Optional[int]:
+        """Добавляет подписчика; новая версия подписок."""
+
+    @abstractmethod
+    def remove_subscriber(self, user_id: int) -> Optional[int]:
+        """Удаляет подписчика и его фильтры; новая версия подписок."""
+
+    @abstractmethod
+    def is_subscriber(self, user_id: int) -> bool:
+        """Является ли пользователь подписчиком."""
+
+    @abstractmethod
+    def get_all_subscribers(self) -> List[int]:
+        """ID всех подписчиков."""
+
+    @abstractmethod
+    def add_subscriber_filter(
+        self, user_id: int, kind: str, value: str
+    ) -> Optional[int]:
+        """Добавляет фильтр подписчика; новая версия подписок."""
+
+    @abstractmethod
+    def remove_subscriber_filter(
+        self, user_id: int, kind: str, value: str
+    ) -> Optional[int]:
+        """Удаляет фильтр подписчика; новая версия подписок."""
+
+    @abstractmethod
+    def clear_subscriber_filters(self, user_id: int, kind: str) -> Optional[int]:
+        """Удаляет фильтры подписчика указанного типа; новая версия подписок."""
+
+    @abstractmethod
+    def get_all_subscriber_filters(self) -> List[Dict[str, Any]]:
+        """Все фильтры подписчиков."""
+
+    # --- Выгрузка и обслуживание ---
+
+    @abstractmethod
+    def iter_export_rows(
+        self,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        channels: Optional[List[str]] = None,
+        sentiments: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        batch_size: int = 1000,
+    ) -> Iterator[Dict[str, Any]]:
+        """Сообщения с анализами из согласованного снимка, пачками."""
+
+    @abstractmethod
+    def archive_old_messages(self, older_than_days: int, limit: int = 500) -> int:
+        """Переносит тексты старых сообщений в архив; число перенесенных."""
+
+    @abstractmethod
+    def incremental_vacuum(self, pages: int = 0) -> int:
+        """Возвращает свободное место; число свободных страниц до очистки."""
+
+    @abstractmethod
+    def checkpoint_wal(self) -> bool:
+        """Сбрасывает журнал в основной файл базы, если это нужно."""
+
+    @abstractmethod
+    def get_database_size(self) -> int:
+        """Размер рабочей базы в байтах."""
+
+    @abstractmethod
+    def close(self):
+        """Закрывает подключения."""
+
+
+class AsyncStorage:
+    """
+    Асинхронная обертка над StorageBackend: storage.aio.<метод>(...) -
+    корутина с тем же результатом. Для хранилищ с offload_calls вызов
+    выполняется в пуле потоков (asyncio.to_thread), иначе - сразу.
+    """
+
+    def __init__(self, storage: StorageBackend):
+        self._storage = storage
+
+    def __getattr__(self, name: str):
+        method = getattr(self._storage, name)
+        offload = self._storage.offload_calls
+
+        async def call(*args, **kwargs):
+            if offload:
+                return await asyncio.to_thread(method, *args, **kwargs)
+            return method(*args, **kwargs)
+
+        call.__name__ = name
+        # Следующие обращения берут готовую обертку из __dict__
+        setattr(self, name, call)
+        return call
+
+
+def is_postgres_url(url: str) -> bool:
+    return url.startswith(POSTGRES_SCHEMES)
+
+
+def create_storage(url: str = config.DATABASE_URL) -> StorageBackend:
+    """Создает хранилище по DATABASE_URL: PostgreSQL по URL, иначе SQLite."""
+    if is_postgres_url(url):
+        # asyncpg нужен только для PostgreSQL
+        from postgres_storage import PostgresStorage
+
+        return PostgresStorage(url)
+    from data_manager import DataManager
+
+    return DataManager(url)
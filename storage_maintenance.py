@@ -0,0 +1,78 @@
+# storage_maintenance.py
+import asyncio
+from logger import get_logger
+import config
+from services import data_manager
+import metrics
+
+logger = get_logger()
+
+ARCHIVED_MESSAGES = metrics.Counter(
+    "newsbot_archived_messages_total", "Сообщения, перенесенные в архивные базы"
+)
+MAINTENANCE_SECONDS = metrics.Histogram(
+    "newsbot_db_maintenance_seconds",
+    "Длительность шагов обслуживания базы",
+    ["step"],
+)
+DATABASE_SIZE = metrics.Gauge(
+    "newsbot_database_size_bytes", "Размер рабочей базы вместе с WAL"
+)
+
+
+class StorageMaintenance:
+    """
+    Периодическое обслуживание хранилища, чтобы рабочая база оставалась
+    небольшой: перенос старых текстов в архив, а для SQLite еще возврат
+    свободных страниц файловой системе (incremental vacuum) и checkpoint
+    WAL-журнала.
+    """
+
+    def __init__(self):
+        self.data_manager = data_manager
+
+    async def archive(self) -> int:
+        """Переносит старые сообщения в архив пачками, не блокируя event loop надолго."""
+        if config.MESSAGE_RETENTION_DAYS <= 0:
+            return 0
+        total = 0
+        while True:
+            with MAINTENANCE_SECONDS.time("archive"):
+                moved = await self.data_manager.aio.archive_old_messages(
+                    config.MESSAGE_RETENTION_DAYS, config.ARCHIVE_BATCH_SIZE
+                )
+            total += moved
+            ARCHIVED_MESSAGES.inc(amount=moved)
+            if moved < config.ARCHIVE_BATCH_SIZE:
+                return total
+            # Отдаем управление другим задачам между пачками
+            await asyncio.sleep(0)
+
+    async def run_once(self):
+        """Один проход обслуживания."""
+        archived = await self.archive()
+        with MAINTENANCE_SECONDS.time("vacuum"):
+            freed = await self.data_manager.aio.incremental_vacuum(
+                config.DB_VACUUM_PAGES
+            )
+        with MAINTENANCE_SECONDS.time("checkpoint"):
+            checkpointed = await self.data_manager.aio.checkpoint_wal()
+        if not checkpointed:
+            logger.warning("Checkpoint WAL не завершен: база занята читателями.")
+        size = await self.data_manager.aio.get_database_size()
+        # Размер для /metrics обновляется раз за проход обслуживания
+        DATABASE_SIZE.set(size)
+        logger.info(
+            f"Обслуживание базы: в архив {archived}, свободных страниц {freed}, "
+            f"размер {size // 1024} КБ"
+        )
+
+    async def run(self):
+        """Основной цикл обслуживания базы."""
+        logger.info("Запуск обслуживания базы данных.")
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка при обслуживании базы: {e}", exc_info=True)
+            await asyncio.sleep(config.DB_MAINTENANCE_INTERVAL_SECONDS)
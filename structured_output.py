@@ -0,0 +1,118 @@
+# structured_output.py
+"""
+Разбор JSON-ответов LLM.
+
+JsonObjectStream следит за потоком токенов и сообщает, когда закрылся
+первый JSON-объект верхнего уровня, чтобы генерацию можно было прервать
+сразу, не дожидаясь "болтовни" модели после JSON. parse_json_object
+терпимо разбирает ответ и чинит типичные поломки: markdown-ограждения,
+висячие запятые, одинарные кавычки, Python-литералы и незакрытые скобки.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+_CODE_FENCE_RE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_PY_LITERAL_RE = re.compile(r"\b(True|False|None)\b")
+
+
+class JsonObjectStream:
+    """Инкрементально отслеживает баланс скобок с учетом строк и экранирования."""
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.complete = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def feed(self, chunk: str) -> bool:
+        """Добавляет кусок ответа. Возвращает True, когда объект закрылся."""
+        if self.complete:
+            return True
+        for i, char in enumerate(chunk):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"' and self._started:
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+                self._started = True
+            elif char == "}" and self._started:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._chunks.append(chunk[: i + 1])
+                    self.complete = True
+                    return True
+        self._chunks.append(chunk)
+        return False
+
+
+def _close_brackets(text: str) -> str:
+    """Дописывает незакрытые кавычки и скобки (ответ оборван по num_predict)."""
+    stack = []
+    in_string = False
+    escape = False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    return text + "".join(reversed(stack))
+
+
+def _candidates(text: str):
+    """Варианты текста от наименее к наиболее агрессивному исправлению."""
+    text = _CODE_FENCE_RE.sub("", text).strip()
+    start = text.find("{")
+    if start == -1:
+        return
+    text = text[start:]
+    end = text.rfind("}")
+    if end != -1:
+        yield text[: end + 1]
+    fixed = _TRAILING_COMMA_RE.sub(r"\1", text)
+    fixed = _PY_LITERAL_RE.sub(lambda m: _PY_LITERALS[m.group(1)], fixed)
+    if '"' not in fixed:
+        fixed = fixed.replace("'", '"')
+    yield _TRAILING_COMMA_RE.sub(r"\1", _close_brackets(fixed))
+
+
+def parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """Извлекает JSON-объект из ответа LLM, исправляя типичные ошибки."""
+    if not text:
+        return None
+    for candidate in _candidates(text):
+        try:
+            data = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            return data
+    return None
@@ -0,0 +1,100 @@
+# subscriber_registry.py
+from typing import List, Optional, Set, Tuple
+from logger import get_logger
+from storage import StorageBackend
+
+logger = get_logger()
+
+
+class SubscriberRegistry:
+    """
+    Кэш подписчиков в памяти.
+
+    Загружается из базы один раз при старте и обновляется при каждой
+    подписке/отписке, поэтому проверки в обработчиках бота не ходят в БД.
+    Чтобы оставаться корректным при нескольких процессах, реестр
+    периодически (refresh) сверяет свою версию со счетчиком
+    'subscribers_version' в базе и перезагружается, если подписки
+    изменил кто-то другой.
+    """
+
+    def __init__(self, data_manager: StorageBackend):
+        self.data_manager = data_manager
+        self._subscribers: Set[int] = set()
+        self._snapshot: Optional[Tuple[int, ...]] = None
+        self._version = 0
+        self.load()
+
+    def load(self):
+        """Загружает подписчиков из базы данных."""
+        # Версию читаем до списка: если между запросами что-то изменится,
+        # следующая сверка увидит более новую версию и перезагрузит кэш
+        version = self.data_manager.get_subscribers_version()
+        self._apply(version, self.data_manager.get_all_subscribers())
+
+    def _apply(self, version: int, subscribers: List[int]):
+        self._version = version
+        self._subscribers = set(subscribers)
+        self._snapshot = None
+        logger.info(
+            f"Реестр подписчиков загружен: {len(self._subscribers)} подписчиков "
+            f"(версия {self._version})."
+        )
+
+    async def refresh(self) -> bool:
+        """
+        Сверяет версию с базой и перезагружает кэш при расхождении.
+        Возвращает True, если кэш обновлен. Вызывается периодически
+        из SubscriberRouter.run, поэтому проверки в обработчиках бота
+        и при рассылке не ходят в базу.
+        """
+        version = await self.data_manager.aio.get_subscribers_version()
+        if version == self._version:
+            return False
+        logger.info("Подписки изменены другим процессом, перезагружаю реестр.")
+        subscribers = await self.data_manager.aio.get_all_subscribers()
+        self._apply(version, subscribers)
+        return True
+
+    def _commit(self, version: Optional[int]):
+        """Принимает версию после собственной записи в БД."""
+        if version is None:
+            return
+        # Если между нашими записями были чужие изменения, версия
+        # остается прежней и следующая сверка перезагрузит кэш
+        if version == self._version + 1:
+            self._version = version
+        self._snapshot = None
+
+    def is_subscriber(self, user_id: int) -> bool:
+        return user_id in self._subscribers
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.is_subscriber(user_id)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def snapshot(self) -> Tuple[int, ...]:
+        """Неизменяемый список подписчиков для рассылки; кэшируется до изменения."""
+        if self._snapshot is None:
+            self._snapshot = tuple(self._subscribers)
+        return self._snapshot
+
+    async def add(self, user_id: int):
+        """Подписывает чат и обновляет кэш."""
+        version = await self.data_manager.aio.add_subscriber(user_id)
+        if version is not None:
+            self._subscribers.add(user_id)
+        self._commit(version)
+
+    async def remove(self, user_id: int):
+        """Отписывает чат (в том числе заблокировавший бота) и обновляет кэш."""
+        version = await self.data_manager.aio.remove_subscriber(user_id)
+        if version is not None:
+            self._subscribers.discard(user_id)
+        self._commit(version)
+
+    def record_write(self, version: Optional[int]):
+        """Учитывает версию после другой записи в подписки (например, фильтров)."""
+        self._commit(version)
@@ -0,0 +1,182 @@
+# subscriber_router.py
+import asyncio
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Set
+from logger import get_logger
+import config
+from storage import StorageBackend
+from subscriber_registry import SubscriberRegistry
+
+logger = get_logger()
+
+# Типы фильтров подписчика
+FILTER_HASHTAG = "hashtag"
+FILTER_CHANNEL = "channel"
+FILTER_SENTIMENT = "sentiment"
+FILTER_KINDS = (FILTER_HASHTAG, FILTER_CHANNEL, FILTER_SENTIMENT)
+
+
+class SubscriberRouter:
+    """
+    Маршрутизация уведомлений по фильтрам подписчиков.
+
+    Держит в памяти обратный индекс "тип фильтра -> значение -> подписчики",
+    который строится из таблицы 'subscriber_filters' при старте и обновляется
+    при каждом изменении. Подписчик без фильтров определенного типа
+    получает все значения этого типа (например, все каналы).
+    Сам список подписчиков хранит SubscriberRegistry; если реестр
+    перезагрузился из-за изменений в другом процессе, индекс перестраивается.
+    Сверку с базой выполняет фоновая задача run, а запись - асинхронные
+    методы, поэтому обработчики бота не ждут базу в event loop.
+    """
+
+    def __init__(self, data_manager: StorageBackend, registry: SubscriberRegistry):
+        self.data_manager = data_manager
+        self.registry = registry
+        # Подписчики без единого фильтра получают все посты
+        self._unfiltered: Set[int] = set()
+        # user_id -> тип фильтра -> выбранные значения
+        self._filters: Dict[int, Dict[str, Set[str]]] = {}
+        # тип фильтра -> значение -> user_id
+        self._index: Dict[str, Dict[str, Set[int]]] = {
+            kind: defaultdict(set) for kind in FILTER_KINDS
+        }
+        self.reload()
+
+    def reload(self):
+        """Перестраивает индекс из базы данных."""
+        self._rebuild(self.data_manager.get_all_subscriber_filters())
+
+    def _rebuild(self, rows: List[Dict[str, Any]]):
+        subscribers = set(self.registry.snapshot())
+        self._filters = {}
+        for kind in FILTER_KINDS:
+            self._index[kind].clear()
+        for row in rows:
+            if row["user_id"] in subscribers and row["kind"] in FILTER_KINDS:
+                self._index_add(row["user_id"], row["kind"], row["value"])
+        self._unfiltered = subscribers - self._filters.keys()
+        logger.info(
+            f"Индекс подписок загружен: {len(subscribers)} подписчиков, "
+            f"{len(self._filters)} с фильтрами."
+        )
+
+    async def refresh(self):
+        """Сверяет реестр с базой и перестраивает индекс, если он перезагружен."""
+        if await self.registry.refresh():
+            self._rebuild(await self.data_manager.aio.get_all_subscriber_filters())
+
+    async def run(self):
+        """Периодическая сверка подписок с базой (изменения из других процессов)."""
+        while True:
+            await asyncio.sleep(config.SUBSCRIBERS_SYNC_SECONDS)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка при сверке подписчиков: {e}", exc_info=True)
+
+    def _index_add(self, user_id: int, kind: str, value: str):
+        self._filters.setdefault(user_id, {}).setdefault(kind, set()).add(value)
+        self._index[kind][value].add(user_id)
+        self._unfiltered.discard(user_id)
+
+    def _index_remove(self, user_id: int, kind: str, value: str):
+        user_filters = self._filters.get(user_id)
+        if not user_filters or value not in user_filters.get(kind, ()):
+            return
+        user_filters[kind].discard(value)
+        if not user_filters[kind]:
+            del user_filters[kind]
+        if not user_filters:
+            del self._filters[user_id]
+            if user_id in self.registry:
+                self._unfiltered.add(user_id)
+        bucket = self._index[kind].get(value)
+        if bucket is not None:
+            bucket.discard(user_id)
+            if not bucket:
+                del self._index[kind][value]
+
+    async def add_subscriber(self, user_id: int):
+        """Подписывает чат на уведомления (без фильтров)."""
+        await self.registry.add(user_id)
+        if user_id in self.registry and user_id not in self._filters:
+            self._unfiltered.add(user_id)
+
+    async def remove_subscriber(self, user_id: int):
+        """Отписывает чат и удаляет все его фильтры."""
+        await self.registry.remove(user_id)
+        for kind, values in list(self._filters.get(user_id, {}).items()):
+            for value in list(values):
+                self._index_remove(user_id, kind, value)
+        self._unfiltered.discard(user_id)
+
+    def get_filters(self, user_id: int, kind: str) -> Set[str]:
+        """Возвращает выбранные значения фильтра указанного типа."""
+        return set(self._filters.get(user_id, {}).get(kind, ()))
+
+    async def toggle_filter(self, user_id: int, kind: str, value: str) -> bool:
+        """Включает или выключает значение фильтра. Возвращает новое состояние."""
+        if value in self._filters.get(user_id, {}).get(kind, ()):
+            version = await self.data_manager.aio.remove_subscriber_filter(
+                user_id, kind, value
+            )
+            if version is not None:
+                self._index_remove(user_id, kind, value)
+            self.registry.record_write(version)
+            return False
+        version = await self.data_manager.aio.add_subscriber_filter(
+            user_id, kind, value
+        )
+        if version is not None:
+            self._index_add(user_id, kind, value)
+        self.registry.record_write(version)
+        return version is not None
+
+    async def clear_filters(self, user_id: int, kind: str):
+        """Сбрасывает фильтр указанного типа: чат снова получает все значения."""
+        version = await self.data_manager.aio.clear_subscriber_filters(user_id, kind)
+        self.registry.record_write(version)
+        if version is None:
+            return
+        for value in list(self._filters.get(user_id, {}).get(kind, ())):
+            self._index_remove(user_id, kind, value)
+
+    def route(
+        self, channel_id: str, hashtags: Iterable[str], sentiment: str
+    ) -> List[int]:
+        """
+        Возвращает подписчиков, которым нужно отправить пост.
+
+        Стоимость пропорциональна числу подходящих подписчиков: просматриваются
+        только чаты без фильтров и чаты из корзин индекса для значений поста.
+        """
+        if not self._filters:
+            # Ни у кого нет фильтров: рассылка всем по готовому снимку
+            return list(self.registry.snapshot())
+
+        post_values = {
+            FILTER_HASHTAG: set(hashtags),
+            FILTER_CHANNEL: {channel_id},
+            FILTER_SENTIMENT: {sentiment},
+        }
+        candidates: Set[int] = set()
+        for kind, values in post_values.items():
+            index = self._index[kind]
+            for value in values:
+                bucket = index.get(value)
+                if bucket:
+                    candidates |= bucket
+
+        recipients = list(self._unfiltered)
+        for user_id in candidates:
+            user_filters = self._filters.get(user_id)
+            if user_filters is None:
+                continue
+            # Каждый заданный тип фильтра должен совпасть хотя бы по одному значению
+            if all(
+                not selected.isdisjoint(post_values[kind])
+                for kind, selected in user_filters.items()
+            ):
+                recipients.append(user_id)
+        return recipients
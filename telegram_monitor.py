@@ -3,11 +3,41 @@ from telethon import TelegramClient
 from telethon.tl.types import Message, User
 from logger import get_logger
 import config
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import os
+import time
+import metrics
 
 logger = get_logger()
 
+TELEGRAM_REQUEST_SECONDS = metrics.Histogram(
+    "newsbot_telegram_request_seconds",
+    "Длительность запросов Telethon",
+    ["method"],
+)
+TELEGRAM_ERRORS = metrics.Counter(
+    "newsbot_telegram_errors_total",
+    "Ошибки при получении сообщений через Telethon",
+    ["method"],
+)
+
+
+def _media_info(msg: Message) -> Optional[Dict[str, Any]]:
+    """Тип и параметры вложения сообщения (без загрузки файла)."""
+    if not msg.media:
+        return None
+    for kind in ("photo", "video", "gif", "voice", "audio", "sticker", "document"):
+        if getattr(msg, kind, None):
+            break
+    else:
+        kind = type(msg.media).__name__
+    info: Dict[str, Any] = {"type": kind, "message_id": msg.id}
+    file = msg.file
+    if file is not None:
+        info["mime_type"] = file.mime_type
+        info["size"] = file.size
+    return info
+
 
 class TelegramMonitor:
     """
@@ -59,49 +89,158 @@ class TelegramMonitor:
             await self.client.disconnect()
             logger.info("Клиент Telethon отключен.")
 
-    async def get_new_messages(
-        self, channel_id: str, last_message_id: int = 0
+    def _group_posts(
+        self, messages: List[Message], deferred_tail: bool
     ) -> List[Dict[str, Any]]:
         """
-        Получает новые сообщения из канала, начиная с определенного ID.
+        Собирает сообщения (в хронологическом порядке) в логические посты:
+        альбом - сообщения с общим grouped_id - становится одним постом
+        с подписью и списком вложений. ID поста - первое сообщение альбома,
+        last_id - последнее (до него сдвигается курсор канала).
+
+        Если выборка могла оборвать альбом (deferred_tail) или последний
+        альбом еще догружается, он откладывается до следующей проверки.
+        """
+        posts: List[Dict[str, Any]] = []
+        albums: Dict[int, Dict[str, Any]] = {}
+        for msg in messages:
+            post = albums.get(msg.grouped_id) if msg.grouped_id else None
+            if post is None:
+                post = {
+                    "id": msg.id,
+                    "last_id": msg.id,
+                    "text": "",
+                    "date": msg.date.isoformat(),
+                    "is_forward": False,
+                    "media": [],
+                    "edit_date": None,
+                }
+                posts.append(post)
+                if msg.grouped_id:
+                    albums[msg.grouped_id] = post
+            post["last_id"] = msg.id
+            post["is_forward"] = post["is_forward"] or msg.fwd_from is not None
+            if msg.edit_date:
+                post["edit_date"] = max(
+                    post["edit_date"] or "", msg.edit_date.isoformat()
+                )
+            # Подпись обычно у одного сообщения альбома, но бывает у нескольких
+            if msg.text and msg.text not in post["text"]:
+                post["text"] = (
+                    f"{post['text']}\n\n{msg.text}" if post["text"] else msg.text
+                )
+            media = _media_info(msg)
+            if media:
+                post["media"].append(media)
+
+        if posts and messages[-1].grouped_id:
+            age = time.time() - messages[-1].date.timestamp()
+            if deferred_tail or age < config.ALBUM_SETTLE_SECONDS:
+                posts.pop()
+        return posts
+
+    async def get_new_messages(
+        self, channel_id: str, last_message_id: int = 0, limit: int = 100
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Получает новые посты канала после last_message_id (не больше limit
+        самых старых из новых сообщений за раз, чтобы курсор канала шел
+        по порядку). Альбомы объединяются в один пост, посты без текста
+        и подписи пропускаются.
+
+        Возвращает посты и ID последнего просмотренного сообщения (включая
+        пропущенные без текста и служебные, но не отложенный альбом):
+        до него можно сдвинуть курсор, даже если постов с текстом нет.
         """
         if not self.client.is_connected():
             logger.error("Клиент Telethon не подключен.")
-            return []
+            return [], last_message_id
 
         try:
-            channel_entity = await self.client.get_entity(channel_id)
+            with TELEGRAM_REQUEST_SECONDS.time("get_entity"):
+                channel_entity = await self.client.get_entity(channel_id)
 
             # Безопасно получаем имя пользователя и заголовок
             channel_username = getattr(channel_entity, "username", None)
             channel_title = getattr(channel_entity, "title", "Неизвестный канал")
 
-            messages = await self.client.get_messages(
-                channel_entity,
-                min_id=last_message_id,
-                limit=100,  # Ограничение на количество сообщений за один раз
-            )
+            with TELEGRAM_REQUEST_SECONDS.time("get_messages"):
+                # reverse=True: сообщения сразу после min_id, от старых к новым.
+                # Без него Telethon вернул бы limit самых новых, и при большом
+                # отставании курсор перескочил бы через более старые сообщения
+                messages = await self.client.get_messages(
+                    channel_entity, min_id=last_message_id, limit=limit, reverse=True
+                )
 
-            result = []
-            if messages and isinstance(messages, list):
-                # Telethon возвращает сообщения в обратном хронологическом порядке
-                for msg in reversed(messages):
-                    if isinstance(msg, Message) and msg.text:
-                        result.append(
-                            {
-                                "id": msg.id,
-                                "text": msg.text,
-                                "date": msg.date.isoformat(),
-                                "channel_id": channel_id,
-                                "channel_title": channel_title,
-                                "channel_username": channel_username,
-                            }
-                        )
-            return result
+            if not messages or not isinstance(messages, list):
+                return [], last_message_id
+            # Полная выборка могла оборвать самый новый альбом
+            full_batch = len(messages) >= limit
+            consumed_id = max(msg.id for msg in messages)
+            messages = [msg for msg in messages if isinstance(msg, Message)]
+            posts = self._group_posts(messages, deferred_tail=full_batch)
+            tail = messages[-1] if messages else None
+            if (
+                tail
+                and tail.grouped_id
+                and (not posts or posts[-1]["last_id"] < tail.id)
+            ):
+                # Альбом отложен: курсор остается перед его первым сообщением
+                consumed_id = (
+                    min(msg.id for msg in messages if msg.grouped_id == tail.grouped_id)
+                    - 1
+                )
+            for post in posts:
+                post.update(
+                    channel_id=channel_id,
+                    channel_title=channel_title,
+                    channel_username=channel_username,
+                )
+            return [post for post in posts if post["text"]], consumed_id
         except Exception as e:
+            TELEGRAM_ERRORS.inc("get_new_messages")
             logger.error(
                 f"Ошибка при получении новых сообщений из канала {channel_id}: {e}"
             )
+            return [], last_message_id
+
+    async def get_recent_posts(
+        self, channel_id: str, limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """
+        Последние посты канала (не больше limit сообщений) для проверки
+        правок. Альбомы собираются так же, как в get_new_messages; альбом,
+        который мог попасть в выборку не целиком, отбрасывается.
+        """
+        if not self.client.is_connected():
+            logger.error("Клиент Telethon не подключен.")
+            return []
+
+        try:
+            with TELEGRAM_REQUEST_SECONDS.time("get_entity"):
+                channel_entity = await self.client.get_entity(channel_id)
+            with TELEGRAM_REQUEST_SECONDS.time("get_messages"):
+                messages = await self.client.get_messages(channel_entity, limit=limit)
+            if not messages or not isinstance(messages, list):
+                return []
+            full_batch = len(messages) >= limit
+            messages = [msg for msg in reversed(messages) if isinstance(msg, Message)]
+            posts = self._group_posts(messages, deferred_tail=False)
+            # Самый старый альбом полной выборки мог начаться раньше нее
+            if full_batch and posts and messages[0].grouped_id:
+                posts.pop(0)
+            channel_username = getattr(channel_entity, "username", None)
+            channel_title = getattr(channel_entity, "title", "Неизвестный канал")
+            for post in posts:
+                post.update(
+                    channel_id=channel_id,
+                    channel_title=channel_title,
+                    channel_username=channel_username,
+                )
+            return [post for post in posts if post["text"]]
+        except Exception as e:
+            TELEGRAM_ERRORS.inc("get_recent_posts")
+            logger.error(f"Ошибка при получении последних постов {channel_id}: {e}")
             return []
 
     async def get_initial_last_message_id(self, channel_id: str) -> int:
@@ -110,12 +249,14 @@ class TelegramMonitor:
             logger.error("Клиент Telethon не подключен.")
             return 0
         try:
-            channel_entity = await self.client.get_entity(channel_id)
+            with TELEGRAM_REQUEST_SECONDS.time("get_entity"):
+                channel_entity = await self.client.get_entity(channel_id)
             # Берем одно самое последнее сообщение
             async for message in self.client.iter_messages(channel_entity, limit=1):
                 if isinstance(message, Message):
                     return message.id
             return 0
         except Exception as e:
+            TELEGRAM_ERRORS.inc("get_initial_last_message_id")
             logger.error(f"Ошибка при получении начального ID сообщения: {e}")
             return 0
@@ -1,37 +1,40 @@
 # telegram_notifier.py
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from aiogram import Bot
-from aiogram.exceptions import TelegramAPIError
 from logger import get_logger
-from services import data_manager
+from services import subscriber_router
 
 logger = get_logger()
 
+# Словарь для преобразования тональности в хештег
+SENTIMENT_TO_HASHTAG = {
+    "Позитивная": "#позитивная_новость",
+    "Негативная": "#негативная_новость",
+    "Нейтральная": "#нейтральная_новость",
+}
 
-async def send_analysis_result(bot: Bot, analysis_data: Dict[str, Any]):
+
+def format_analysis_message(analysis_data: Dict[str, Any]) -> str:
     """
-    Отправляет отформатированный результат анализа всем подписчикам.
+    Формирует текст уведомления с результатом анализа.
 
     Args:
-        bot (Bot): Экземпляр бота aiogram для отправки сообщения.
         analysis_data (Dict[str, Any]): Словарь, содержащий данные анализа.
-            Ожидаемые ключи: "channel_title", "message_link", "original_message",
-            "summary", "sentiment", "hashtags_formatted".
+            Ожидаемые ключи: "channel_title", "message_link", "summary",
+            "sentiment", "hashtags_formatted"; необязательные "degraded"
+            и "edited".
     """
-    subscribers = data_manager.get_all_subscribers()
-    if not subscribers:
-        logger.info("Подписчики для уведомлений не найдены. Пропускаю отправку.")
-        return
-
-    # Словарь для преобразования тональности в хештег
-    sentiment_to_hashtag = {
-        "Позитивная": "#позитивная_новость",
-        "Негативная": "#негативная_новость",
-        "Нейтральная": "#нейтральная_новость",
-    }
-    sentiment_hashtag = sentiment_to_hashtag.get(analysis_data["sentiment"], "#новость")
-
-    message_text = (
+    sentiment_hashtag = SENTIMENT_TO_HASHTAG.get(analysis_data["sentiment"], "#новость")
+    degraded_note = (
+        "⚠️ Упрощенный анализ: LLM перегружена или недоступна.\n\n"
+        if analysis_data.get("degraded")
+        else ""
+    )
+    edited_note = (
+        "✏️ Обновлено: пост отредактирован.\n\n" if analysis_data.get("edited") else ""
+    )
+    return (
+        f"{edited_note}{degraded_note}"
         f"Анализ из «{analysis_data['channel_title']}»\n\n"
         f"Краткое содержание:\n{analysis_data['summary']}\n\n"
         f"Оригинал: {analysis_data['message_link']}\n\n"
@@ -39,30 +42,87 @@ async def send_analysis_result(bot: Bot, analysis_data: Dict[str, Any]):
         f"{sentiment_hashtag}"
     )
 
-    successful_sends = 0
-    for user_id in subscribers:
-        try:
-            await bot.send_message(
-                chat_id=user_id,
-                text=message_text,
-                parse_mode=None,  # Явно отключаем парсинг, чтобы избежать ошибок
-                disable_web_page_preview=True,
-            )
-            successful_sends += 1
-        except TelegramAPIError as e:
-            logger.warning(
-                f"Не удалось отправить уведомление пользователю {user_id}: {e}"
-            )
-            if "bot was blocked by the user" in str(e):
-                logger.info(
-                    f"Пользователь {user_id} заблокировал бота. Удаляю из подписчиков."
-                )
-                data_manager.remove_subscriber(user_id)
-        except Exception as e:
-            logger.error(
-                f"Непредвиденная ошибка при отправке уведомления пользователю {user_id}: {e}"
-            )
-
-    logger.info(
-        f"Результат анализа для '{analysis_data['channel_title']}' успешно отправлен {successful_sends}/{len(subscribers)} подписчикам."
+
+def build_notification_data(
+    channel_id: str, message: Dict[str, Any], analysis, edited: bool = False
+) -> Dict[str, Any]:
+    """
+    Собирает данные уведомления о посте из сообщения монитора и анализа
+    (NewsAnalysis).
+    """
+    message_link = (
+        f"https://t.me/{message['channel_username']}/{message['id']}"
+        if message.get("channel_username")
+        else "N/A"
+    )
+    return {
+        "channel_id": channel_id,
+        "channel_title": message.get("channel_title", "Неизвестный источник"),
+        "message_link": message_link,
+        "summary": analysis.summary,
+        "sentiment": analysis.sentiment,
+        "hashtags": analysis.hashtags,
+        "hashtags_formatted": analysis.format_hashtags(),
+        "degraded": analysis.degraded,
+        "edited": edited,
+    }
+
+
+def format_trend_alert(trends: List[Dict[str, Any]]) -> str:
+    """
+    Формирует оповещение о хэштегах, резко участившихся за последний час.
+
+    Args:
+        trends (List[Dict[str, Any]]): Результат TrendDetector.pop_alerts().
+    """
+    lines = [
+        f"#{trend['topic']}: {trend['count']} постов "
+        f"(обычно {trend['baseline']:.1f})"
+        for trend in trends
+    ]
+    return "📈 Набирают популярность:\n\n" + "\n".join(lines)
+
+
+def get_recipients(analysis_data: Dict[str, Any]) -> List[int]:
+    """
+    Возвращает подписчиков, чьи фильтры (хештеги, канал, тональность)
+    совпадают с постом.
+
+    Args:
+        analysis_data (Dict[str, Any]): Ожидаемые ключи: "channel_id",
+            "sentiment", "hashtags".
+    """
+    return subscriber_router.route(
+        analysis_data.get("channel_id", ""),
+        analysis_data.get("hashtags", []),
+        analysis_data["sentiment"],
+    )
+
+
+async def send_notification(bot: Bot, chat_id: int, text: str) -> Optional[int]:
+    """
+    Отправляет одно уведомление в чат и возвращает ID отправленного
+    сообщения. Ошибки Telegram API пробрасываются вызывающему коду,
+    который решает, повторять ли отправку.
+    """
+    sent = await bot.send_message(
+        chat_id=chat_id,
+        text=text,
+        parse_mode=None,  # Явно отключаем парсинг, чтобы избежать ошибок
+        disable_web_page_preview=True,
+    )
+    return getattr(sent, "message_id", None)
+
+
+async def edit_notification(bot: Bot, chat_id: int, message_id: int, text: str):
+    """
+    Заменяет текст ранее отправленного уведомления. Ошибки Telegram API
+    пробрасываются, как и в send_notification.
+    """
+    await bot.edit_message_text(
+        text=text,
+        chat_id=chat_id,
+        message_id=message_id,
+        parse_mode=None,
+        disable_web_page_preview=True,
     )
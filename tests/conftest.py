@@ -0,0 +1,182 @@
+# tests/conftest.py
+"""
+Общие фикстуры тестов хранилища.
+
+PostgreSQL берется из TEST_DATABASE_URL (подключение с правом CREATE DATABASE)
+или запускается временный сервер через initdb/pg_ctl (PATH, PG_BIN или
+pg_config --bindir). Под root (обычно в контейнере) сервер запускается
+от пользователя PG_TEST_USER (по умолчанию nobody): PostgreSQL не работает
+от root. Если ни сервера, ни initdb нет, тесты PostgreSQL пропускаются.
+"""
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+from urllib.parse import urlsplit
+
+# config требует настройки бота при импорте; тестам хранилища они не нужны
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "1:test")
+os.environ.setdefault("TELEGRAM_CHANNEL_IDS", "test_channel")
+os.environ.setdefault("LOG_DIR", tempfile.mkdtemp(prefix="newsbot-test-logs-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import config
+
+
+def _unprivileged():
+    """
+    Для root: (каталог, preexec_fn), чтобы initdb и сервер работали от
+    непривилегированного пользователя; иначе (None, None).
+    """
+    if not hasattr(os, "geteuid") or os.geteuid() != 0:
+        return None, None
+    import pwd
+
+    user = pwd.getpwnam(os.getenv("PG_TEST_USER", "nobody"))
+    # Каталог прямо в /tmp: в базовый каталог pytest (0700) другой
+    # пользователь не попадет
+    base = tempfile.mkdtemp(prefix="newsbot-pg-")
+    os.chown(base, user.pw_uid, user.pw_gid)
+
+    def demote():
+        os.setgroups([])
+        os.setgid(user.pw_gid)
+        os.setuid(user.pw_uid)
+
+    return base, demote
+
+
+def _pg_bindir():
+    """Каталог с initdb и pg_ctl или None."""
+    candidates = [os.getenv("PG_BIN")]
+    initdb = shutil.which("initdb")
+    if initdb:
+        candidates.append(os.path.dirname(initdb))
+    if shutil.which("pg_config"):
+        result = subprocess.run(
+            ["pg_config", "--bindir"], capture_output=True, text=True
+        )
+        candidates.append(result.stdout.strip())
+    for bindir in candidates:
+        if bindir and all(
+            os.path.exists(os.path.join(bindir, tool)) for tool in ("initdb", "pg_ctl")
+        ):
+            return bindir
+    return None
+
+
+@pytest.fixture(scope="session")
+def postgres_url(tmp_path_factory):
+    """URL сервера PostgreSQL для тестов (служебная база postgres)."""
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+    pytest.importorskip("asyncpg")
+    bindir = _pg_bindir()
+    if bindir is None:
+        pytest.skip("нет TEST_DATABASE_URL и не найдены initdb/pg_ctl")
+
+    own_dir, demote = _unprivileged()
+    base = Path(own_dir) if own_dir else tmp_path_factory.mktemp("pg")
+    data_dir, socket_dir = base / "data", base / "sock"
+    socket_dir.mkdir()
+    # Сокет создает сервер: каталог должен принадлежать тому же пользователю
+    os.chown(socket_dir, base.stat().st_uid, base.stat().st_gid)
+    subprocess.run(
+        [
+            os.path.join(bindir, "initdb"),
+            "-D",
+            str(data_dir),
+            "-U",
+            "postgres",
+            "--auth=trust",
+            "-E",
+            "UTF8",
+            "--locale=C",
+        ],
+        check=True,
+        capture_output=True,
+        preexec_fn=demote,
+    )
+    # Только unix-сокет во временном каталоге: не конфликтует с сервером на 5432
+    options = f"-k {socket_dir} -c listen_addresses='' -c fsync=off"
+    subprocess.run(
+        [
+            os.path.join(bindir, "pg_ctl"),
+            "-D",
+            str(data_dir),
+            "-o",
+            options,
+            "-l",
+            str(base / "server.log"),
+            "-w",
+            "start",
+        ],
+        check=True,
+        capture_output=True,
+        preexec_fn=demote,
+    )
+    try:
+        yield f"postgresql://postgres@/postgres?host={socket_dir}"
+    finally:
+        subprocess.run(
+            [os.path.join(bindir, "pg_ctl"), "-D", str(data_dir), "-m", "fast", "stop"],
+            capture_output=True,
+            preexec_fn=demote,
+        )
+        if own_dir:
+            shutil.rmtree(own_dir, ignore_errors=True)
+
+
+async def _admin(url: str, statement: str):
+    import asyncpg
+
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute(statement)
+    finally:
+        await conn.close()
+
+
+@pytest.fixture
+def postgres_dsn(postgres_url):
+    """Отдельная пустая база на каждый тест; удаляется после него."""
+    name = f"newsbot_test_{uuid.uuid4().hex[:12]}"
+    asyncio.run(_admin(postgres_url, f"CREATE DATABASE {name}"))
+    try:
+        yield urlsplit(postgres_url)._replace(path=f"/{name}").geturl()
+    finally:
+        asyncio.run(_admin(postgres_url, f"DROP DATABASE {name} WITH (FORCE)"))
+
+
+@pytest.fixture
+def archive_dir(tmp_path, monkeypatch):
+    """Архивы SQLite пишутся во временный каталог теста."""
+    path = str(tmp_path / "archive")
+    monkeypatch.setattr(config, "ARCHIVE_DIR", path)
+    return path
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def storage(request, tmp_path, archive_dir):
+    """Хранилище каждой реализации StorageBackend на пустой базе."""
+    if request.param == "sqlite":
+        from data_manager import DataManager
+
+        backend = DataManager(str(tmp_path / "newsbot.db"))
+    else:
+        from postgres_storage import PostgresStorage
+
+        backend = PostgresStorage(request.getfixturevalue("postgres_dsn"))
+        assert backend.pool is not None
+    try:
+        yield backend
+    finally:
+        backend.close()
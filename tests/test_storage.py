@@ -0,0 +1,494 @@
+# tests/test_storage.py
+"""
+Контракт StorageBackend: одни и те же сценарии для SQLite (DataManager)
+и PostgreSQL (PostgresStorage).
+"""
+import asyncio
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+from data_manager import SCHEMA_VERSION
+
+
+def _date(days_ago: float = 0) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days_ago)).isoformat()
+
+
+def _message(message_id: int, text: str = None, days_ago: float = 0, **extra):
+    return {
+        "id": message_id,
+        "text": text or f"Текст поста {message_id}",
+        "date": _date(days_ago),
+        **extra,
+    }
+
+
+def _analysis(sentiment: str = "Нейтральная", hashtags=("#экономика",), **extra):
+    return {
+        "summary": "Кратко о посте",
+        "sentiment": sentiment,
+        "hashtags": list(hashtags),
+        **extra,
+    }
+
+
+def _save(storage, channel_id, message, analysis=None, chat_ids=(), text="Уведомление"):
+    analysis_id = storage.save_processed_message(
+        channel_id, message, analysis or _analysis(), text, list(chat_ids)
+    )
+    assert analysis_id is not None
+    return analysis_id
+
+
+# --- Схема ---
+
+
+def test_new_database_is_empty(storage):
+    assert storage.get_last_message_id("a") == 0
+    assert storage.get_subscribers_version() == 0
+    assert storage.get_due_notifications() == []
+    assert storage.get_next_notification_time() is None
+    assert storage.count_pending_notifications() == 0
+    assert storage.get_statistics()["total_messages"] == 0
+
+
+# Схема версии 3: еще нет вложений, правок, модели анализа и ID уведомлений
+OLD_SQLITE_SCHEMA = [
+    """
+    CREATE TABLE messages (
+        channel_id TEXT NOT NULL,
+        message_id INTEGER NOT NULL,
+        text TEXT,
+        date TEXT NOT NULL,
+        archived_at TEXT,
+        PRIMARY KEY (channel_id, message_id)
+    )
+    """,
+    """
+    CREATE TABLE analyses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id TEXT NOT NULL,
+        message_id INTEGER NOT NULL,
+        summary TEXT NOT NULL,
+        sentiment TEXT NOT NULL,
+        hashtags TEXT,
+        analysis_date TEXT NOT NULL,
+        degraded INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (channel_id, message_id)
+    )
+    """,
+    """
+    CREATE TABLE notification_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        analysis_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT,
+        created_at TEXT NOT NULL,
+        sent_at TEXT,
+        UNIQUE (analysis_id, chat_id)
+    )
+    """,
+    "PRAGMA user_version = 3",
+]
+
+OLD_POSTGRES_SCHEMA = [
+    """
+    CREATE TABLE schema_info (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    """,
+    "INSERT INTO schema_info (id, version) VALUES (1, 3)",
+    """
+    CREATE TABLE messages (
+        channel_id TEXT NOT NULL,
+        message_id BIGINT NOT NULL,
+        rowid BIGINT GENERATED BY DEFAULT AS IDENTITY UNIQUE,
+        text TEXT,
+        date TEXT NOT NULL,
+        archived_at TEXT,
+        PRIMARY KEY (channel_id, message_id)
+    )
+    """,
+    """
+    CREATE TABLE analyses (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        channel_id TEXT NOT NULL,
+        message_id BIGINT NOT NULL,
+        summary TEXT NOT NULL,
+        sentiment TEXT NOT NULL,
+        hashtags TEXT,
+        analysis_date TEXT NOT NULL,
+        degraded INTEGER NOT NULL DEFAULT 0,
+        UNIQUE (channel_id, message_id),
+        FOREIGN KEY (channel_id, message_id) REFERENCES messages (channel_id, message_id)
+    )
+    """,
+    """
+    CREATE TABLE notification_outbox (
+        id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+        analysis_id BIGINT NOT NULL REFERENCES analyses (id),
+        chat_id BIGINT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at DOUBLE PRECISION NOT NULL,
+        last_error TEXT,
+        created_at TEXT NOT NULL,
+        sent_at TEXT,
+        UNIQUE (analysis_id, chat_id)
+    )
+    """,
+]
+
+OLD_ROWS = [
+    (
+        "INSERT INTO messages (channel_id, message_id, text, date) "
+        "VALUES ('a', 1, 'Старый пост', '2026-01-01T00:00:00+00:00')"
+    ),
+    (
+        "INSERT INTO analyses (channel_id, message_id, summary, sentiment, "
+        "hashtags, analysis_date) VALUES ('a', 1, 'Кратко', 'Позитивная', "
+        "'[\"#старое\"]', '2026-01-01T00:00:01')"
+    ),
+]
+
+NEW_COLUMNS = {
+    "messages": {"media", "edited_at"},
+    "analyses": {"model", "prompt_version"},
+    "notification_outbox": {"sent_message_id"},
+}
+
+
+def _check_migrated(storage):
+    """Старые строки читаются, новые колонки пишутся."""
+    assert storage.get_edit_candidates("a", [1]) == {
+        1: {"message_id": 1, "text": "Старый пост", "edited_at": None}
+    }
+    message = _message(2, edit_date=_date(), media=[{"type": "photo"}])
+    _save(storage, "a", message, _analysis(model="m", prompt_version="v"), [10])
+    assert storage.mark_notification_sent(
+        storage.get_due_notifications()[0]["id"], sent_message_id=99
+    )
+    assert (
+        storage.save_edited_analysis(
+            "a", 2, "Новый текст", _date(), _analysis(), "Правка"
+        )
+        == 1
+    )
+    assert storage.get_due_notifications()[0]["sent_message_id"] == 99
+
+
+def test_sqlite_migrates_older_schema(tmp_path, archive_dir):
+    from data_manager import DataManager
+
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    for statement in OLD_SQLITE_SCHEMA + OLD_ROWS:
+        conn.execute(statement)
+    conn.commit()
+    conn.close()
+
+    storage = DataManager(path)
+    try:
+        for table, columns in NEW_COLUMNS.items():
+            existing = {
+                row["name"]
+                for row in storage.conn.execute(f"PRAGMA table_info({table})")
+            }
+            assert columns <= existing, table
+        version = storage.conn.execute("PRAGMA user_version").fetchone()[0]
+        assert version == SCHEMA_VERSION
+        _check_migrated(storage)
+    finally:
+        storage.close()
+
+
+async def _execute_all(dsn, statements):
+    import asyncpg
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        for statement in statements:
+            await conn.execute(statement)
+    finally:
+        await conn.close()
+
+
+async def _fetch(dsn, query):
+    import asyncpg
+
+    conn = await asyncpg.connect(dsn)
+    try:
+        return await conn.fetch(query)
+    finally:
+        await conn.close()
+
+
+def test_postgres_migrates_older_schema(postgres_dsn):
+    from postgres_storage import PostgresStorage
+
+    asyncio.run(_execute_all(postgres_dsn, OLD_POSTGRES_SCHEMA + OLD_ROWS))
+
+    storage = PostgresStorage(postgres_dsn)
+    try:
+        rows = asyncio.run(
+            _fetch(
+                postgres_dsn,
+                "SELECT table_name, column_name FROM information_schema.columns "
+                "WHERE table_schema = 'public'",
+            )
+        )
+        existing = {}
+        for row in rows:
+            existing.setdefault(row["table_name"], set()).add(row["column_name"])
+        for table, columns in NEW_COLUMNS.items():
+            assert columns <= existing[table], table
+        version = asyncio.run(_fetch(postgres_dsn, "SELECT version FROM schema_info"))
+        assert version[0]["version"] == SCHEMA_VERSION
+        _check_migrated(storage)
+    finally:
+        storage.close()
+
+
+# --- Сохранение и очередь уведомлений ---
+
+
+def test_save_processed_message_fans_out(storage):
+    # Повторы chat_id (например, чат подписан дважды) дают одно уведомление
+    chat_ids = list(range(1, 301)) + [5, 5, 300]
+    album = _message(10, last_id=12, media=[{"type": "photo"}, {"type": "video"}])
+    analysis_id = _save(storage, "a", album, chat_ids=chat_ids, text="Пост 10")
+
+    due = storage.get_due_notifications(limit=1000)
+    assert sorted(item["chat_id"] for item in due) == list(range(1, 301))
+    assert {item["analysis_id"] for item in due} == {analysis_id}
+    assert {item["text"] for item in due} == {"Пост 10"}
+    assert {item["status"] for item in due} == {"pending"}
+    assert {item["attempts"] for item in due} == {0}
+    assert storage.count_pending_notifications() == 300
+    assert storage.get_due_notifications(limit=7) == due[:7]
+    # Курсор канала встает на последнее сообщение альбома
+    assert storage.get_last_message_id("a") == 12
+
+
+def test_save_without_recipients_moves_cursor(storage):
+    _save(storage, "a", _message(3), chat_ids=[])
+    assert storage.get_last_message_id("a") == 3
+    assert storage.count_pending_notifications() == 0
+    assert storage.get_statistics()["total_messages"] == 1
+
+
+def test_duplicate_post_is_rejected_atomically(storage):
+    _save(storage, "a", _message(1), chat_ids=[1, 2])
+    storage.set_last_message_id("a", 1)
+    result = storage.save_processed_message(
+        "a", _message(1, last_id=5), _analysis(), "Еще раз", [3]
+    )
+    assert result is None
+    # Транзакция откатилась целиком: ни уведомления, ни сдвига курсора
+    assert storage.count_pending_notifications() == 2
+    assert storage.get_last_message_id("a") == 1
+
+
+def test_outbox_state_transitions(storage):
+    _save(storage, "a", _message(1), chat_ids=[1, 2, 3, 4], text="Пост 1")
+    sent, retried, dead, flood = [
+        item["id"] for item in storage.get_due_notifications()
+    ]
+
+    assert storage.mark_notification_sent(sent, sent_message_id=501)
+    later = time.time() + 3600
+    storage.reschedule_notification(retried, later, "timeout")
+    storage.reschedule_notification(
+        flood, time.time() - 1, "flood", count_attempt=False
+    )
+    storage.mark_notification_dead(dead, "blocked")
+
+    due = storage.get_due_notifications()
+    assert [(item["id"], item["attempts"]) for item in due] == [(flood, 0)]
+    assert storage.count_pending_notifications() == 2
+    assert abs(storage.get_next_notification_time() - (time.time() - 1)) < 5
+
+    # Правка поста: отправленное уведомление встает в очередь на редактирование
+    edits = storage.save_edited_analysis(
+        "a",
+        1,
+        "Исправленный текст",
+        _date(),
+        _analysis("Позитивная"),
+        "Пост 1 (правка)",
+    )
+    assert edits == 1
+    due = {item["id"]: item for item in storage.get_due_notifications()}
+    assert set(due) == {sent, flood}
+    assert due[sent]["status"] == "edit"
+    assert due[sent]["sent_message_id"] == 501
+    assert due[sent]["attempts"] == 0
+    assert due[flood]["text"] == "Пост 1 (правка)"
+    assert storage.get_message_text("a", 1) == "Исправленный текст"
+
+    # Неудачная правка закрывается без потери ID отправленного сообщения
+    assert storage.mark_notification_sent(sent, error="message is not modified")
+    assert storage.mark_notification_sent(flood, sent_message_id=502)
+    storage.reschedule_notification(retried, time.time() - 1, "timeout")
+    due = storage.get_due_notifications()
+    # Каждый перенос с count_attempt засчитывает попытку
+    assert [(item["id"], item["attempts"]) for item in due] == [(retried, 2)]
+
+    # Очистка удаляет только доставленные; dead и ожидающие остаются
+    storage.purge_sent_notifications(-1)
+    assert [item["id"] for item in storage.get_due_notifications()] == [retried]
+    assert storage.count_pending_notifications() == 1
+    assert (
+        storage.save_edited_analysis(
+            "a", 1, "Еще правка", _date(), _analysis(), "Пост 1 (вторая правка)"
+        )
+        == 0
+    )
+
+
+def test_edit_tracking(storage):
+    _save(storage, "a", _message(1, text="Исходный текст"))
+    _save(storage, "a", _message(2))
+    assert storage.get_edit_candidates("a", [1, 3]) == {
+        1: {"message_id": 1, "text": "Исходный текст", "edited_at": None}
+    }
+    edited_at = _date()
+    storage.mark_message_edited("a", 1, edited_at)
+    assert storage.get_edit_candidates("a", [1])[1]["edited_at"] == edited_at
+    assert storage.get_edit_candidates("b", [1]) == {}
+
+
+# --- Архив ---
+
+
+def test_trend_history(storage):
+    assert storage.get_trend_history(3600) == []
+    _save(storage, "a", _message(1, days_ago=0.01), _analysis(hashtags=["#рынки"]))
+    _save(storage, "a", _message(2, days_ago=3))
+
+    rows = storage.get_trend_history(86400)
+    assert [row["hashtags"] for row in rows] == [["#рынки"]]
+    assert rows[0]["summary"] == "Кратко о посте"
+
+
+def test_trend_history_failure_is_none(tmp_path, archive_dir):
+    from data_manager import DataManager
+
+    storage = DataManager(str(tmp_path / "newsbot.db"))
+    # Ошибка базы отличается от пустой истории: счетчики трендов не сбрасываются
+    storage.conn.close()
+    assert storage.get_trend_history(3600) is None
+
+
+def test_archive_and_get_message_text(storage):
+    _save(storage, "a", _message(1, text="Старый пост про рынок", days_ago=90))
+    _save(storage, "b", _message(1, text="Старый пост другого канала", days_ago=40))
+    _save(storage, "a", _message(2, text="Свежий пост", days_ago=1))
+
+    assert storage.archive_old_messages(30, limit=1) == 1
+    assert storage.archive_old_messages(30) == 1
+    assert storage.archive_old_messages(30) == 0
+
+    assert storage.get_message_text("a", 1) == "Старый пост про рынок"
+    assert storage.get_message_text("b", 1) == "Старый пост другого канала"
+    assert storage.get_message_text("a", 2) == "Свежий пост"
+    assert storage.get_message_text("a", 3) is None
+    # Для проверки правок архивный текст недоступен, анализ остается
+    assert storage.get_edit_candidates("a", [1])[1]["text"] is None
+    assert storage.get_statistics()["total_messages"] == 3
+
+
+# --- Выгрузка ---
+
+
+def _export_fixture(storage):
+    _save(storage, "a", _message(1, days_ago=60), _analysis("Позитивная", ["#рынки"]))
+    _save(storage, "a", _message(2, days_ago=3), _analysis("Негативная", ["#политика"]))
+    _save(
+        storage,
+        "b",
+        _message(1, days_ago=2),
+        _analysis("Нейтральная", ["#рынки", "#технологии"], degraded=True),
+    )
+    _save(storage, "b", _message(2, days_ago=1), _analysis("Позитивная", []))
+    storage.archive_old_messages(30)
+
+
+def _keys(rows):
+    return [(row["channel_id"], row["message_id"]) for row in rows]
+
+
+def test_iter_export_rows(storage):
+    _export_fixture(storage)
+
+    rows = list(storage.iter_export_rows(batch_size=1))
+    # По дате, затем по каналу и ID; архивный текст подставляется
+    assert _keys(rows) == [("a", 1), ("a", 2), ("b", 1), ("b", 2)]
+    assert rows[0]["text"] == "Текст поста 1"
+    assert rows[0]["hashtags"] == ["#рынки"]
+    assert rows[2]["degraded"] is True and rows[0]["degraded"] is False
+    assert rows[3]["hashtags"] == []
+    assert {
+        "channel_id",
+        "message_id",
+        "date",
+        "text",
+        "summary",
+        "sentiment",
+        "hashtags",
+        "degraded",
+        "model",
+        "prompt_version",
+        "analysis_date",
+    } <= set(rows[0])
+
+
+def test_iter_export_rows_filters(storage):
+    _export_fixture(storage)
+
+    def export(**filters):
+        return _keys(storage.iter_export_rows(batch_size=2, **filters))
+
+    assert export(date_from=_date(10)) == [("a", 2), ("b", 1), ("b", 2)]
+    assert export(date_to=_date(2.5)) == [("a", 1), ("a", 2)]
+    assert export(channels=["b"]) == [("b", 1), ("b", 2)]
+    assert export(sentiments=["Позитивная"]) == [("a", 1), ("b", 2)]
+    assert export(tags=["#рынки"]) == [("a", 1), ("b", 1)]
+    assert export(tags=["#технологии", "#политика"]) == [("a", 2), ("b", 1)]
+    assert export(channels=["a"], tags=["#рынки"], date_from=_date(10)) == []
+    assert export(channels=["c"]) == []
+
+
+def test_iter_export_rows_is_a_snapshot(storage):
+    _save(storage, "a", _message(1))
+    _save(storage, "a", _message(2))
+    rows = storage.iter_export_rows(batch_size=1)
+    first = next(rows)
+    # Запись во время выгрузки не попадает в уже начатый снимок
+    _save(storage, "a", _message(3))
+    assert _keys([first, *rows]) == [("a", 1), ("a", 2)]
+    assert len(list(storage.iter_export_rows())) == 3
+
+
+# --- Асинхронный доступ ---
+
+
+def test_aio_returns_same_results(storage):
+    async def scenario():
+        analysis_id = await storage.aio.save_processed_message(
+            "a", _message(1), _analysis(), "Уведомление", [1, 2]
+        )
+        due = await storage.aio.get_due_notifications()
+        await storage.aio.set_last_message_id("a", 7)
+        return analysis_id, due, await storage.aio.get_last_message_id("a")
+
+    analysis_id, due, last_id = asyncio.run(scenario())
+    assert analysis_id is not None
+    assert [item["chat_id"] for item in due] == [1, 2]
+    assert last_id == 7
+    assert storage.count_pending_notifications() == 2
@@ -0,0 +1,255 @@
+# trend_detector.py
+import asyncio
+import math
+import re
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+from logger import get_logger
+import config
+import metrics
+
+logger = get_logger()
+
+TRENDING_TOPICS = metrics.Gauge(
+    "newsbot_trending_topics", "Темы, резко участившиеся за окно трендов", ["kind"]
+)
+
+KIND_HASHTAG = "hashtag"
+KIND_TERM = "term"
+
+_WORD_RE = re.compile(r"[^\W\d_]{4,}")
+# Частые слова пересказов, которые не являются темой
+_STOP_WORDS = frozenset(
+    """
+    этот этого этой этом эти этих также которые который которая которых
+    после более менее может могут будет будут было были быть когда чтобы
+    свой своих своей очень однако сообщил сообщает сообщили заявил
+    заявила заявили году года время всего всех сейчас новости новость против
+    """.split()
+)
+
+
+def story_terms(summary: str) -> set:
+    """Слова пересказа, по которым отслеживаются сюжеты (без повторов)."""
+    return {
+        word for word in _WORD_RE.findall(summary.lower()) if word not in _STOP_WORDS
+    }
+
+
+def _timestamp(iso_date: str) -> Optional[float]:
+    try:
+        date = datetime.fromisoformat(iso_date)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+class _Series:
+    """Кольцевой буфер счетчиков по временным корзинам для одной темы."""
+
+    __slots__ = ("counts", "last")
+
+    def __init__(self, size: int):
+        self.counts = array("I", bytes(4 * size))
+        self.last: Optional[int] = None
+
+    def advance(self, bucket: int):
+        """Обнуляет корзины, вышедшие из буфера с момента прошлого обновления."""
+        if self.last is not None and bucket > self.last:
+            size = len(self.counts)
+            if bucket - self.last >= size:
+                self.counts = array("I", bytes(4 * size))
+            else:
+                for b in range(self.last + 1, bucket + 1):
+                    self.counts[b % size] = 0
+        if self.last is None or bucket > self.last:
+            self.last = bucket
+
+    def total(self, start: int, end: int) -> int:
+        """Сумма корзин [start, end]."""
+        size = len(self.counts)
+        return sum(self.counts[b % size] for b in range(start, end + 1))
+
+
+class TrendDetector:
+    """
+    Скользящие счетчики хэштегов и слов пересказов для поиска трендов.
+
+    Время делится на корзины по TRENDS_BUCKET_SECONDS; для каждой темы
+    хранится кольцевой буфер на окно трендов плюс базовый период. Тема
+    считается трендом, если число постов за последнее окно сильно
+    превышает обычное для нее число за такое же окно в базовом периоде
+    (z-оценка). Обновление - O(1) на тему поста (с учетом ленивого
+    обнуления корзин), запросы не обращаются к базе.
+    """
+
+    def __init__(
+        self,
+        bucket_seconds: float = config.TRENDS_BUCKET_SECONDS,
+        window_seconds: float = config.TRENDS_WINDOW_SECONDS,
+        baseline_hours: float = config.TRENDS_BASELINE_HOURS,
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = max(int(window_seconds // bucket_seconds), 1)
+        # Базовый период делится на целое число окон
+        self.baseline_windows = max(
+            int(baseline_hours * 3600 // (self.window_buckets * bucket_seconds)), 1
+        )
+        self.size = self.window_buckets * (self.baseline_windows + 1)
+        self._series: Dict[str, Dict[str, _Series]] = {
+            KIND_HASHTAG: {},
+            KIND_TERM: {},
+        }
+        # Хэштег -> время последнего оповещения о нем
+        self._alerted: Dict[str, float] = {}
+        self._current: Optional[int] = None
+
+    @property
+    def history_seconds(self) -> float:
+        return self.size * self.bucket_seconds
+
+    def _bucket(self, timestamp: float) -> int:
+        return int(timestamp // self.bucket_seconds)
+
+    def _prune(self, current: int):
+        """Удаляет темы без постов за весь буфер: все их корзины устарели."""
+        for series_by_topic in self._series.values():
+            stale = [
+                topic
+                for topic, series in series_by_topic.items()
+                if series.last <= current - self.size
+            ]
+            for topic in stale:
+                del series_by_topic[topic]
+
+    def _add(self, kind: str, key: str, bucket: int, current: int):
+        series = self._series[kind].get(key)
+        if series is None:
+            series = self._series[kind][key] = _Series(self.size)
+        series.advance(current)
+        series.counts[bucket % self.size] += 1
+
+    def add(
+        self,
+        date: str,
+        hashtags: Iterable[str],
+        summary: str = "",
+        now: Optional[float] = None,
+    ):
+        """Учитывает проанализированный пост с датой публикации date (ISO)."""
+        now = time.time() if now is None else now
+        current = self._bucket(now)
+        if current != self._current:
+            # Раз в корзину: проход только по словарям тем, без их буферов
+            self._prune(current)
+            self._current = current
+        timestamp = _timestamp(date)
+        # Пост без даты или из будущего (расхождение часов) - в текущую корзину
+        bucket = current if timestamp is None else min(self._bucket(timestamp), current)
+        if bucket <= current - self.size:
+            return
+        for tag in set(hashtags):
+            self._add(KIND_HASHTAG, tag, bucket, current)
+        for term in story_terms(summary or ""):
+            self._add(KIND_TERM, term, bucket, current)
+
+    async def load(self, data_manager) -> bool:
+        """
+        Восстанавливает счетчики по анализам из базы за период буфера.
+        Счетчики строятся заново, поэтому load можно вызывать повторно.
+        Если база недоступна, текущие счетчики остаются как есть и
+        возвращается False.
+        """
+        rows = await data_manager.aio.get_trend_history(self.history_seconds)
+        if rows is None:
+            logger.warning(
+                "История трендов не загружена, счетчики оставлены без изменений."
+            )
+            return False
+        self._restore(rows)
+        return True
+
+    def _restore(self, rows: List[Dict[str, Any]]):
+        self._series = {KIND_HASHTAG: {}, KIND_TERM: {}}
+        self._current = None
+        now = time.time()
+        for row in rows:
+            self.add(row["date"], row["hashtags"], row["summary"], now=now)
+        logger.info(
+            f"Счетчики трендов восстановлены по {len(rows)} анализам: "
+            f"{len(self._series[KIND_HASHTAG])} хэштегов, "
+            f"{len(self._series[KIND_TERM])} слов."
+        )
+
+    def _score(self, series: _Series, current: int, count: int) -> Dict[str, float]:
+        w = self.window_buckets
+        baseline = [
+            series.total(current - (k + 1) * w + 1, current - k * w)
+            for k in range(1, self.baseline_windows + 1)
+        ]
+        mean = sum(baseline) / len(baseline)
+        std = math.sqrt(sum((x - mean) ** 2 for x in baseline) / len(baseline))
+        # Для редких тем разброс по истории почти нулевой: снизу ограничиваем
+        # его пуассоновским sqrt(mean) и единицей, иначе любой пост - "всплеск"
+        sigma = max(std, math.sqrt(mean), 1.0)
+        return {"count": count, "baseline": mean, "z": (count - mean) / sigma}
+
+    def trends(
+        self,
+        kind: str = KIND_HASHTAG,
+        limit: int = 10,
+        now: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Темы, резко участившиеся за последнее окно, по убыванию z-оценки:
+        [{"topic", "count", "baseline", "z"}].
+        """
+        current = self._bucket(time.time() if now is None else now)
+        result = []
+        for topic, series in self._series[kind].items():
+            series.advance(current)
+            count = series.total(current - self.window_buckets + 1, current)
+            # Базовый период считается только для тем, заметных в окне
+            if count < config.TRENDS_MIN_COUNT:
+                continue
+            score = self._score(series, current, count)
+            if score["z"] >= config.TRENDS_Z_THRESHOLD:
+                result.append({"topic": topic, **score})
+        result.sort(key=lambda item: (item["z"], item["count"]), reverse=True)
+        TRENDING_TOPICS.set(len(result), kind)
+        return result[:limit]
+
+    async def run_reload(self, data_manager):
+        """
+        Перезагружает счетчики из базы раз в корзину. Нужно процессу с
+        APP_ROLE=bot: посты анализирует процесс мониторинга, и без
+        перезагрузки /trends показывал бы состояние на момент запуска.
+        """
+        while True:
+            await asyncio.sleep(self.bucket_seconds)
+            try:
+                await self.load(data_manager)
+            except Exception as e:
+                logger.error(f"Ошибка при перезагрузке трендов: {e}", exc_info=True)
+
+    def pop_alerts(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Тренды-хэштеги, о которых еще не оповещали в течение
+        TRENDS_ALERT_COOLDOWN_SECONDS.
+        """
+        now = time.time() if now is None else now
+        cooldown = config.TRENDS_ALERT_COOLDOWN_SECONDS
+        self._alerted = {
+            topic: at for topic, at in self._alerted.items() if now - at < cooldown
+        }
+        alerts = []
+        for trend in self.trends(KIND_HASHTAG, limit=config.TRENDS_ALERT_MAX, now=now):
+            if trend["topic"] in self._alerted:
+                continue
+            self._alerted[trend["topic"]] = now
+            alerts.append(trend)
+        return alerts
@@ -0,0 +1,163 @@
+# webhook_server.py
+import asyncio
+import hmac
+from typing import Optional, Set
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from pydantic import ValidationError
+from logger import get_logger
+import config
+import metrics
+
+logger = get_logger()
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+WEBHOOK_UPDATES = metrics.Counter(
+    "newsbot_webhook_updates_total",
+    "Обновления, полученные через вебхук, по результату",
+    ["result"],
+)
+WEBHOOK_IN_FLIGHT = metrics.Gauge(
+    "newsbot_webhook_updates_in_flight", "Обновления вебхука в обработке"
+)
+WEBHOOK_UPDATE_SECONDS = metrics.Histogram(
+    "newsbot_webhook_update_seconds", "Время обработки одного обновления вебхука"
+)
+
+
+class WebhookServer:
+    """
+    Прием обновлений Telegram через вебхук вместо long polling.
+
+    Запрос проверяется по секретному токену из заголовка, обновление
+    передается в dispatcher отдельной задачей, и Telegram сразу получает
+    ответ 200. Одновременно обрабатывается не больше max_concurrent
+    обновлений: следующий запрос ждет свободного места, не отвечая, и этим
+    притормаживает отправку новых обновлений со стороны Telegram.
+
+    При остановке новые обновления получают 503 (Telegram повторит их
+    позже, в том числе через другой процесс за тем же адресом), а начатые
+    дорабатываются в пределах drain_timeout.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        path: str = config.WEBHOOK_PATH,
+        secret: str = config.WEBHOOK_SECRET,
+        max_concurrent: int = config.WEBHOOK_MAX_CONCURRENT_UPDATES,
+        drain_timeout: float = config.WEBHOOK_DRAIN_TIMEOUT_SECONDS,
+    ):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret = secret.encode()
+        self.drain_timeout = drain_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._tasks: Set[asyncio.Task] = set()
+        self._draining = False
+        self._runner: Optional[web.AppRunner] = None
+
+    def _authorized(self, request: web.Request) -> bool:
+        token = request.headers.get(SECRET_HEADER, "").encode("utf-8", "replace")
+        return hmac.compare_digest(token, self.secret)
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            WEBHOOK_UPDATES.inc("unauthorized")
+            return web.Response(status=401)
+        if self._draining:
+            WEBHOOK_UPDATES.inc("draining")
+            return web.Response(status=503)
+        try:
+            update = types.Update.model_validate(
+                await request.json(), context={"bot": self.bot}
+            )
+        except (ValueError, ValidationError) as e:
+            WEBHOOK_UPDATES.inc("invalid")
+            logger.warning(f"Некорректное обновление в вебхуке: {e}")
+            return web.Response(status=400)
+
+        await self._semaphore.acquire()
+        if self._draining:
+            self._semaphore.release()
+            WEBHOOK_UPDATES.inc("draining")
+            return web.Response(status=503)
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: types.Update):
+        WEBHOOK_IN_FLIGHT.inc()
+        try:
+            with WEBHOOK_UPDATE_SECONDS.time():
+                await self.dispatcher.feed_update(self.bot, update)
+            WEBHOOK_UPDATES.inc("handled")
+        except Exception as e:
+            WEBHOOK_UPDATES.inc("error")
+            logger.error(
+                f"Ошибка при обработке обновления {update.update_id}: {e}",
+                exc_info=True,
+            )
+        finally:
+            WEBHOOK_IN_FLIGHT.dec()
+            self._semaphore.release()
+
+    async def start(
+        self,
+        host: str = config.WEBHOOK_HOST,
+        port: int = config.WEBHOOK_PORT,
+        reuse_port: bool = config.WEBHOOK_REUSE_PORT,
+    ):
+        """
+        Запускает HTTP-сервер в текущем event loop. С reuse_port несколько
+        процессов бота слушают один порт, и ядро распределяет соединения
+        между ними.
+        """
+        await self.dispatcher.emit_startup(bot=self.bot)
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(
+            self._runner, host, port, reuse_port=reuse_port or None
+        ).start()
+        logger.info(f"Вебхук слушает http://{host}:{port}{self.path}")
+
+    async def register(self, url: str = config.WEBHOOK_URL):
+        """Сообщает Telegram адрес вебхука и секретный токен."""
+        await self.bot.set_webhook(
+            url.rstrip("/") + self.path,
+            secret_token=self.secret.decode(),
+            allowed_updates=self.dispatcher.resolve_used_update_types(),
+        )
+        logger.info(f"Вебхук зарегистрирован в Telegram: {url}")
+
+    async def run(self):
+        """Запускает сервер и работает до отмены задачи."""
+        await self.start()
+        if config.WEBHOOK_URL:
+            await self.register()
+        await asyncio.Event().wait()
+
+    async def stop(self):
+        """Перестает принимать обновления и дожидается начатых."""
+        self._draining = True
+        if self._tasks:
+            logger.info(f"Ожидание обработки {len(self._tasks)} обновлений вебхука...")
+            _, pending = await asyncio.wait(self._tasks, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                logger.warning(
+                    f"Не дождались {len(pending)} обновлений за "
+                    f"{self.drain_timeout} с, они прерваны."
+                )
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.dispatcher.emit_shutdown(bot=self.bot)